@@ -28,7 +28,6 @@ import sys
 import traceback
 
 import ujson as json
-from io import BytesIO
 from collections import Counter, defaultdict
 from random import choice, sample, seed
 
@@ -42,6 +41,8 @@ from discord.ext import commands
 from pyhtml import server
 import cogs
 from cogs.utils import db, data
+from cogs.utils.scheduler import Scheduler
+from cogs.utils.webhooks import AttachmentRelay, WebhookPool
 from cogs.utils.translation import _
 
 try:
@@ -61,6 +62,7 @@ class Bot(commands.AutoShardedBot):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, game=discord.Game(name="rp!help for help!"), **kwargs)
         self.prefixes = {}
+        self.prefix_cache = {}
         self.owner_id = 122739797646245899
         self.lounge_id = 166349353999532035
         self.uptime = datetime.datetime.utcnow()
@@ -70,6 +72,8 @@ class Bot(commands.AutoShardedBot):
         self.shutdowns = []
         self.lotteries = dict()
         self.in_character = defaultdict(lambda: defaultdict(str))
+        self.webhooks = WebhookPool(self)
+        self.scheduler = Scheduler(self)
 
         self.logger = logging.getLogger('discord')  # Discord Logging
         self.logger.setLevel(logging.INFO)
@@ -79,6 +83,7 @@ class Bot(commands.AutoShardedBot):
         self.logger.addHandler(self.handler)
 
         self.session = aiohttp.ClientSession(loop=self.loop)
+        self.attachments = AttachmentRelay(self.session)
         self.shutdowns.append(self.shutdown)
 
         with open("resources/auth") as af:
@@ -100,7 +105,9 @@ class Bot(commands.AutoShardedBot):
             self.httpserver = server.API(self)
             self.loop.create_task(self.httpserver.host())
 
-        self.db: db.Database = db.Database(self)
+        dbconfig = db.load_config()
+        self.db: db.Database = db.Database(self, write_behind=dbconfig.get("write_behind", False),
+                                           group_commit=dbconfig.get("group_commit", False))
         self.di: data.DataInteraction = data.DataInteraction(self)
         self.default_udata = data.default_user
         self.default_servdata = data.default_server
@@ -114,7 +121,7 @@ class Bot(commands.AutoShardedBot):
         self.languages = ["en", "fr", "de", "ru", "es"]
 
         with open("resources/blacklist.json") as blf:
-            self.blacklist = json.loads(blf.read())
+            self.blacklist = set(json.loads(blf.read()))
 
         with open("savedata/prefixes.json") as prf:
             self.prefixes = json.loads(prf.read())
@@ -154,47 +161,79 @@ class Bot(commands.AutoShardedBot):
         print('------')
         if self._first:
             self.loop.create_task(self.update_stats())
+            # The database connects in the background, so its workers wait for it
+            self.loop.create_task(self.db.run_workers())
+            self.loop.create_task(self.scheduler.run())
             self._first = False
 
+    def get_prefixes(self, guild_id=None):
+        """The prefixes a command in a server (or in DMs if None) can start with, as a tuple for str.startswith"""
+        cached = self.prefix_cache.get(guild_id)
+        if cached is None:
+            if "debug" in sys.argv:
+                cached = ("rp$",)
+            else:
+                custom = self.prefixes.get(str(guild_id), []) if guild_id is not None else []
+                cached = tuple(prefixes) + ((custom,) if isinstance(custom, str) else tuple(custom))
+            self.prefix_cache[guild_id] = cached
+        return cached
+
+    def set_prefix(self, guild_id, prefix):
+        self.prefixes[str(guild_id)] = prefix
+        self.prefix_cache.pop(guild_id, None)
+
     async def on_message(self, msg):
-        if msg.author.id not in self.blacklist:
-            """
-            if False and msg.guild:
-                prefixes = await self.di.get_cmd_prefixes(msg.guild)
-                for cmd, prefix in prefixes.items():
-                    if msg.content.startswith(prefix):
-                        msg.content = msg.content.replace(prefix, "rp!" + (cmd.replace(".", " ")) + " ", 1)
-                        break
-            """
-
-            ctx = await self.get_context(msg)
-            await self.invoke(ctx)
-
-            if ctx.command is None and ctx.guild:
-                if ctx.guild.id in self.in_character:
-                    if ctx.author.id in self.in_character[ctx.guild.id]:
-                        char = self.in_character[ctx.guild.id][ctx.author.id]
-                        hooks = await ctx.guild.webhooks()
-                        hook = discord.utils.get(hooks, name=char)
-                        if hook is None:
-                            # await ctx.send(await _(ctx, "Webhook missing!"))
-                            del self.in_character[ctx.guild.id][ctx.author.id]
-                            return
-                        content = msg.content
-                        files = msg.attachments
-                        dfiles = []
-                        for f in files:
-                            dio = BytesIO()
-                            await f.save(dio)
-                            dfiles.append(discord.File(dio, f.filename, spoiler=f.is_spoiler()))
-                        embeds = msg.embeds
-                        if hook.channel.id != msg.channel.id:
-                            await hook.delete()
-                            hook = await msg.channel.create_webhook(name=char)
-                        await msg.delete()
-                        url = (await self.di.get_character(ctx.guild, char)).meta.get("icon")
-                        await hook.send(content, avatar_url=url,
-                                        files=dfiles, embeds=embeds)
+        # Chat far outnumbers commands, so anything that can't be a command or a proxied message
+        # is turned away before a context is built for it
+        if msg.author.id in self.blacklist:
+            return
+        guild_id = msg.guild.id if msg.guild else None
+        character = self.in_character.get(guild_id, {}).get(msg.author.id) if guild_id is not None else None
+        if not character and not msg.content.startswith(self.get_prefixes(guild_id)):
+            return
+
+        """
+        if False and msg.guild:
+            prefixes = await self.di.get_cmd_prefixes(msg.guild)
+            for cmd, prefix in prefixes.items():
+                if msg.content.startswith(prefix):
+                    msg.content = msg.content.replace(prefix, "rp!" + (cmd.replace(".", " ")) + " ", 1)
+                    break
+        """
+
+        ctx = await self.get_context(msg)
+        await self.invoke(ctx)
+
+        if ctx.command is None and character:
+            char = await self.di.get_character(ctx.guild, character)
+            if char is None:
+                # await ctx.send(await _(ctx, "Character missing!"))
+                self.in_character[ctx.guild.id].pop(ctx.author.id, None)
+                return
+            content = msg.content
+            dfiles = await self.attachments.fetch(msg.attachments, ctx.guild.filesize_limit)
+            if dfiles is None:
+                # Too big to upload again, leave the original message where it is
+                return
+            embeds = msg.embeds
+            try:
+                await msg.delete()
+                await self.webhooks.send(msg.channel, content, username=char.name, avatar_url=char.meta.get("icon"),
+                                         files=dfiles, embeds=embeds)
+            finally:
+                self.attachments.close(dfiles)
+
+    async def get_context(self, message, *, cls=data.Context):
+        return await super().get_context(message, cls=cls)
+
+    async def invoke(self, ctx):
+        token = db.current_snapshot.set(getattr(ctx, "snapshot", None))
+        try:
+            if ctx.guild is not None:
+                await self.db.touch(ctx.guild)
+            await super().invoke(ctx)
+        finally:
+            db.current_snapshot.reset(token)
 
     async def update_stats(self):
         url = "https://bots.discord.pw/api/bots/{}/stats".format(self.user.id)
@@ -247,19 +286,23 @@ class Bot(commands.AutoShardedBot):
                     add += values.get(fpn, 0)
 
                 if add:
-                    await asyncio.sleep(4)
-                    r = await self.di.add_exp(ctx.author, add)
-                    if r is not None:
-                        await ctx.message.add_reaction("\u23EB")
+                    self.db.exp.add(ctx.author, add, ctx.message)
             time = await self.di.get_delete_time(ctx.guild)
             if time:
-                await asyncio.sleep(time)
-                await ctx.message.delete()
+                self.scheduler.delete_later(ctx.message, time)
+
+    async def on_level_up(self, message, level):
+        try:
+            await message.add_reaction("\u23EB")
+        except discord.HTTPException:
+            pass
 
     async def on_member_join(self, member):
+        amount = await self.di.get_guild_start(member.guild)
+        if await self.db.add_user(member, dict(self.default_udata, money=amount)):
+            return
         if await self.di.get_balance(member) != 0:
             return
-        amount = await self.di.get_guild_start(member.guild)
         if amount:
             await self.di.set_eco(member, amount)
 
@@ -289,9 +332,14 @@ class Bot(commands.AutoShardedBot):
     async def on_guild_join(self, guild):
         if guild.id in self.blacklist:
             await guild.leave()
+        else:
+            await self.db.touch(guild)
 
         self.stats.increment("RPGBot.guilds", tags=["RPGBot:guilds"], host="scw-8112e8")
 
+    async def on_webhooks_update(self, channel):
+        self.webhooks.invalidate(channel.id)
+
     async def on_guild_leave(self, guild):
         self.stats.increment("RPGBot.guilds", -1, tags=["RPGBot:guilds"], host="scw-8112e8")
 
@@ -359,6 +407,8 @@ class Bot(commands.AutoShardedBot):
         with open("savedata/prefixes.json", 'w') as prf:
             json.dump(self.prefixes, prf)
 
+        await self.db.flush()
+        await self.db.flush_activity()
         await self.session.close()
 
 
@@ -387,17 +437,7 @@ with open("resources/auth") as af:
 
 
 async def prefix(bot, msg):
-    if "debug" in sys.argv:
-        return ["rp$"]
-    if msg.guild:
-        # prefix = await bot.db.guild_item(msg.guild, "prefix")
-        prefix = bot.prefixes.get(str(msg.guild.id), [])
-        if isinstance(prefix, str):
-            return prefixes + [prefix]
-        else:
-            return prefixes + prefix
-    else:
-        return prefixes
+    return bot.get_prefixes(msg.guild.id if msg.guild else None)
 
 
 """
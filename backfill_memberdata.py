@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+# Copyright (c) 2016-2017, henry232323
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.  IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+"""Move every user's data out of the legacy userdata table into one memberdata row per server,
+then seed the balances table from it.
+Safe to run while the bot is up and to run again, entries already moved are left alone.
+Usage: python3 backfill_memberdata.py [batch size]"""
+
+import sys
+import asyncio
+
+from cogs.utils.db import Database
+
+
+async def main(batch_size):
+    db = Database(None)
+    await db.connect()
+    users = moved = 0
+    async for read, count in db.backfill_memberdata(batch_size):
+        users += read
+        moved += count
+        print(f"Read {users} users, moved {moved} server entries")
+    entries = seeded = 0
+    async for read, count in db.backfill_balances(batch_size):
+        entries += read
+        seeded += count
+        print(f"Read {entries} server entries, seeded {seeded} balances")
+    await db._conn.close()
+
+
+if __name__ == "__main__":
+    asyncio.get_event_loop().run_until_complete(main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000))
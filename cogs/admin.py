@@ -124,6 +124,18 @@ class Admin(commands.Cog):
 
         await ctx.message.channel.purge(limit=number)
 
+    @commands.command(hidden=True)
+    @commands.is_owner()
+    async def archived(self, ctx, count: int = 10):
+        """Report the servers whose data has been archived, most recent first"""
+        total, size, recent = await self.bot.db.get_archive_report(count)
+        archiver = self.bot.db.archiver
+        lines = [f"{total} servers archived, {size} bytes packed",
+                 f"This session: {archiver.archived['left']} left, {archiver.archived['inactive']} inactive "
+                 f"(after {archiver.inactive_days} days)"]
+        lines.extend(f"{guild_id}: {reason}, {size} bytes, {archived}" for guild_id, reason, size, archived in recent)
+        await ctx.send("```\n{}\n```".format("\n".join(lines)))
+
     @commands.command(hidden=True)
     @commands.is_owner()
     async def logout(self, ctx):
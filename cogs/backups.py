@@ -175,7 +175,7 @@ class Backups(commands.Cog):
     @checks.mod_or_permissions()
     async def export(self, ctx, subsection: str = None):
         """Export a server's data"""
-        data = await self.bot.db.get_guild_data(ctx.guild)
+        data = await self.bot.db.get_full_guild_data(ctx.guild) or await self.bot.db.get_guild_data(ctx.guild)
         if subsection is not None and subsection not in data:
             await ctx.send((await _(ctx,
                                     "{} is not a valid subsection! Try providing no subsection and see the available keys")).format(
@@ -24,7 +24,6 @@ import discord
 from discord.ext import commands
 
 from random import randint
-import asyncio
 
 from .utils import checks
 from .utils.data import Character, NumberConverter, IntConverter, chunkn
@@ -34,6 +33,8 @@ from .utils.translation import _
 class Characters(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
+        self.expiries = {}
+        self.bot.scheduler.register("unassume", self.expire, restore=self.restore)
 
     def cog_check(self, ctx):
         def predicate(ctx):
@@ -48,8 +49,7 @@ class Characters(commands.Cog):
         """List all characters of the user. If no user is given lists your own characters."""
         if user is None:
             user = ctx.author
-        characters = await self.bot.di.get_guild_characters(ctx.guild)
-        characters = [x for x, y in characters.items() if y.owner == user.id]
+        characters = list(await self.bot.di.get_guild_characters(ctx.guild, owner=user.id))
         if not characters:
             await ctx.send((await _(ctx, "{} has no characters to display")).format(user))
             return
@@ -59,16 +59,17 @@ class Characters(commands.Cog):
         await ctx.send(embed=embed)
 
     @commands.command()
-    async def allchars(self, ctx):
-        """List all guild characters"""
-        characters = await self.bot.di.get_guild_characters(ctx.guild)
+    async def allchars(self, ctx, page: int = 1):
+        """List all guild characters, 200 to a page. Example: rp!allchars 2"""
+        page = max(page, 1)
+        characters = await self.bot.di.get_character_names(ctx.guild, 200, (page - 1) * 200)
         if not characters:
             await ctx.send(await _(ctx, "No characters to display"))
             return
 
         embed = discord.Embed(color=randint(0, 0xFFFFFF), )
         words = dict()
-        for x in characters.keys():
+        for x in characters:
             if x[0].casefold() in words:
                 words[x[0].casefold()].append(x)
             else:
@@ -79,6 +80,8 @@ class Characters(commands.Cog):
                 embed.add_field(name=key.upper(), value="\n".join(value))
 
         embed.set_author(name=ctx.guild.name, icon_url=ctx.guild.icon_url)
+        pages = -(-await self.bot.di.count_characters(ctx.guild) // 200)
+        embed.set_footer(text=(await _(ctx, "Page {} of {}")).format(page, pages))
         await ctx.send(embed=embed)
 
     @commands.group(invoke_without_command=True, aliases=["c", "char", "personnage"])
@@ -161,12 +164,7 @@ class Characters(commands.Cog):
                 await ctx.send(await _(ctx, "Only Bot Mods/Bot Admins may make characters for other players!"))
                 return
 
-        data = await self.bot.db.get_guild_data(ctx.guild)
-        characters = await ctx.bot.di.get_guild_characters(ctx.guild)
-        if "caliases" not in data:
-            data["caliases"] = {}
-        aliases = data["caliases"]
-        if name in characters or name in aliases:
+        if await ctx.bot.di.character_exists(ctx.guild, name):
             await ctx.send(await _(ctx, "A character with this name already exists!"))
             return
 
@@ -227,14 +225,8 @@ class Characters(commands.Cog):
         character["level"] = character["meta"].pop("level", None)
         if (len(ctx.message.mentions) > 0 and ouser is None) or (len(ctx.message.mentions) > 1 and ouser is not None):
             newname = character["name"].replace("!", "")
-            data = await self.bot.db.get_guild_data(ctx.guild)
-            if "caliases" not in data:
-                data["caliases"] = {}
-
-            if newname not in data["characters"]:
-                data["caliases"][newname] = character["name"]
-
-            await self.bot.db.update_guild_data(ctx.guild, data)
+            if not await self.bot.di.character_exists(ctx.guild, newname):
+                await self.bot.di.add_alias(ctx.guild, newname, character["name"])
 
         await self.bot.di.add_character(ctx.guild, Character(**character))
         await ctx.send(
@@ -261,13 +253,10 @@ class Characters(commands.Cog):
 
             else:
 
-                async with self.bot.di.rm.lock(ctx.author.id):
-                    await self.bot.di.remove_character(ctx.guild, name)
+                await self.bot.di.remove_character(ctx.guild, character.name)
                 await ctx.send(await _(ctx, "Character deleted"))
         else:
-
-            async with self.bot.di.rm.lock(ctx.guild.id):
-                await self.bot.di.remove_character(ctx.guild, name)
+            await self.bot.di.remove_character(ctx.guild, character.name)
             await ctx.send(await _(ctx, "Character deleted"))
 
     @character.command()
@@ -331,7 +320,7 @@ class Characters(commands.Cog):
         else:
             character[5][attribute] = value
 
-        async with self.bot.di.rm.lock(ctx.guild.id):
+        async with self.bot.di.rm.lock(ctx.guild.id, label="guild"):
             await self.bot.di.add_character(ctx.guild, Character(*character))
         await ctx.send(await _(ctx, "Character edited!"))
 
@@ -361,23 +350,29 @@ class Characters(commands.Cog):
 
         del character[5][attribute]
 
-        async with self.bot.di.rm.lock(ctx.guild.id):
+        async with self.bot.di.rm.lock(ctx.guild.id, label="guild"):
             await self.bot.di.add_character(ctx.guild, Character(*character))
         await ctx.send(await _(ctx, "Removed attribute!"))
 
-    async def unassume(self, ctx, character, wait=60 * 60 * 24):
+    async def unassume(self, ctx, character):
         author = ctx.author
-        data = await self.bot.db.get_guild_data(ctx.guild)
-        if "caliases" not in data:
-            data["caliases"] = {}
-
-        character = data["caliases"].get(character, character)
-        await asyncio.sleep(wait)
-        if self.bot.in_character[author.guild.id][author.id] != character:
+        character = await self.bot.di.resolve_alias(ctx.guild, character)
+        if self.bot.in_character[author.guild.id].get(author.id) != character:
             return
         del self.bot.in_character[author.guild.id][author.id]
-        hooks = await author.guild.webhooks()
-        await discord.utils.get(hooks, name=character).delete()
+        await self.bot.scheduler.cancel(self.expiries.pop((author.guild.id, author.id), None))
+
+    async def expire(self, payload):
+        """End an assumed character once its day is up"""
+        self.expiries.pop((payload["guild"], payload["user"]), None)
+        if self.bot.in_character[payload["guild"]].get(payload["user"]) == payload["character"]:
+            del self.bot.in_character[payload["guild"]][payload["user"]]
+
+    def restore(self, timer):
+        """Put back a character that was assumed before a restart"""
+        payload = timer.payload
+        self.bot.in_character[payload["guild"]][payload["user"]] = payload["character"]
+        self.expiries[(payload["guild"], payload["user"])] = timer
 
     async def shutdown(self):
         pass
@@ -385,16 +380,11 @@ class Characters(commands.Cog):
     @character.command(aliases=["a"])
     async def assume(self, ctx, name: str):
         """Assume a character. You will send messages with this character's icon and name. Necessary for some character inventory and economy commands. Lasts one day"""
-        data = await self.bot.db.get_guild_data(ctx.guild)
-        if "caliases" not in data:
-            data["caliases"] = {}
-
-        name = data["caliases"].get(name, name)
-
         character = await self.bot.di.get_character(ctx.guild, name)
         if character is None:
             await ctx.send(await _(ctx, "That character doesn't exist!"))
             return
+        name = character.name
 
         try:
             is_mod = checks.role_or_permissions(ctx, lambda r: r.name in ('Bot Mod', 'Bot Admin', 'Bot Moderator'),
@@ -405,20 +395,19 @@ class Characters(commands.Cog):
             await ctx.send(await _(ctx, "You do not own this character!"))
             return
 
+        await self.bot.webhooks.get(ctx.channel)
+        key = ctx.guild.id, ctx.author.id
+        await self.bot.scheduler.cancel(self.expiries.pop(key, None))
         self.bot.in_character[ctx.guild.id][ctx.author.id] = name
-        hooks = await ctx.guild.webhooks()
-        hook = discord.utils.get(hooks, name=name)
-
-        if hook is None:
-            await ctx.channel.create_webhook(name=name)
+        self.expiries[key] = await self.bot.scheduler.schedule(
+            60 * 60 * 24, "unassume", dict(guild=ctx.guild.id, user=ctx.author.id, character=name))
 
         await ctx.send((await _(ctx, "You are now {} for the next 24 hours")).format(name))
-        self.bot.loop.create_task(self.unassume(ctx, name))
 
     @character.command(name="unassume", aliases=["ua"])
     async def c_unassume(self, ctx, character: str):
         """Unassume a character"""
-        await self.unassume(ctx, character, 0)
+        await self.unassume(ctx, character)
         await ctx.send(await _(ctx, "Character unassumed!"))
 
     async def c_inventory(self, guild, name):
@@ -433,7 +422,6 @@ class Characters(commands.Cog):
         dest = ctx.channel
         if name is None:
             name = self.bot.in_character[ctx.guild.id].get(ctx.author.id)
-        gd = await self.bot.db.get_guild_data(ctx.guild)
         try:
             is_mod = checks.role_or_permissions(ctx,
                                                 lambda r: r.name in ('Bot Mod', 'Bot Admin', 'Bot Moderator'),
@@ -441,7 +429,7 @@ class Characters(commands.Cog):
         except:
             is_mod = False
 
-        hide = gd.get("hideinv", False)
+        hide = await self.bot.db.get_section(ctx.guild, "hideinv", False)
 
         if not is_mod and hide:
             name = self.bot.in_character[ctx.guild.id].get(ctx.author.id)
@@ -504,7 +492,7 @@ class Characters(commands.Cog):
     async def takeitem(self, ctx, item: str, num: IntConverter, *names: str):
         """Remove an item from a character's inventory (Moderators)"""
 
-        async with self.bot.di.rm.lock(ctx.guild.id):
+        async with self.bot.di.rm.lock(ctx.guild.id, label="guild"):
             num = abs(num)
             for name in names:
                 await self.c_takeitem(ctx.guild, name, (item, num))
@@ -530,7 +518,7 @@ class Characters(commands.Cog):
         """Give an item to a character (Not out of your inventory) (Moderators)
         Example: rp!ci giveitem Banana 32 Char1 Char2 Char3"""
 
-        async with self.bot.di.rm.lock(ctx.guild.id):
+        async with self.bot.di.rm.lock(ctx.guild.id, label="guild"):
             items = await self.bot.di.get_guild_items(ctx.guild)
             if item not in items:
                 await ctx.send(await _(ctx, "That is not a valid item!"))
@@ -562,7 +550,7 @@ class Characters(commands.Cog):
             split, num = "x".join(split[:-1]), abs(int(split[-1]))
             fitems.append((split, num))
 
-        async with self.bot.di.rm.lock(ctx.guild.id):
+        async with self.bot.di.rm.lock(ctx.guild.id, label="guild"):
             try:
                 await self.c_takeitem(ctx.guild, name, *fitems)
                 await self.c_giveitem(ctx.guild, other, *fitems)
@@ -585,7 +573,7 @@ class Characters(commands.Cog):
             split, num = "x".join(split[:-1]), abs(int(split[-1]))
             fitems.append((split, num))
 
-        async with self.bot.di.rm.lock(ctx.guild.id):
+        async with self.bot.di.rm.lock(ctx.guild.id, label="guild"):
             try:
                 await self.c_takeitem(ctx.guild, name, *fitems)
                 await self.bot.di.give_items(other, *fitems)
@@ -600,7 +588,7 @@ class Characters(commands.Cog):
         If you dont input a number of items you will use one by default.
         """
 
-        async with self.bot.di.rm.lock(ctx.guild.id):
+        async with self.bot.di.rm.lock(ctx.guild.id, label="guild"):
             number = abs(number)
             items = await self.bot.di.get_guild_items(ctx.guild)
             msg = items.get(item).meta.get('used')
@@ -629,7 +617,7 @@ class Characters(commands.Cog):
     async def craft(self, ctx, number: int, *, name: str):
         """Craft a recipe with a given name from the available server recipes; e.g. rp!craft 5 Apple Pie"""
 
-        async with self.bot.di.rm.lock(ctx.guild.id):
+        async with self.bot.di.rm.lock(ctx.guild.id, label="guild"):
             recipes = await ctx.bot.di.get_guild_recipes(ctx.guild)
             recipe = recipes.get(name)
             if recipe is None:
@@ -671,7 +659,6 @@ class Characters(commands.Cog):
         if name is None:
             name = self.bot.in_character[ctx.guild.id].get(ctx.author.id)
 
-        gd = await self.bot.db.get_guild_data(ctx.guild)
         try:
             is_mod = checks.role_or_permissions(ctx,
                                                 lambda r: r.name in ('Bot Mod', 'Bot Admin', 'Bot Moderator'),
@@ -679,7 +666,7 @@ class Characters(commands.Cog):
         except:
             is_mod = False
 
-        hide = gd.get("hideinv", False)
+        hide = await self.bot.db.get_section(ctx.guild, "hideinv", False)
 
         if not is_mod and hide:
             name = self.bot.in_character[ctx.guild.id].get(ctx.author.id)
@@ -734,7 +721,7 @@ Total:\t\t {:.2f} dollars
     async def setbalance(self, ctx, amount: NumberConverter, *names: str):
         """Set the balance of the given members to an amount  (Moderators)"""
 
-        async with self.bot.di.rm.lock(ctx.guild.id):
+        async with self.bot.di.rm.lock(ctx.guild.id, label="guild"):
             for name in names:
                 await self.c_setbalance(ctx.guild, name, amount)
 
@@ -780,7 +767,7 @@ Total:\t\t {:.2f} dollars
     async def givemoney(self, ctx, amount: NumberConverter, *names: str):
         """Give the character's money (Moderators)"""
 
-        async with self.bot.di.rm.lock(ctx.guild.id):
+        async with self.bot.di.rm.lock(ctx.guild.id, label="guild"):
             for name in names:
                 await self.c_addeco(ctx.guild, name, amount)
 
@@ -791,7 +778,7 @@ Total:\t\t {:.2f} dollars
     async def takemoney(self, ctx, amount: NumberConverter, *names: str):
         """Take the character's money (Moderators)"""
 
-        async with self.bot.di.rm.lock(ctx.guild.id):
+        async with self.bot.di.rm.lock(ctx.guild.id, label="guild"):
             succ = False
 
             for name in names:
@@ -808,7 +795,7 @@ Total:\t\t {:.2f} dollars
     async def pay(self, ctx, amount: NumberConverter, other: str):
         """Pay another character money"""
 
-        async with self.bot.di.rm.lock(ctx.guild.id):
+        async with self.bot.di.rm.lock(ctx.guild.id, label="guild"):
             amount = abs(amount)
 
             name = self.bot.in_character[ctx.guild.id].get(ctx.author.id)
@@ -832,25 +819,19 @@ Total:\t\t {:.2f} dollars
         Example: rp!c alias Tom Tom Hanks
         This will make the name Tom point to the name Tom Hanks"""
 
-        async with self.bot.di.rm.lock(ctx.guild.id):
-            data = await self.bot.db.get_guild_data(ctx.guild)
-            if "caliases" not in data:
-                data["caliases"] = {}
-
-            if alias_name in data["characters"]:
-                await ctx.send(await _(ctx, "A character with this name already exists!"))
-                return
-
-            if alias_name in data["caliases"]:
-                await ctx.send(await _(ctx, "An alias with this name already exists!"))
-                return
+        existing = await self.bot.di.get_character(ctx.guild, alias_name)
+        if existing is not None and existing.name == alias_name:
+            await ctx.send(await _(ctx, "A character with this name already exists!"))
+            return
 
-            if character_name not in data["characters"]:
-                await ctx.send((await _(ctx, "Character {0} does not exist!")).format(character_name))
-                return
-            data["caliases"][alias_name] = character_name
+        character = await self.bot.di.get_character(ctx.guild, character_name)
+        if character is None or character.name != character_name:
+            await ctx.send((await _(ctx, "Character {0} does not exist!")).format(character_name))
+            return
 
-            await ctx.bot.db.update_guild_data(ctx.guild, data)
+        if not await self.bot.di.add_alias(ctx.guild, alias_name, character_name):
+            await ctx.send(await _(ctx, "An alias with this name already exists!"))
+            return
         await ctx.send((await _(ctx, "Created a new alias {0} for character {1}")).format(alias_name, character_name))
 
     @character.command()
@@ -859,27 +840,20 @@ Total:\t\t {:.2f} dollars
         Example: rp!c removealias Tom
         Only character owners may remove the aliases of their characters."""
 
-        async with self.bot.di.rm.lock(ctx.guild.id):
-            data = await self.bot.db.get_guild_data(ctx.guild)
-            if "caliases" not in data:
-                data["caliases"] = {}
+        character_name = await self.bot.db.get_alias(ctx.guild, alias_name)
+        if character_name is None:
+            await ctx.send(await _(ctx, "This alias doesn't exist!"))
+            return
 
-            if alias_name not in data["caliases"]:
-                await ctx.send(await _(ctx, "This alias doesn't exist!"))
+        character = await self.bot.di.get_character(ctx.guild, alias_name)
+        if character is not None:
+            if character.owner != ctx.author.id and not checks.role_or_permissions(ctx,
+                                                                                 lambda r: r.name in (
+                                                                                         'Bot Mod', 'Bot Admin',
+                                                                                         'Bot Moderator'),
+                                                                                 manage_server=True):
+                await ctx.send(await _(ctx, "You cannot delete other people's aliases!"))
                 return
 
-            if data["caliases"][alias_name] in data["characters"]:
-
-                if data["characters"][data["caliases"][alias_name]][
-                    1] != ctx.author.id and not checks.role_or_permissions(ctx,
-                                                                          lambda r: r.name in (
-                                                                                  'Bot Mod', 'Bot Admin',
-                                                                                  'Bot Moderator'),
-                                                                          manage_server=True):
-                    await ctx.send(await _(ctx, "You cannot delete other people's aliases!"))
-                    return
-
-            del data["caliases"][alias_name]
-
-            await ctx.bot.db.update_guild_data(ctx.guild, data)
+        await self.bot.di.remove_alias(ctx.guild, alias_name)
         await ctx.send((await _(ctx, "Removed alias {0}")).format(alias_name))
@@ -23,6 +23,7 @@ import asyncio
 from collections import Counter
 from random import choice, randint
 import json
+from types import SimpleNamespace
 from recordclass import recordclass
 
 import discord
@@ -40,7 +41,15 @@ class Economy(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
         self.bids = list()
+        self.lotto_timers = {}
         self.bot.shutdowns.append(self.shutdown)
+        self.bot.scheduler.register("lotto", self.finish_lotto, restore=self.restore_lotto)
+        # Lotteries saved at the last shutdown, each put back when its draw's timer is
+        try:
+            with open("resources/lotteries.json") as lf:
+                self.saved_lotteries = {int(k): v for k, v in json.loads(lf.read()).items()}
+        except FileNotFoundError:
+            self.saved_lotteries = {}
 
     async def shutdown(self):
         with open("resources/lotteries.json", 'w') as lf:
@@ -62,7 +71,6 @@ class Economy(commands.Cog):
         dest = ctx.channel
         if member is None:
             member = ctx.author
-        gd = await self.bot.db.get_guild_data(ctx.guild)
         try:
             is_mod = checks.role_or_permissions(ctx,
                                                 lambda r: r.name in ('Bot Mod', 'Bot Admin', 'Bot Moderator'),
@@ -70,7 +78,7 @@ class Economy(commands.Cog):
         except:
             is_mod = False
 
-        hide = gd.get("hideinv", False)
+        hide = await self.bot.db.get_section(ctx.guild, "hideinv", False)
 
         if not is_mod and hide:
             member = ctx.author
@@ -109,7 +117,7 @@ Total:\t\t {:.2f} dollars
         members = chain(members)
 
         for member in members:
-            async with self.bot.di.rm.lock(member.id):
+            async with self.bot.di.rm.lock(member.id, label="user"):
                 await self.bot.di.set_eco(member, amount)
 
         await ctx.send(await _(ctx, "Balances changed"))
@@ -124,7 +132,7 @@ Total:\t\t {:.2f} dollars
         members = chain(members)
 
         for member in members:
-            async with self.bot.di.rm.lock(member.id):
+            async with self.bot.di.rm.lock(member.id, label="user"):
                 await self.bot.di.add_eco(member, amount)
 
         await ctx.send(await _(ctx, "Money given"))
@@ -139,7 +147,7 @@ Total:\t\t {:.2f} dollars
         succ = False
 
         for member in members:
-            async with self.bot.di.rm.lock(member.id):
+            async with self.bot.di.rm.lock(member.id, label="user"):
                 try:
                     await self.bot.di.take_from_bank(member, amount)
                     succ = True
@@ -158,17 +166,16 @@ Total:\t\t {:.2f} dollars
                 await _(ctx, "Bots don't have money to pay other people! Use rp!givemoney instead of rp!pay"))
             return
         amount = abs(amount)
-        async with self.bot.di.rm.lock(ctx.author.id):
-            await self.bot.di.add_eco(ctx.author, -amount)
-        async with self.bot.di.rm.lock(member.id):
-            await self.bot.di.add_eco(member, amount)
+        result = await self.bot.di.transfer(ctx.guild, money=[(ctx.author, member, amount)])
+        if not result.ok:
+            await ctx.send(await _(ctx, "You don't have enough to give!"))
+            return
         await ctx.send((await _(ctx, "Successfully paid {} dollars to {}")).format(amount, member))
 
     @commands.group(aliases=["m", "pm"], invoke_without_command=True)
     async def market(self, ctx):
         """View the current market listings"""
-        um = await self.bot.di.get_guild_market(ctx.guild)
-        market = list(um.values())
+        market = await self.bot.di.get_listings(ctx.guild)
         desc = await _(ctx,
                        "\u27A1 to see the next page"
                        "\n\u2B05 to go back"
@@ -191,27 +198,7 @@ Total:\t\t {:.2f} dollars
         try:
             users = [await ctx.guild.fetch_member(x['user']) for x in chunks[i]]
         except Exception:
-            br = []
-            fr = dict()
-            for listing, data in um.items():
-                for datum in data:
-                    if 'item' not in listing:
-                        id = self.bot.randsample()
-                        fr[id] = dict(id=id, item=listing, user=ctx.author.id, cost=datum['cost'],
-                                      amount=datum['amount'])
-                br.append(listing)
-
-            for i in br:
-                del um[i]
-            um.update(fr)
-
-            await self.bot.di.update_guild_market(ctx.guild, um)
-            market = list(um.items())
-            chunks = []
-            for i in range(0, len(market), clen):
-                chunks.append(market[i:i + clen])
-
-            users = get(ctx.guild.members, id=[x['user'] for x in chunks[i]])
+            users = [ctx.guild.get_member(x['user']) for x in chunks[i]]
 
         currency = await ctx.bot.di.get_currency(ctx.guild)
 
@@ -301,20 +288,15 @@ Total:\t\t {:.2f} dollars
         This will list 12 Apples from your inventory for $500"""
         amount = abs(amount)
         cost = abs(cost)
-        market = await self.bot.di.get_guild_market(ctx.guild)
 
-        async with self.bot.di.rm.lock(ctx.author.id):
+        async with self.bot.di.rm.lock(ctx.author.id, label="user"):
             try:
                 await self.bot.di.take_items(ctx.author, (item, amount))
             except ValueError:
                 await ctx.send(await _(ctx, "You don't have enough of these to sell!"))
                 return
 
-        id = self.bot.randsample()
-        market[id] = dict(id=id, item=item, user=ctx.author.id, cost=cost, amount=amount)
-
-        async with self.bot.di.rm.lock(ctx.guild.id):
-            await self.bot.di.update_guild_market(ctx.guild, market)
+        id = await self.bot.di.create_listing(ctx.guild, item, ctx.author.id, cost, amount)
 
         await ctx.send((await _(ctx, "Item listed with ID {}")).format(id))
 
@@ -325,34 +307,20 @@ Total:\t\t {:.2f} dollars
         Example: rp!market buy CRP1I7
         IDs for items can be found in rp!market"""
 
-        async with self.bot.di.rm.lock(ctx.guild.id):
-            market = await self.bot.di.get_guild_market(ctx.guild)
-            item = market.pop(id)
-
-            if not item:
-                await ctx.send(await _(ctx, "That is not a valid ID!"))
-                return
+        result = await self.bot.di.transfer(ctx.guild, listing=id, buyer=ctx.author)
 
-            try:
-                await self.bot.di.add_eco(ctx.author, -item['cost'])
-            except ValueError:
-                await ctx.send(await _(ctx, "You cant afford this item!"))
-                return
-
-            owner = discord.utils.get(ctx.guild.members, id=item["user"])
-            if owner is None:
-                owner = discord.Object(item["user"])
-                owner.guild = ctx.guild
+        if result.reason == "listing":
+            await ctx.send(await _(ctx, "That is not a valid ID!"))
+            return
+        elif not result.ok:
+            await ctx.send(await _(ctx, "You cant afford this item!"))
+            return
 
-            async with self.bot.di.rm.lock(owner.id):
-                await self.bot.di.add_eco(owner, item['cost'])
+        item = result.listing
+        owner = ctx.guild.get_member(item["user"])
 
-            async with self.bot.di.rm.lock(ctx.author.id):
-                await self.bot.di.give_items(ctx.author, (item["item"], item["amount"]))
-
-            await self.bot.di.update_guild_market(ctx.guild, market)
         await ctx.send(await _(ctx, "Items successfully bought"))
-        if not isinstance(owner, discord.Object):
+        if owner is not None:
             await owner.send((await _(ctx,
                                       "{} bought {} {} from you for {} dollars with ID {} on server {}")).format(
                 ctx.author, item["item"], item["amount"], item['cost'], id, ctx.guild.name))
@@ -361,8 +329,7 @@ Total:\t\t {:.2f} dollars
     async def search(self, ctx, *, item: str):
         """Search the market for an item.
         Example: rp!market search Banana"""
-        um = await self.bot.di.get_guild_market(ctx.guild)
-        market = [i for i in um.values() if i['item'] == item]
+        market = await self.bot.di.get_listings(ctx.guild, item=item)
         desc = await _(ctx, """
         \u27A1 to see the next page
         \u2B05 to go back
@@ -381,30 +348,7 @@ Total:\t\t {:.2f} dollars
             chunks.append(market[i:i + 25])
 
         i = 0
-        try:
-            users = get(ctx.guild.members, id=[x['user'] for x in chunks[i]])
-        except Exception:
-            br = []
-            fr = dict()
-            for listing, data in um.items():
-                for datum in data:
-                    if 'item' not in listing:
-                        id = self.bot.randsample()
-                        fr[id] = dict(id=id, item=listing, user=ctx.author.id, cost=datum['cost'],
-                                      amount=datum['amount'])
-                br.append(listing)
-
-            for i in br:
-                del um[i]
-            um.update(fr)
-
-            await self.bot.di.update_guild_market(ctx.guild, um)
-            market = list(um.items())
-            chunks = []
-            for i in range(0, len(market), 25):
-                chunks.append(market[i:i + 25])
-
-            users = get(ctx.guild.members, id=[x['user'] for x in chunks[i]])
+        users = [ctx.guild.get_member(x['user']) for x in chunks[i]]
 
         # items = [f"{x['id']}\t| {x['cost']} dollars\t| x{x['amount']}\t| {x['item']}\t| {y.mention}" for x, y in zip(chunks[i], users)]
         # items.insert(0, "ID\t\t| COST\t\t| NUMBER\t\t| ITEM\t\t| SELLER")
@@ -489,19 +433,14 @@ Total:\t\t {:.2f} dollars
     async def _market_remove(self, ctx, id: str):
         """Remove an item from the market"""
 
-        async with self.bot.di.rm.lock(ctx.guild.id):
-            market = await self.bot.di.get_guild_market(ctx.guild)
-            try:
-                item = market.pop(id)
-            except KeyError:
-                await ctx.send(await _(ctx, "That is not a valid ID!"))
-                return
-
-            if item["user"] == ctx.author.id:
+        item = await self.bot.di.pop_listing(ctx.guild, id, ctx.author.id)
+        if item is not None:
+            async with self.bot.di.rm.lock(ctx.author.id, label="user"):
                 await self.bot.di.give_items(ctx.author, (item["item"], item["amount"]))
-                await self.bot.di.update_guild_market(ctx.guild, market)
-            else:
-                await ctx.send(await _(ctx, "This is not your item to remove!"))
+        elif await self.bot.di.get_listing(ctx.guild, id) is None:
+            await ctx.send(await _(ctx, "That is not a valid ID!"))
+        else:
+            await ctx.send(await _(ctx, "This is not your item to remove!"))
 
     @commands.group(invoke_without_command=True, aliases=['lottery'])
     async def lotto(self, ctx):
@@ -534,6 +473,8 @@ Total:\t\t {:.2f} dollars
             del self.bot.lotteries[ctx.guild.id][name]
         except KeyError:
             await ctx.send(await _(ctx, "There is no lottery of that name!"))
+            return
+        await self.bot.scheduler.cancel(self.lotto_timers.pop((ctx.guild.id, name), None))
 
     @checks.mod_or_permissions()
     @lotto.command(aliases=["create"])
@@ -549,20 +490,40 @@ Total:\t\t {:.2f} dollars
             return
         current = dict(jackpot=jackpot, players=list(), channel=ctx.channel.id)
         self.bot.lotteries[ctx.guild.id][name] = current
+        self.lotto_timers[(ctx.guild.id, name)] = await self.bot.scheduler.schedule(
+            time, "lotto", dict(guild=ctx.guild.id, name=name))
         await ctx.send(await _(ctx, "Lottery created!"))
-        await asyncio.sleep(time)
-        if name in self.bot.lotteries[ctx.guild.id]:
-            if current["players"]:
-                winner = discord.utils.get(ctx.guild.members, id=choice(current["players"]))
 
-                async with self.bot.di.rm.lock(winner.id):
-                    await self.bot.di.add_eco(winner, current["jackpot"])
-                await ctx.send(
+    def restore_lotto(self, timer):
+        guild, name = timer.payload["guild"], timer.payload["name"]
+        current = self.saved_lotteries.get(guild, {}).pop(name, None)
+        if current is not None:
+            self.bot.lotteries.setdefault(guild, {})[name] = current
+        self.lotto_timers[(guild, name)] = timer
+
+    async def finish_lotto(self, payload):
+        """Draw the winner of a lottery once its time is up"""
+        name = payload["name"]
+        self.lotto_timers.pop((payload["guild"], name), None)
+        current = self.bot.lotteries.get(payload["guild"], {}).pop(name, None)
+        guild = self.bot.get_guild(payload["guild"])
+        if current is None or guild is None:
+            return
+
+        # There is no command context by now, translations only need the bot and server
+        ctx = SimpleNamespace(bot=self.bot, guild=guild)
+        channel = guild.get_channel(current["channel"])
+        if current["players"]:
+            winner = guild.get_member(choice(current["players"]))
+
+            async with self.bot.di.rm.lock(winner.id, label="user"):
+                await self.bot.di.add_eco(winner, current["jackpot"])
+            if channel is not None:
+                await channel.send(
                     (await _(ctx, "Lottery {} is now over!\n{} won {}! Congratulations!")).format(name, winner.mention,
                                                                                                   current["jackpot"]))
-            else:
-                await ctx.send((await _(ctx, "Nobody entered {}! Its over now.")).format(name))
-            del self.bot.lotteries[ctx.guild.id][name]
+        elif channel is not None:
+            await channel.send((await _(ctx, "Nobody entered {}! Its over now.")).format(name))
 
     @lotto.command(aliases=["join"])
     async def enter(self, ctx, *, name: str):
@@ -621,13 +582,12 @@ Total:\t\t {:.2f} dollars
         Can be sold for 10 and cannot be bought. Must be an existing item (Use rp!settings additem first)!
           Requires Bot Moderator or Admin"""
 
-        gd = await self.bot.db.get_guild_data(ctx.guild)
-        if name not in gd["items"]:
+        if name not in await self.bot.db.get_section(ctx.guild, "items", {}):
             await ctx.send(
                 await _(ctx, "This item doesn't exist! Try creating the item first with `rp!settings additem`"))
             return
 
-        shop = gd.get("shop_items", dict())
+        shop = await self.bot.di.get_guild_shop(ctx.guild)
         item = dict(buy=0, sell=0, level=0)
         shop[name] = item
         check = lambda x: x.author is ctx.author and x.channel is ctx.channel
@@ -718,13 +678,13 @@ Total:\t\t {:.2f} dollars
                 await ctx.send(await _(ctx, "You aren't high enough level for this item!"))
                 return
 
-            async with self.bot.di.rm.lock(ctx.author.id):
+            async with self.bot.di.rm.lock(ctx.author.id, label="user"):
                 await self.bot.di.add_eco(ctx.author, -iobj["buy"] * amount)
         except ValueError:
             await ctx.send(await _(ctx, "You can't afford this many!"))
             return
 
-        async with self.bot.di.rm.lock(ctx.author.id):
+        async with self.bot.di.rm.lock(ctx.author.id, label="user"):
             await self.bot.di.give_items(ctx.author, (item, amount))
         await ctx.send((await _(ctx, "Successfully bought {} {}s")).format(amount, item))
 
@@ -739,7 +699,7 @@ Total:\t\t {:.2f} dollars
             await ctx.send(await _(ctx, "This item cannot be sold!"))
             return
 
-        async with self.bot.di.rm.lock(ctx.author.id):
+        async with self.bot.di.rm.lock(ctx.author.id, label="user"):
             try:
                 await self.bot.di.take_items(ctx.author, (item, amount))
             except ValueError:
@@ -760,7 +720,7 @@ Total:\t\t {:.2f} dollars
 
         amount = abs(amount)
 
-        async with self.bot.di.rm.lock(ctx.author.id):
+        async with self.bot.di.rm.lock(ctx.author.id, label="user"):
             try:
                 await self.bot.di.take_items(ctx.author, (item, amount))
             except ValueError:
@@ -794,26 +754,20 @@ Total:\t\t {:.2f} dollars
         if not cb:
             await ctx.send(await _(ctx, "Nobody bid!"))
 
-            async with self.bot.di.rm.lock(ctx.author.id):
+            async with self.bot.di.rm.lock(ctx.author.id, label="user"):
                 await self.bot.di.give_items(ctx.author, (item, amount))
             self.bids.remove(ctx.channel.id)
             return
 
-        for x in range(len(cb)):
-            winner, wamount = cb.most_common(x + 1)[x]
-            wb = await self.bot.di.get_balance(winner)
-            if wb >= wamount:
-                async with self.bot.di.rm.lock(winner.id):
-                    await ctx.send((await _(ctx, "{} won the bid for {} dollars!")).format(winner, amount))
-                    await self.bot.di.add_eco(winner, -wamount)
-                    await self.bot.di.give_items(winner, (item, amount))
-
-                async with self.bot.di.rm.lock(ctx.author.id):
-                    await self.bot.di.add_eco(ctx.author, wamount)
+        for winner, wamount in cb.most_common():
+            result = await self.bot.di.transfer(ctx.guild, money=[(winner, ctx.author, wamount)],
+                                                items=[(None, winner, item, amount)])
+            if result.ok:
+                await ctx.send((await _(ctx, "{} won the bid for {} dollars!")).format(winner, amount))
                 break
         else:
             await ctx.send(await _(ctx, "Nobody bid and had enough money to pay for it!"))
-            async with self.bot.di.rm.lock(ctx.author.id):
+            async with self.bot.di.rm.lock(ctx.author.id, label="user"):
                 await self.bot.di.give_items(ctx.author, (item, amount))
 
         self.bids.remove(ctx.channel.id)
@@ -825,17 +779,11 @@ Total:\t\t {:.2f} dollars
     @commands.command()
     async def baltop(self, ctx):
         """Get the top 10 server balances"""
-        req = f"""SELECT (UUID, info->'{ctx.guild.id}'->>'money') FROM userdata;"""
-        async with self.bot.db._conn.acquire() as connection:
-            resp = await connection.fetch(req)
-
-        users = [(discord.utils.get(ctx.guild.members, id=int(x["row"][0])), x["row"][1]) for x in resp if
-                 (len(x["row"]) == 2) and (x["row"][1] is not None)]
-        users = [x for x in users if x[0]]
-        users.sort(key=lambda x: -float(x[1]))
+        users = await self.bot.di.get_baltop(ctx.guild)
 
         currency = await ctx.bot.di.get_currency(ctx.guild)
-        msg = "\n".join(f"{x}: {y[0]} {y[1]} {currency}" for x, y in zip(range(1, 11), users))
+        msg = "\n".join(f"{x}: {y[0]} {int(y[1]) if int(y[1]) == y[1] else y[1]} {currency}"
+                        for x, y in zip(range(1, 11), users))
         await ctx.send(f"```\n{msg}\n```")
 
     @commands.group(aliases=["banc"], invoke_without_command=True)
@@ -851,7 +799,7 @@ Total:\t\t {:.2f} dollars
         """Deposit `amount` into the bank.
         Example: rp!bank deposit 500.3"""
 
-        async with self.bot.di.rm.lock(ctx.author.id):
+        async with self.bot.di.rm.lock(ctx.author.id, label="user"):
             bal = (await self.bot.di.get_all_balances(ctx.author))
             if amount > bal[0]:
                 await ctx.send(await _(ctx, "You don't have enough to deposit!"))
@@ -869,7 +817,7 @@ Total:\t\t {:.2f} dollars
         """Withdraw `amount` from the bank
         Example: rp!bank withdraw 499"""
 
-        async with self.bot.di.rm.lock(ctx.author.id):
+        async with self.bot.di.rm.lock(ctx.author.id, label="user"):
             bal = (await self.bot.di.get_all_balances(ctx.author))
             if amount > bal[1]:
                 await ctx.send(await _(ctx, "You don't have enough to withdraw!"))
@@ -232,99 +232,98 @@ class Groups(commands.Cog):
 
             """
 
-        async with self.bot.di.rm.lock(ctx.author.id):
-            async with self.bot.di.rm.lock(ctx.guild.id):
-                ug = await self.bot.di.get_user_guild(ctx.author)
-                if ug is not None:
-                    await ctx.send(await _(ctx, "You're already in a guild! Leave this guild to create a new one"))
-                    return
-                guilds = await self.bot.di.get_guild_guilds(ctx.guild)
-                if name in guilds:
-                    await ctx.send(await _(ctx, "A guild with this name already exists!"))
+        async with self.bot.di.rm.lock(ctx.guild.id, ctx.author.id, label=("guild", "user")):
+            ug = await self.bot.di.get_user_guild(ctx.author)
+            if ug is not None:
+                await ctx.send(await _(ctx, "You're already in a guild! Leave this guild to create a new one"))
+                return
+            guilds = await self.bot.di.get_guild_guilds(ctx.guild)
+            if name in guilds:
+                await ctx.send(await _(ctx, "A guild with this name already exists!"))
+                return
+            owner = discord.utils.get(guilds.values(), owner=ctx.author.id)
+            if owner is not None:
+                await ctx.send(await _(ctx, "You already own a guild!"))
+                return
+            try:
+                check = lambda x: x.channel is ctx.channel and x.author is ctx.author
+                guild = dict(name=name,
+                             owner=ctx.author.id,
+                             description="",
+                             members=set(),
+                             bank=0,
+                             items=dict(),
+                             open=False,
+                             image=None,
+                             invites=set())
+                await ctx.send(await _(ctx, "'cancel' or 'skip' to cancel creation or skip a step"))
+                await ctx.send(await _(ctx, "Describe the Guild (guild description)"))
+                response = await self.bot.wait_for("message", check=check, timeout=120)
+                if response.content.lower() == "cancel":
+                    await ctx.send(await _(ctx, "Cancelling!"))
                     return
-                owner = discord.utils.get(guilds.values(), owner=ctx.author.id)
-                if owner is not None:
-                    await ctx.send(await _(ctx, "You already own a guild!"))
+                elif response.content.lower() == "skip":
+                    await ctx.send(await _(ctx, "Skipping!"))
+                else:
+                    guild["description"] = response.content
+                await ctx.send(
+                    await _(ctx,
+                            "Is this guild open to everyone? Or is an invite necessary? (yes or no, no is assumed)"))
+                response = await self.bot.wait_for("message", timeout=60, check=check)
+                if response.content.lower() == "cancel":
+                    await ctx.send(await _(ctx, "Cancelling!"))
                     return
-                try:
-                    check = lambda x: x.channel is ctx.channel and x.author is ctx.author
-                    guild = dict(name=name,
-                                 owner=ctx.author.id,
-                                 description="",
-                                 members=set(),
-                                 bank=0,
-                                 items=dict(),
-                                 open=False,
-                                 image=None,
-                                 invites=set())
-                    await ctx.send(await _(ctx, "'cancel' or 'skip' to cancel creation or skip a step"))
-                    await ctx.send(await _(ctx, "Describe the Guild (guild description)"))
-                    response = await self.bot.wait_for("message", check=check, timeout=120)
+                elif response.content.lower() == "skip":
+                    await ctx.send(await _(ctx, "Skipping!"))
+                    guild["open"] = False
+                else:
+                    guild["open"] = response.content.lower() == "yes"
+
+                await ctx.send(await _(ctx, "If you'd like give a URL to an image for the guild"))
+                while True:
+                    response = await self.bot.wait_for("message", timeout=60, check=check)
                     if response.content.lower() == "cancel":
                         await ctx.send(await _(ctx, "Cancelling!"))
                         return
                     elif response.content.lower() == "skip":
                         await ctx.send(await _(ctx, "Skipping!"))
+                        break
                     else:
-                        guild["description"] = response.content
-                    await ctx.send(
-                        await _(ctx,
-                                "Is this guild open to everyone? Or is an invite necessary? (yes or no, no is assumed)"))
+                        if validate_url(response.content):
+                            guild["image"] = response.content
+                            break
+                        else:
+                            await ctx.send(await _(ctx, "That isn't a valid URL!"))
+
+                await ctx.send(await _(ctx, "Finally, you can also set an icon for the guild"))
+                while True:
                     response = await self.bot.wait_for("message", timeout=60, check=check)
                     if response.content.lower() == "cancel":
                         await ctx.send(await _(ctx, "Cancelling!"))
                         return
                     elif response.content.lower() == "skip":
                         await ctx.send(await _(ctx, "Skipping!"))
-                        guild["open"] = False
+                        break
                     else:
-                        guild["open"] = response.content.lower() == "yes"
-
-                    await ctx.send(await _(ctx, "If you'd like give a URL to an image for the guild"))
-                    while True:
-                        response = await self.bot.wait_for("message", timeout=60, check=check)
-                        if response.content.lower() == "cancel":
-                            await ctx.send(await _(ctx, "Cancelling!"))
-                            return
-                        elif response.content.lower() == "skip":
-                            await ctx.send(await _(ctx, "Skipping!"))
+                        if validate_url(response.content):
+                            guild["image"] = response.content
                             break
                         else:
-                            if validate_url(response.content):
-                                guild["image"] = response.content
-                                break
-                            else:
-                                await ctx.send(await _(ctx, "That isn't a valid URL!"))
-
-                    await ctx.send(await _(ctx, "Finally, you can also set an icon for the guild"))
-                    while True:
-                        response = await self.bot.wait_for("message", timeout=60, check=check)
-                        if response.content.lower() == "cancel":
-                            await ctx.send(await _(ctx, "Cancelling!"))
-                            return
-                        elif response.content.lower() == "skip":
-                            await ctx.send(await _(ctx, "Skipping!"))
-                            break
-                        else:
-                            if validate_url(response.content):
-                                guild["image"] = response.content
-                                break
-                            else:
-                                await ctx.send(await _(ctx, "That isn't a valid URL!"))
+                            await ctx.send(await _(ctx, "That isn't a valid URL!"))
 
-                    guild["members"].add(ctx.author.id)
-                    guilds[name] = Guild(**guild)
-                    await self.bot.di.update_guild_guilds(ctx.guild, guilds)
-                    await self.bot.di.set_guild(ctx.author, guild["name"])
+                guild["members"].add(ctx.author.id)
+                guilds[name] = Guild(**guild)
+                await self.bot.di.update_guild_guilds(ctx.guild, guilds)
+                await self.bot.di.set_guild(ctx.author, guild["name"])
 
-                    await ctx.send(await _(ctx, "Guild successfully created!"))
-                except asyncio.TimeoutError:
-                    await ctx.send(await _(ctx, "Timed out! Try again"))
+                await ctx.send(await _(ctx, "Guild successfully created!"))
+            except asyncio.TimeoutError:
+                await ctx.send(await _(ctx, "Timed out! Try again"))
 
     @guild.command()
     async def join(self, ctx, *, name: str):
         """Join a guild. (if you have an invite for closed guilds)"""
-        async with self.bot.di.rm.lock(ctx.author.id):
+        async with self.bot.di.rm.lock(ctx.author.id, label="user"):
             ug = await self.bot.di.get_user_guild(ctx.author)
             if ug is not None:
                 await ctx.send(await _(ctx, "You're already in a guild! Leave this guild to join a new one"))
@@ -352,7 +351,7 @@ class Groups(commands.Cog):
     @guild.command()
     async def leave(self, ctx):
         """Leave your guild. Will ask you to delete your guild if you are the owner."""
-        async with self.bot.di.rm.lock(ctx.author.id):
+        async with self.bot.di.rm.lock(ctx.author.id, label="user"):
             ug = await self.bot.di.get_user_guild(ctx.author)
             if ug is None:
                 await ctx.send(await _(ctx, "You aren't in a guild!"))
@@ -397,32 +396,31 @@ class Groups(commands.Cog):
         """Kick a member from a guild."""
         if user == ctx.author:
             return
-        async with self.bot.di.rm.lock(ctx.author.id):
-            async with self.bot.di.rm.lock(user.id):
-                ug = await self.bot.di.get_user_guild(ctx.author)
-                if ug is None:
-                    await ctx.send(await _(ctx, "You aren't in a guild!"))
-                    return
-                guilds = await self.bot.di.get_guild_guilds(ctx.guild)
-                guild = guilds.get(ug)
-                if guild.owner != ctx.author.id:
-                    await ctx.send(await _(ctx, "You do not own this guild!"))
-                    return
+        async with self.bot.di.rm.lock(ctx.author.id, user.id, label="user"):
+            ug = await self.bot.di.get_user_guild(ctx.author)
+            if ug is None:
+                await ctx.send(await _(ctx, "You aren't in a guild!"))
+                return
+            guilds = await self.bot.di.get_guild_guilds(ctx.guild)
+            guild = guilds.get(ug)
+            if guild.owner != ctx.author.id:
+                await ctx.send(await _(ctx, "You do not own this guild!"))
+                return
 
-                if user.id not in guild.members:
-                    await ctx.send(await _(ctx, "User isn't in this guild!"))
-                    return
+            if user.id not in guild.members:
+                await ctx.send(await _(ctx, "User isn't in this guild!"))
+                return
 
-                guild.members.remove(user.id)
-                await self.bot.di.set_guild(user, None)
-                await self.bot.di.update_guild_guilds(ctx.guild, guilds)
-                await ctx.send(await _(ctx, "User kicked"))
+            guild.members.remove(user.id)
+            await self.bot.di.set_guild(user, None)
+            await self.bot.di.update_guild_guilds(ctx.guild, guilds)
+            await ctx.send(await _(ctx, "User kicked"))
 
     @guild.command()
     async def invite(self, ctx, user: discord.Member):
         """Invite a user your closed guild"""
 
-        async with self.bot.di.rm.lock(ctx.guild.id):
+        async with self.bot.di.rm.lock(ctx.guild.id, label="guild"):
             ug = await self.bot.di.get_user_guild(ctx.author)
             if ug is None:
                 await ctx.send(await _(ctx, "You aren't in a guild!"))
@@ -443,7 +441,7 @@ class Groups(commands.Cog):
         """Delete your guild.
         To delete a guild you do not own, you must have Bot Moderator or Bot Admin"""
 
-        async with self.bot.di.rm.lock(ctx.guild.id):
+        async with self.bot.di.rm.lock(ctx.guild.id, label="guild"):
             if name is not None:
                 assert checks.modpredicate(ctx)
                 ug = name
@@ -469,7 +467,7 @@ class Groups(commands.Cog):
             if resp.content.lower() == "yes":
                 await ctx.send(await _(ctx, "Alright then!"))
 
-                async with self.bot.di.rm.lock(guild.owner):
+                async with self.bot.di.rm.lock(guild.owner, label="user"):
                     await ctx.bot.di.add_eco(Object(id=guild.owner, guild=ctx.guild), guild.bank)
                     await ctx.bot.di.give_items(Object(id=guild.owner, guild=ctx.guild), *guild.items.items())
                 await self.bot.di.remove_guild(ctx.guild, guild.name)
@@ -482,7 +480,7 @@ class Groups(commands.Cog):
         """Deposit an amount of money into the guild bank.
         To deposit into a guild are not a member of, you must have Bot Moderator or Bot Admin"""
 
-        async with self.bot.di.rm.lock(ctx.guild.id):
+        async with self.bot.di.rm.lock(ctx.guild.id, label="guild"):
             amount = abs(amount)
             guilds = await self.bot.di.get_guild_guilds(ctx.guild)
 
@@ -502,7 +500,7 @@ class Groups(commands.Cog):
 
             try:
 
-                async with self.bot.di.rm.lock(ctx.author.id):
+                async with self.bot.di.rm.lock(ctx.author.id, label="user"):
                     await self.bot.di.add_eco(ctx.author, -amount)
             except ValueError:
                 await ctx.send(await _(ctx, "You don't have enough to deposit!"))
@@ -518,7 +516,7 @@ class Groups(commands.Cog):
         """Take money from the guild bank (guild mods only)
         To withdraw from a guild you are not a member of, you must have Bot Moderator or Bot Admin"""
 
-        async with self.bot.di.rm.lock(ctx.guild.id):
+        async with self.bot.di.rm.lock(ctx.guild.id, label="guild"):
             amount = abs(amount)
             ug = await self.bot.di.get_user_guild(ctx.author)
             if ug is None:
@@ -535,7 +533,7 @@ class Groups(commands.Cog):
                 await ctx.send(await _(ctx, "Cannot withdraw more than the guild has!"))
                 return
 
-            async with self.bot.di.rm.lock(ctx.author.id):
+            async with self.bot.di.rm.lock(ctx.author.id, label="user"):
                 await self.bot.di.add_eco(ctx.author, amount)
 
             await self.bot.di.update_guild_guilds(ctx.guild, guilds)
@@ -545,7 +543,7 @@ class Groups(commands.Cog):
     async def setmod(self, ctx, *members: discord.Member):
         """Give the listed users mod for your guild (guild owner only)"""
 
-        async with self.bot.di.rm.lock(ctx.guild.id):
+        async with self.bot.di.rm.lock(ctx.guild.id, label="guild"):
             ug = await self.bot.di.get_user_guild(ctx.author)
             if ug is None:
                 await ctx.send(await _(ctx, "You aren't in a guild!"))
@@ -572,7 +570,7 @@ class Groups(commands.Cog):
         Example: rp!guild give MyGuild Bananax5 Orangex10
         Requires Bot Moderator or Bot Admin"""
 
-        async with self.bot.di.rm.lock(ctx.guild.id):
+        async with self.bot.di.rm.lock(ctx.guild.id, label="guild"):
             guilds = await self.bot.di.get_guild_guilds(ctx.guild)
             guild = guilds.get(name)
 
@@ -599,7 +597,7 @@ class Groups(commands.Cog):
         Example: rp!guild take MyGuild Bananax5 Orangex10
         Requires Bot Moderator or Bot Admin"""
 
-        async with self.bot.di.rm.lock(ctx.guild.id):
+        async with self.bot.di.rm.lock(ctx.guild.id, label="guild"):
             guilds = await self.bot.di.get_guild_guilds(ctx.guild)
             guild = guilds.get(name)
 
@@ -633,7 +631,7 @@ class Groups(commands.Cog):
         Example: rp!guild givemoney MyGuild 500
         Requires Bot Moderator or Bot Admin"""
 
-        async with self.bot.di.rm.lock(ctx.guild.id):
+        async with self.bot.di.rm.lock(ctx.guild.id, label="guild"):
             amount = abs(amount)
             guilds = await self.bot.di.get_guild_guilds(ctx.guild)
 
@@ -655,7 +653,7 @@ class Groups(commands.Cog):
         Example: rp!guild takemoney MyGuild 500
         Requires Bot Moderator or Bot Admin"""
 
-        async with self.bot.di.rm.lock(ctx.guild.id):
+        async with self.bot.di.rm.lock(ctx.guild.id, label="guild"):
             amount = abs(amount)
             guilds = await self.bot.di.get_guild_guilds(ctx.guild)
             guild = guilds.get(guild_name)
@@ -677,7 +675,7 @@ class Groups(commands.Cog):
         Example: rp!guild deposititems Bananax5 Orangex10
         To deposit into a guild you are not a member of, you must have Bot Moderator or Bot Admin"""
 
-        async with self.bot.di.rm.lock(ctx.guild.id):
+        async with self.bot.di.rm.lock(ctx.guild.id, label="guild"):
             ug = await self.bot.di.get_user_guild(ctx.author)
             if ug is None:
                 await ctx.send(await _(ctx, "You aren't in a guild!"))
@@ -692,7 +690,7 @@ class Groups(commands.Cog):
                 fitems.append((split, num))
 
             try:
-                async with self.bot.di.rm.lock(ctx.author.id):
+                async with self.bot.di.rm.lock(ctx.author.id, label="user"):
                     await self.bot.di.take_items(ctx.author, *fitems)
             except ValueError:
                 await ctx.send(await _(ctx, "You don't have enough to give!"))
@@ -710,7 +708,7 @@ class Groups(commands.Cog):
         Example: rp!guild withdrawitems Bananax5 Orangex10
         To withdraw from a guild you are not a member of, you must have Bot Moderator or Bot Admin"""
 
-        async with self.bot.di.rm.lock(ctx.guild.id):
+        async with self.bot.di.rm.lock(ctx.guild.id, label="guild"):
             ug = await self.bot.di.get_user_guild(ctx.author)
             if ug is None:
                 await ctx.send(await _(ctx, "You aren't in a guild!"))
@@ -740,7 +738,7 @@ class Groups(commands.Cog):
 
             await self.bot.di.update_guild_guilds(ctx.guild, guilds)
 
-        async with self.bot.di.rm.lock(ctx.author.id):
+        async with self.bot.di.rm.lock(ctx.author.id, label="user"):
             await self.bot.di.give_items(ctx.author, *fitems)
         await ctx.send(await _(ctx, "Successfully withdrew items"))
 
@@ -748,7 +746,7 @@ class Groups(commands.Cog):
     async def toggleopen(self, ctx):
         """Toggle the Guilds open state (guild owner only)"""
 
-        async with self.bot.di.rm.lock(ctx.guild.id):
+        async with self.bot.di.rm.lock(ctx.guild.id, label="guild"):
             ug = await self.bot.di.get_user_guild(ctx.author)
             if ug is None:
                 await ctx.send(await _(ctx, "You aren't in a guild!"))
@@ -769,7 +767,7 @@ class Groups(commands.Cog):
     @guild.command()
     async def seticon(self, ctx, url: str):
         """Set the guild's icon (guild mods only)"""
-        async with self.bot.di.rm.lock(ctx.guild.id):
+        async with self.bot.di.rm.lock(ctx.guild.id, label="guild"):
             ug = await self.bot.di.get_user_guild(ctx.author)
             if ug is None:
                 await ctx.send(await _(ctx, "You aren't in a guild!"))
@@ -788,7 +786,7 @@ class Groups(commands.Cog):
     @guild.command()
     async def setimage(self, ctx, url: str):
         """Set the guild's image (guild mods only)"""
-        async with self.bot.di.rm.lock(ctx.guild.id):
+        async with self.bot.di.rm.lock(ctx.guild.id, label="guild"):
             ug = await self.bot.di.get_user_guild(ctx.author)
             if ug is None:
                 await ctx.send(await _(ctx, "You aren't in a guild!"))
@@ -807,7 +805,7 @@ class Groups(commands.Cog):
     @guild.command(aliases=["setdesc"])
     async def setdescription(self, ctx, *, description):
         """Set the guild's description (guild mods only)"""
-        async with self.bot.di.rm.lock(ctx.guild.id):
+        async with self.bot.di.rm.lock(ctx.guild.id, label="guild"):
             ug = await self.bot.di.get_user_guild(ctx.author)
             if ug is None:
                 await ctx.send(await _(ctx, "You aren't in a guild!"))
@@ -826,7 +824,7 @@ class Groups(commands.Cog):
     @guild.command()
     async def transfer(self, ctx, user: discord.Member):
         """Transfer ownership of a guild to someone else (guild owner only)"""
-        async with self.bot.di.rm.lock(ctx.guild.id):
+        async with self.bot.di.rm.lock(ctx.guild.id, label="guild"):
             ug = await self.bot.di.get_user_guild(ctx.author)
             if ug is None:
                 await ctx.send(await _(ctx, "You aren't in a guild!"))
@@ -19,7 +19,6 @@
 # FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
 # DEALINGS IN THE SOFTWARE.
 
-import asyncio
 from random import choice, randint
 
 import discord
@@ -50,7 +49,6 @@ class Inventory(commands.Cog):
         dest = ctx.channel
         if member is None:
             member = ctx.author
-        gd = await self.bot.db.get_guild_data(ctx.guild)
         try:
             is_mod = checks.role_or_permissions(ctx,
                                                 lambda r: r.name in ('Bot Mod', 'Bot Admin', 'Bot Moderator'),
@@ -58,7 +56,7 @@ class Inventory(commands.Cog):
         except:
             is_mod = False
 
-        hide = gd.get("hideinv", False)
+        hide = await self.bot.db.get_section(ctx.guild, "hideinv", False)
 
         if not is_mod and hide:
             member = ctx.author
@@ -387,8 +385,11 @@ class Inventory(commands.Cog):
         await ctx.send((await _(ctx,
                                 "{} has 5 minutes to respond to this request using rp!trade respond. See rp!help trade respond for details")).format(
             other))
-        await asyncio.sleep(300)
-        if self.trades.pop(other) is None:
+        self.bot.scheduler.call_later(300, self.expire_trade, ctx, other)
+
+    async def expire_trade(self, ctx, other):
+        if self.trades.get(other, (None,))[0] is ctx:
+            del self.trades[other]
             await ctx.send((await _(ctx, "{} failed to respond")).format(other))
 
     @trade.command()
@@ -488,15 +489,19 @@ class Inventory(commands.Cog):
             titems = []
             for item in items:
                 split = item.split('x')
-                titems.append(("x".join(split[:-1]), abs(int(split[-1]))))
-            await self.bot.di.take_items(sender, *titems)
-            await self.bot.di.give_items(other, *titems)
+                titems.append((sender, other, "x".join(split[:-1]), abs(int(split[-1]))))
             ritems = []
             for item in self.trades[sender][1]:
                 split = item.split('x')
-                ritems.append(("x".join(split[:-1]), abs(int(split[-1]))))
-            await self.bot.di.take_items(other, *ritems)
-            await self.bot.di.give_items(sender, *ritems)
+                ritems.append((other, sender, "x".join(split[:-1]), abs(int(split[-1]))))
+            result = await self.bot.di.transfer(ctx.guild, items=titems + ritems)
+            if not result.ok:
+                short, offered = (sender, titems) if result.user == sender.id else (other, ritems)
+                await ctx.send(
+                    (await _(ctx, "{} does not have enough {} to trade! Trade cancelled!")).format(
+                        short, ", ".join(x[2] for x in offered)))
+                del self.trades[sender]
+                return
 
             await ctx.send(await _(ctx, "Trade complete!"))
             del self.trades[sender]
@@ -314,7 +314,7 @@ class Mapping(commands.Cog):
             return
         if changed or change:
             await self.bot.di.set_map(ctx.guild, mapname, mapo)
-        await self.bot.di.add_character(ctx.guild, char)
+        await self.bot.di.set_pos(ctx.guild, mapname, char.name, pos)
 
         await self.process_tile(ctx, mapo, changed, spawned, tile, char, mapname)
 
@@ -407,7 +407,7 @@ class Mapping(commands.Cog):
             return
         if changed or change:
             await self.bot.di.set_map(ctx.guild, mapname, mapo)
-        await self.bot.di.add_character(ctx.guild, char)
+        await self.bot.di.set_pos(ctx.guild, mapname, char.name, pos)
         await self.process_tile(ctx, mapo, changed, spawned, tile, char, mapname)
 
     @map.command(aliases=["west", "ouest", "gauche"])
@@ -502,7 +502,7 @@ class Mapping(commands.Cog):
             return
         if changed or change:
             await self.bot.di.set_map(ctx.guild, mapname, mapo)
-        await self.bot.di.add_character(ctx.guild, char)
+        await self.bot.di.set_pos(ctx.guild, mapname, char.name, pos)
         await self.process_tile(ctx, mapo, changed, spawned, tile, char, mapname)
 
     @map.command(aliases=["east", "est", "droit"])
@@ -596,7 +596,7 @@ class Mapping(commands.Cog):
             return
         if changed or change:
             await self.bot.di.set_map(ctx.guild, mapname, mapo)
-        await self.bot.di.add_character(ctx.guild, char)
+        await self.bot.di.set_pos(ctx.guild, mapname, char.name, pos)
 
         await self.process_tile(ctx, mapo, changed, spawned, tile, char, mapname)
 
@@ -755,7 +755,6 @@ class Mapping(commands.Cog):
         try:
             if name is None:
                 name = self.bot.in_character[ctx.guild.id].get(ctx.author.id)
-            gd = await self.bot.db.get_guild_data(ctx.guild)
             try:
                 is_mod = checks.role_or_permissions(ctx,
                                                     lambda r: r.name in ('Bot Mod', 'Bot Admin', 'Bot Moderator'),
@@ -763,7 +762,7 @@ class Mapping(commands.Cog):
             except:
                 is_mod = False
 
-            hide = gd.get("hideinv", False)
+            hide = await self.bot.db.get_section(ctx.guild, "hideinv", False)
 
             if not is_mod and hide:
                 name = self.bot.in_character[ctx.guild.id].get(ctx.author.id)
@@ -832,9 +831,8 @@ class Mapping(commands.Cog):
     async def setpos(self, ctx, character: str, x: int, y: int):
         """Set the position of a character on that character's current map. If this is out of bounds the character will be stuck"""
         char = await self.bot.di.get_character(ctx.guild, character)
-        mapname = char.meta.get("map")
-        char.meta[mapname] = x, y
-        await self.bot.di.add_character(ctx.guild, char)
+        mapname = char.meta.get("map") or await self.bot.di.get_default_map(ctx.guild)
+        await self.bot.di.set_pos(ctx.guild, mapname, char.name, [x, y])
         await ctx.send("Updated character position!")
 
     @map.command()
@@ -33,6 +33,7 @@ from collections import Counter
 from random import randint, choice
 
 from .utils import checks
+from .utils.db import Query
 from .utils.translation import _
 
 
@@ -284,6 +285,35 @@ class Misc(commands.Cog):
         fmt = '%s socket events observed (%.2f/minute):\n%s'
         await ctx.send(fmt % (total, cpm, self.bot.socket_stats))
 
+    @commands.command(hidden=True)
+    @commands.is_owner()
+    async def dbstats(self, ctx):
+        stats = self.bot.db.cache.stats()
+        fmt = 'Guild cache: {entries} entries, {bytes} bytes, {hits} hits, {misses} misses ' \
+              '({hit_rate:.2%}), {evictions} evictions'
+        fmt += '\nCold sections: {sections} cached, {packed} bytes packed'
+        fmt += '\nMigrations: {migrated} upgraded to version {latest}, {failed} failed'
+        stats.update(self.bot.db.migrator.stats())
+        blobs = self.bot.db.blobs.stats()
+        stats.update(sections=blobs["entries"], packed=blobs["bytes"])
+        if self.bot.db.group_commit:
+            fmt += '\nGroup commit: {mutations} guild mutations in {writes} writes'
+            stats.update(mutations=self.bot.db.group_commits["mutations"], writes=self.bot.db.group_commits["writes"])
+        fmt += '\nExperience: {exp_pending} pending, {exp_written} written in {exp_flushes} flushes, {levels} level ups'
+        fmt += '\nScheduler: {scheduled} scheduled, {fired} fired, {deleted} messages deleted'
+        stats.update(self.bot.scheduler.stats())
+        exp = self.bot.db.exp.stats()
+        stats.update(exp_pending=exp["pending"], exp_written=exp["written"], exp_flushes=exp["flushes"],
+                     levels=exp["levels"])
+        if self.bot.db.writes is not None:
+            fmt += '\nWrite-behind: {pending} pending, {written} written in {flushes} flushes ({time:.3f}s)'
+            stats.update(self.bot.db.writes.stats())
+        locks = "".join(f"\nLocks ({cls}): {x.acquisitions} acquired, {x.timeouts} timed out, "
+                        f"{x.wait:.3f}s waiting (max {x.max_wait:.3f}s), {x.hold:.3f}s held (max {x.max_hold:.3f}s)"
+                        for cls, x in self.bot.di.rm.stats.items())
+        queries = "\n".join(f"{q.name}: {q.calls} calls, {q.time:.3f}s" for q in Query.stats() if q.calls)
+        await ctx.send(fmt.format(**stats) + locks + (f"\n```\n{queries}\n```" if queries else ""))
+
     @commands.command(hidden=True)
     @commands.is_owner()
     async def makedoc(self, ctx):
@@ -256,30 +256,15 @@ class Pets(commands.Cog):
             return
 
         if resp.content == "rp!accept":
-            yud = await self.bot.db.get_user_data(ctx.author)
-            tud = await self.bot.db.get_user_data(other)
-
-            for your_pet in yud["box"]:
-                if your_pet[0] == your_id:
-                    break
-            else:
-                raise KeyError((await _(ctx, "{} is not a valid ID!")).format(your_id))
-            yud["box"].remove(your_pet)
-            tud["box"].append(your_pet)
-
-            for their_pet in tud["box"]:
-                if their_pet[0] == your_id:
-                    break
-            else:
-                raise KeyError((await _(ctx, "{} is not a valid ID!")).format(their_id))
-            tud["box"].remove(their_pet)
-            yud["box"].append(their_pet)
-
-            your_pet["id"], their_pet["id"] = their_pet["id"], your_pet["id"]
+            result = await self.bot.di.transfer(ctx.guild, pets=[(ctx.author, other, your_id),
+                                                                 (other, ctx.author, their_id)])
+            if not result.ok:
+                await ctx.send((await _(ctx, "{} is not a valid ID!")).format(
+                    your_id if result.user == ctx.author.id else their_id))
+                return
 
-            await self.bot.db.update_user_data(ctx.author, yud)
-            await self.bot.db.update_user_data(other, tud)
-            await ctx.send((await _(ctx, "Trade completed! Traded {} for {}!")).format(your_pet['name'], their_pet['name']))
+            your_pet, their_pet = result.pets
+            await ctx.send((await _(ctx, "Trade completed! Traded {} for {}!")).format(your_pet.name, their_pet.name))
 
         else:
             await ctx.send(await _(ctx, "Trade declined! Cancelling."))
@@ -1,7 +1,6 @@
 import datetime
 import time
 import asyncio
-import json
 from collections import defaultdict
 
 import discord
@@ -33,11 +32,7 @@ class Salary(commands.Cog):
                 try:
                     dels = defaultdict(list)
 
-                    req = f"""SELECT UUID, info ->> 'salaries' FROM guilddata;"""
-                    async with self.bot.db._conn.acquire() as connection:
-                        response = await connection.fetch(req)
-                    guilds = (y for y in ((x["uuid"], json.loads(x["?column?"])) for x in response if x["?column?"]) if
-                              y[1])
+                    guilds = await self.bot.db.get_all_salaries()
 
                     for guild, roles in guilds:
                         try:
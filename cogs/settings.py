@@ -48,14 +48,16 @@ class Settings(commands.Cog):
     @commands.group(aliases=["s", "configuration", "conf"], invoke_without_command=True)
     async def settings(self, ctx):
         """Get the current server settings"""
-        settings = await self.bot.db.get_guild_data(ctx.guild)
+        settings = dict(await self.bot.db.get_guild_data(ctx.guild))
+        settings.update(await self.bot.db.get_sections(ctx.guild, ("items", "maps")))
         embed = discord.Embed(color=randint(0, 0xFFFFFF),)
         embed.set_author(name=ctx.guild.name, icon_url=ctx.guild.icon_url)
         embed.add_field(name=await _(ctx, "Starting Money"),
                         value=f"{settings['start']} {settings.get('currency', 'dollars')}")
         embed.add_field(name=await _(ctx, "Items"), value="{} {}".format(len(settings['items']), await _(ctx, "items")))
         embed.add_field(name=await _(ctx, "Characters"),
-                        value="{} {}".format(len(settings['characters']), await _(ctx, "characters")))
+                        value="{} {}".format(await self.bot.di.count_characters(ctx.guild),
+                                             await _(ctx, "characters")))
         embed.add_field(name=await _(ctx, "Maps"),
                         value=await _(ctx, "None") if not settings.get("maps") else "\n".join(
                             (x if x != settings.get("default_map") else f"**{x}**") for x in settings["maps"]))
@@ -275,7 +277,7 @@ class Settings(commands.Cog):
             rp!setprefix ! --> !setprefix rp!
 
         Requires Bot Moderator or Bot Admin"""
-        self.bot.prefixes[str(ctx.guild.id)] = new_prefix
+        self.bot.set_prefix(ctx.guild.id, new_prefix)
         await ctx.send(await _(ctx, "Updated server prefix"))
 
     @commands.command()
@@ -323,8 +325,6 @@ class Settings(commands.Cog):
         """Set whether or not user inventories are hidden. If enabled, inventories will be sent via DMs.
         Values are True/False
         Requires Bot Moderator or Bot Admin"""
-        gd = await self.bot.db.get_guild_data(ctx.guild)
-        gd["hideinv"] = value
-        await self.bot.db.update_guild_data(ctx.guild, gd)
+        await self.bot.db.modify_guild_data(ctx.guild, lambda gd: gd.update(hideinv=value))
         await ctx.send(await _(ctx, "Updated inventory setting"))
 
@@ -46,8 +46,7 @@ class Team(commands.Cog):
 
         try:
             team = await self.bot.di.get_team(ctx.guild, character)
-            all_chars = await self.bot.di.get_guild_characters(ctx.guild)
-            chobj = all_chars[character]
+            chobj = await self.bot.di.get_character(ctx.guild, character)
         except KeyError:
             await ctx.send(await _(ctx, "That character doesn't exist!"))
             return
@@ -70,14 +69,16 @@ class Team(commands.Cog):
     async def add(self, ctx, character: str, id: int):
         """Add a Pet to a character's team"""
         try:
-            chobj = (await self.bot.di.get_guild_characters(ctx.guild))[character]
+            chobj = await self.bot.di.get_character(ctx.guild, character)
+            if chobj is None:
+                raise KeyError(character)
             if chobj.owner != ctx.author.id:
                 await ctx.send(await _(ctx, "You do not own this character!"))
                 return
             if id in chobj.team:
                 await ctx.send(await _(ctx, "That Pet is already a part of the team!"))
                 return
-            await self.bot.di.add_to_team(ctx.guild, character, id)
+            await self.bot.di.add_to_team(ctx.guild, chobj.name, id)
             await ctx.send(await _(ctx, "Added to team!"))
         except KeyError:
             await ctx.send("That character does not exist!")
@@ -86,12 +87,14 @@ class Team(commands.Cog):
     async def remove(self, ctx, character: str, id: int):
         """Remove a Pet from a character's team"""
         try:
-            chobj = (await self.bot.di.get_guild_characters(ctx.guild))[character]
+            chobj = await self.bot.di.get_character(ctx.guild, character)
+            if chobj is None:
+                raise KeyError(character)
             if chobj.owner != ctx.author.id:
                 await ctx.send(await _(ctx, "You do not own this character!"))
                 return
 
-            await self.bot.di.remove_from_team(ctx.guild, character, id)
+            await self.bot.di.remove_from_team(ctx.guild, chobj.name, id)
             await ctx.send(await _(ctx, "Successfully removed Pet!"))
         except KeyError:
             await ctx.send(await _(ctx, "That character does not exist!"))
@@ -49,7 +49,6 @@ class User(commands.Cog):
         dest = ctx.channel
         if user is None:
             user = ctx.author
-        gd = await self.bot.db.get_guild_data(ctx.guild)
         try:
             is_mod = checks.role_or_permissions(ctx,
                                                 lambda r: r.name in ('Bot Mod', 'Bot Admin', 'Bot Moderator'),
@@ -57,7 +56,7 @@ class User(commands.Cog):
         except:
             is_mod = False
 
-        hide = gd.get("hideinv", False)
+        hide = await self.bot.db.get_section(ctx.guild, "hideinv", False)
 
         if not is_mod and hide:
             user = ctx.author
@@ -70,7 +69,7 @@ class User(commands.Cog):
         embed.set_thumbnail(url=user.avatar_url)
 
         ud = await self.bot.db.get_user_data(user)
-        gd = await self.bot.db.get_guild_data(ctx.guild)
+        gd = await self.bot.db.get_sections(ctx.guild, ("hideinv", "currency"))
         hide = gd.get("hideinv", False)
 
         pet = [f"{x[0]}: **{x[1]}**" for x in ud["box"]]
@@ -80,7 +79,7 @@ class User(commands.Cog):
             pet.append((await _(ctx, "\nand {} more...")).format(pl - 20))
         boxitems = "\n".join(pet)
 
-        characters = [x for x, y in gd["characters"].items() if y[1] == user.id]
+        characters = list(await self.bot.di.get_guild_characters(ctx.guild, owner=user.id))
         if characters:
             embed.add_field(name=await _(ctx, "Characters"), value="\n".join(characters))
 
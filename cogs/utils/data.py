@@ -23,15 +23,16 @@
 import discord
 from discord.ext import commands
 from recordclass import recordclass as namedtuple
-import ujson as json
-from async_timeout import timeout
+from async_timeout import timeout as _timeout
 
 from collections import Counter
 import re
+import time
 import asyncio
 from random import randint
 
 from .translation import _
+from .db import GuildSnapshot, AdvisoryLocks, load_config
 from builtins import property as _property, tuple as _tuple
 from operator import itemgetter as _itemgetter
 from collections import OrderedDict
@@ -47,48 +48,156 @@ Map = namedtuple("Map", ["tiles", "generators", "spawners", "spawn", "maxx", "ma
 AdvancedMap = namedtuple("AdvancedMap", ["tiles", "generators", "spawners", "spawnables", "spawn", "type"])
 
 
+class Context(commands.Context):
+    """Command context carrying a snapshot of the guild's data for the length of the invocation"""
+
+    def __init__(self, **attrs):
+        super().__init__(**attrs)
+        self.snapshot = GuildSnapshot(self.guild) if self.guild is not None else None
+
+    def refresh_guild_data(self):
+        """Drop the invocation's snapshot so the next read goes back to the database"""
+        if self.snapshot is not None:
+            self.snapshot.refresh()
+
+
 class ContextManagerLockWrapper:
-    def __init__(self, manager, resource):
+    def __init__(self, manager, resources, timeout=None, label=None):
         self.manager = manager
-        self.resource = resource
+        self.resources = resources
+        self.timeout = timeout
+        self.label = label
+        self.held = None
 
     async def __aenter__(self):
-        try:
-            async with timeout(10 * 60):
-                await self.manager.acquire(self.resource)
-        except asyncio.TimeoutError:
-            self.manager.release(self.resource)
-            await self.manager.bot.get_user(self.manager.bot.owner_id)
+        self.held = await self.manager.acquire(*self.resources, timeout=self.timeout, label=self.label)
+        return self.held
 
     async def __aexit__(self, exc_type, exc_val, exc_tb):
-        self.manager.release(self.resource)
+        await self.manager.release(self.held)
+
+
+class LockStats:
+    """Acquisition, wait and hold counts for one class of resource"""
+    __slots__ = ("acquisitions", "timeouts", "wait", "max_wait", "hold", "max_hold")
+
+    def __init__(self):
+        self.acquisitions = self.timeouts = 0
+        self.wait = self.max_wait = self.hold = self.max_hold = 0.0
+
+
+class HeldLocks:
+    """The resources held by one acquisition, in the order they were taken, and their metric classes"""
+    __slots__ = ("resources", "classes", "acquired", "shared")
+
+    def __init__(self, resources, classes, acquired, shared=None):
+        self.resources = resources
+        self.classes = classes
+        self.acquired = acquired
+        self.shared = shared
 
 
 class ResourceManager:
-    def __init__(self, bot, lock_factory=asyncio.Lock):
-        """A class for managing multiple locks on arbitrary resources."""
+    def __init__(self, bot, lock_factory=asyncio.Lock, timeout=10 * 60, backend=None):
+        """A class for managing locks on arbitrary resources.
+        Resources locked together are always taken in the same order, so holders can't deadlock on each other.
+        If a `backend` (such as db.AdvisoryLocks) is given, the locks are also held across processes through it"""
         self.locks = {}
+        self.stats = {}
         self._lock_factory = lock_factory
+        self.timeout = timeout
+        self.backend = backend
         self.bot = bot
 
-    async def acquire(self, resource):
-        if resource in self.locks:
-            await self.locks[resource].acquire()
-        else:
-            lock = self.locks[resource] = self._lock_factory()
-            await lock.acquire()
-
-    def release(self, resource):
-        if resource in self.locks:
-            lock = self.locks[resource]
-            lock.release()
-            if not lock.locked():
-                del self.locks[resource]
+    @staticmethod
+    def resource_class(resource, label=None):
+        """The class a resource's metrics are reported under: the name a tuple starts with,
+        otherwise the label it was locked with, otherwise its type"""
+        if isinstance(resource, tuple):
+            return str(resource[0])
+        return label or type(resource).__name__
+
+    @staticmethod
+    def _order(resource):
+        # Only depends on the resource itself, so every acquirer puts the same resources in the same order
+        return type(resource).__name__, repr(resource)
+
+    async def acquire(self, *resources, timeout=None, label=None):
+        """Acquire every resource or, if that takes longer than `timeout` seconds, none of them.
+        `label` names the metric class of the resources, or of each one if it is a tuple"""
+        labels = label if isinstance(label, tuple) else (label,) * len(resources)
+        classes = {resource: self.resource_class(resource, x) for resource, x in zip(resources, labels)}
+        resources = sorted(classes, key=self._order)
+        start = time.perf_counter()
+        taken = []
+        try:
+            async with _timeout(timeout or self.timeout):
+                for resource in resources:
+                    entry = self.locks.get(resource)
+                    if entry is None:
+                        entry = self.locks[resource] = [self._lock_factory(), 0]
+                    entry[1] += 1
+                    try:
+                        await entry[0].acquire()
+                    except BaseException:
+                        self._drop(resource)
+                        raise
+                    taken.append(resource)
+                shared = await self.backend.acquire(resources) if self.backend is not None else None
+        except BaseException as e:
+            for resource in reversed(taken):
+                self.locks[resource][0].release()
+                self._drop(resource)
+            if isinstance(e, asyncio.TimeoutError):
+                for resource in resources:
+                    self._stats(classes[resource]).timeouts += 1
+            raise
+
+        acquired = time.perf_counter()
+        for resource in resources:
+            self._record(classes[resource], "wait", acquired - start)
+        return HeldLocks(resources, classes, acquired, shared)
+
+    async def release(self, held):
+        try:
+            if held.shared is not None:
+                await self.backend.release(held.shared)
+        finally:
+            # Whatever the backend did, or these would stay locked in this process for good
+            elapsed = time.perf_counter() - held.acquired
+            for resource in reversed(held.resources):
+                if resource not in self.locks:
+                    raise RuntimeError("This lock is not being held!")
+                self.locks[resource][0].release()
+                self._drop(resource)
+                self._record(held.classes[resource], "hold", elapsed)
+
+    def _drop(self, resource):
+        """Forget a resource's lock once nobody is holding or waiting on it"""
+        entry = self.locks[resource]
+        entry[1] -= 1
+        if not entry[1]:
+            del self.locks[resource]
+
+    def _stats(self, cls):
+        stats = self.stats.get(cls)
+        if stats is None:
+            stats = self.stats[cls] = LockStats()
+        return stats
+
+    def _record(self, cls, kind, elapsed):
+        stats = self._stats(cls)
+        if kind == "wait":
+            stats.acquisitions += 1
+            stats.wait += elapsed
+            stats.max_wait = max(stats.max_wait, elapsed)
         else:
-            raise RuntimeError("This lock is not being held!")
+            stats.hold += elapsed
+            stats.max_hold = max(stats.max_hold, elapsed)
+        self.bot.stats.histogram(f"RPGBot.locks.{kind}", elapsed, tags=[f"resource:{cls}"], host="scw-8112e8")
 
-    def lock(self, resource):
-        return ContextManagerLockWrapper(self, resource)
+    def lock(self, *resources, timeout=None, label=None):
+        return ContextManagerLockWrapper(self, resources, timeout, label)
 
 
 class Character(tuple):
@@ -421,8 +530,6 @@ default_user = {
 default_server = {
     "start": 0,
     "items": dict(),
-    "characters": dict(),
-    "market_items": dict(),
     "loot_boxes": dict(),
     "guilds": dict(),
     "shop_items": dict(),
@@ -524,11 +631,17 @@ class DataInteraction(object):
     def __init__(self, bot):
         self.bot = bot
         self.db = self.bot.db
-        self.rm = ResourceManager(bot)
+        config = load_config()
+        locks = config.get("locks", {})
+        if locks.get("advisory") and config.get("backend", "postgres") != "postgres":
+            raise ValueError("Advisory locks need the postgres backend")
+        self.rm = ResourceManager(bot, timeout=locks.get("timeout", 10 * 60),
+                                  backend=AdvisoryLocks(self.db) if locks.get("advisory") else None)
 
     async def get_team(self, guild, character):
-        gd = await self.db.get_guild_data(guild)
-        character = Character(*gd["characters"][character])
+        character = await self.get_character(guild, character)
+        if character is None:
+            raise KeyError("Character doesn't exist!")
         owner = discord.utils.get(guild.members, id=character.owner)
         ud = await self.db.get_user_data(owner)
 
@@ -539,22 +652,33 @@ class DataInteraction(object):
     async def get_box(self, member):
         """Get user's Pet box"""
         ub = await self.db.user_item(member, "box")
-        return [Pet(*x) for x in json.loads(ub)]
+        return [Pet(*x) for x in ub]
 
     async def get_balance(self, member):
         """Get user's balance"""
-        return float(await self.db.user_item(member, "money"))
+        return (await self.db.get_balances(member))[0]
 
     async def get_all_balances(self, member):
-        ud = await self.db.get_user_data(member)
-        bal = ud.get("money", 0)
-        bank = ud.get("bank", 0)
-        return (bal, bank)
+        return await self.db.get_balances(member)
+
+    async def get_baltop(self, guild, count=10, get_member=None):
+        """Get the (member, balance) of the `count` richest members still on a server"""
+        get_member = get_member or guild.get_member
+        users = []
+        offset = 0
+        while len(users) < count:
+            page = await self.db.get_guild_balances(guild, count * 2, offset)
+            users.extend((get_member(uid), money) for uid, money in page)
+            users = [x for x in users if x[0]]
+            if len(page) < count * 2:
+                break
+            offset += len(page)
+        return users[:count]
 
     async def get_inventory(self, member):
         """Get user's inventory"""
         ui = await self.db.user_item(member, "items")
-        return json.loads(ui) if ui else {}
+        return ui if ui else {}
 
     async def get_salary_ctime(self, member):
         """Get user's inventory"""
@@ -582,51 +706,65 @@ class DataInteraction(object):
 
     async def get_guild_start(self, guild):
         """Get a Server's user starting balance"""
-        return (await self.db.get_guild_data(guild)).get("start", 0)
+        return await self.db.get_section(guild, "start", 0)
 
     async def get_guild_recipes(self, guild):
-        recipes = (await self.db.get_guild_data(guild)).get("recipes", {})
+        recipes = await self.db.get_section(guild, "recipes", {})
         return {a if isinstance(a, str) else " ".join(a): b for a, b in recipes.items()}
 
     async def get_guild_items(self, guild):
         """Get all the items available in a server"""
-        gd = await self.db.get_guild_data(guild)
-        return {y: ServerItem(*x) for y, x in gd["items"].items()}
+        items = await self.db.get_section(guild, "items", {})
+        return {y: ServerItem(*x) for y, x in items.items()}
 
     async def get_guild_lootboxes(self, guild):
         """Get a server's lootboxes"""
-        gd = await self.db.get_guild_data(guild)
-        return gd.get("lootboxes", dict())
+        return await self.db.get_section(guild, "lootboxes", {})
 
-    async def get_guild_market(self, guild):
-        """Get the current market of a server"""
-        gd = await self.db.get_guild_data(guild)
-        return gd.get("market_items", dict())
+    async def get_listings(self, guild, item=None, user=None):
+        """Get the current market listings of a server, optionally only those of an item or seller"""
+        return await self.db.get_listings(guild, item=item, user=user)
+
+    async def get_listing(self, guild, id):
+        """Get a market listing by its ID, None if it doesn't exist"""
+        return await self.db.get_listing(guild, id)
 
     async def get_guild_shop(self, guild):
         """Get the current market of a server"""
-        gd = await self.db.get_guild_data(guild)
-        return gd.get("shop_items", dict())
+        return await self.db.get_section(guild, "shop_items", {})
 
-    async def get_guild_characters(self, guild):
-        """Get all the characters for a server"""
-        gd = await self.db.get_guild_data(guild)
-        return {y: Character(*x) for y, x in gd["characters"].items()}
+    async def get_guild_characters(self, guild, owner=None):
+        """Get all the characters for a server, or only those owned by `owner`"""
+        return {x[0]: Character(*x) for x in await self.db.get_characters(guild, owner)}
 
     async def get_character(self, guild, name):
-        data = await self.db.get_guild_data(guild)
-        chrs = {y: Character(*x) for y, x in data["characters"].items()}
-        if "caliases" not in data:
-            data["caliases"] = {}
-        if name in data["caliases"]:
-            name = data["caliases"][name]
-        return chrs.get(name)
+        """Get a character by its name or an alias"""
+        character = await self.db.get_character(guild, name)
+        return Character(*character) if character is not None else None
+
+    async def get_character_names(self, guild, limit=None, offset=0):
+        """Get a page of the names of a server's characters in alphabetical order"""
+        return await self.db.get_character_names(guild, limit, offset)
+
+    async def count_characters(self, guild):
+        return await self.db.count_characters(guild)
+
+    async def character_exists(self, guild, name):
+        """Check if a character or alias with the given name exists"""
+        return await self.db.character_name_taken(guild, name)
+
+    async def resolve_alias(self, guild, name):
+        """Get the character name an alias points to, or the name itself if it isn't an alias"""
+        return await self.db.get_alias(guild, name) or name
+
+    async def add_alias(self, guild, alias, name):
+        return await self.db.add_alias(guild, alias, name)
+
+    async def remove_alias(self, guild, alias):
+        await self.db.remove_alias(guild, alias)
 
     async def get_map(self, guild, name):
-        gd = await self.db.get_guild_data(guild)
-        maps = gd.get("maps", {})
-        if isinstance(maps, Map):
-            maps = {"Default": maps}
+        maps = await self.db.get_section(guild, "maps", {})
         map = maps.get(name)
         if not map:
             return
@@ -635,397 +773,300 @@ class DataInteraction(object):
         return Map(*map)
 
     async def get_maps(self, guild):
-        gd = await self.db.get_guild_data(guild)
-        maps = gd.get("maps", {})
-        if isinstance(maps, Map):
-            maps = {"Default": maps}
+        maps = await self.db.get_section(guild, "maps", {})
         return {name: Map(*map) if not isinstance(map[3], dict) else AdvancedMap(*map) for name, map in maps.items()}
 
     async def get_language(self, guild):
-        gd = await self.db.get_guild_data(guild)
-        return gd.get("lang", {})
+        return await self.db.get_section(guild, "lang", {})
 
     async def get_exp_enabled(self, guild):
-        gd = await self.db.get_guild_data(guild)
-        return gd.get("exp", True)
+        return await self.db.get_section(guild, "exp", True)
 
     async def get_salaries(self, guild):
-        gd = await self.db.get_guild_data(guild)
-        return gd.get("salaries", {})
+        return await self.db.get_section(guild, "salaries", {})
 
     async def get_currency(self, guild):
-        gd = await self.db.get_guild_data(guild)
-        return gd.get("currency", "$")
+        return await self.db.get_section(guild, "currency", "$")
 
     async def get_delete_time(self, guild):
-        gd = await self.db.get_guild_data(guild)
-        t = gd.get("msgdel", None)
+        t = await self.db.get_section(guild, "msgdel")
         return t if t is not 0 else None
 
     async def get_guild_guilds(self, guild):
         """Get a server's guilds"""
-        gd = await self.db.get_guild_data(guild)
-        gobj = {y: Guild(*x) for y, x in gd.get("guilds", dict()).items()}
+        guilds = await self.db.get_section(guild, "guilds", {})
+        gobj = {y: Guild(*x) for y, x in guilds.items()}
         return gobj
 
     async def add_pet(self, owner, pet):
         """Create a Pet for a user's box"""
-        ud = await self.db.get_user_data(owner)
-        if isinstance(pet, dict):
-            if not 'id' in pet:
-                id = ud["box"][-1][0] + 1 if ud["box"] else 0
-                ud["box"].append(Pet(**pet, id=id))
+        def add(ud):
+            box = ud.get("box", [])
+            if isinstance(pet, dict):
+                if not 'id' in pet:
+                    id = box[-1][0] + 1 if box else 0
+                    box.append(Pet(**pet, id=id))
+                else:
+                    id = pet['id']
+                    box.append(Pet(**pet))
             else:
-                id = pet['id']
-                ud["box"].append(Pet(**pet))
-        else:
-            id = pet.id
-            for i, npet in enumerate(ud["box"]):
-                if npet[0] == id:
-                    ud["box"][i] = pet
-        await self.db.update_user_data(owner, ud)
-        return id
+                id = pet.id
+                for i, npet in enumerate(box):
+                    if npet[0] == id:
+                        box[i] = pet
+            result.append(id)
+            return dict(box=box)
+
+        result = []
+        await self.db.user_modify(owner, ("box",), add)
+        return result[0]
 
     async def remove_pet(self, owner, id):
         """Remove a Pet from a user's box"""
-        ud = await self.db.get_user_data(owner)
-        for x in ud["box"]:
-            if x[0] == id:
-                break
-        else:
-            raise ValueError("This is not a valid ID!")
-        ud["box"].remove(x)
-        await self.db.update_user_data(owner, ud)
-        return Pet(*x)
+        def remove(ud):
+            box = ud.get("box", [])
+            for x in box:
+                if x[0] == id:
+                    break
+            else:
+                raise ValueError("This is not a valid ID!")
+            box.remove(x)
+            result.append(x)
+            return dict(box=box)
+
+        result = []
+        await self.db.user_modify(owner, ("box",), remove)
+        return Pet(*result[0])
 
     async def new_item(self, guild, serveritem):
         """Create a new server item"""
-        gd = await self.db.get_guild_data(guild)
-        gd["items"][serveritem.name] = serveritem
-        await self.db.update_guild_data(guild, gd)
+        await self.db.update_section(guild, "items", {serveritem.name: serveritem})
 
     async def new_items(self, guild, serveritems):
         """Create a new server item"""
-        gd = await self.db.get_guild_data(guild)
-        for item in serveritems:
-            gd["items"][item.name] = item
-        await self.db.update_guild_data(guild, gd)
+        await self.db.update_section(guild, "items", {item.name: item for item in serveritems})
 
     async def update_guild_items(self, guild, serveritems):
         """Create a new server item"""
-        gd = await self.db.get_guild_data(guild)
-        gd["items"] = dict()
-        for item in serveritems:
-            gd["items"][item.name] = item
-        await self.db.update_guild_data(guild, gd)
+        await self.db.set_section(guild, "items", {x.name: x for x in serveritems})
 
     async def remove_item(self, guild, item):
         """Remove a server item"""
-        gd = await self.db.get_guild_data(guild)
-        del gd["items"][item]
-        await self.db.update_guild_data(guild, gd)
+        if item not in await self.db.get_section(guild, "items", {}):
+            raise KeyError(item)
+        await self.db.remove_section_entries(guild, "items", item)
 
     async def remove_items(self, guild, *items):
         """Remove a server item"""
-        gd = await self.db.get_guild_data(guild)
-        for item in items:
-            gd["items"].pop(item, None)
-        await self.db.update_guild_data(guild, gd)
+        await self.db.remove_section_entries(guild, "items", *items)
 
     async def add_character(self, guild, character):
         """Add a new character to a guild"""
-        gd = await self.db.get_guild_data(guild)
-        gd["characters"][character.name] = character
-        await self.db.update_guild_data(guild, gd)
+        await self.db.put_character(guild, character)
 
     async def remove_character(self, guild, name):
         """Remove a character from a guild"""
-        gd = await self.db.get_guild_data(guild)
-        del gd["characters"][name]
-        await self.db.update_guild_data(guild, gd)
+        await self.db.delete_character(guild, name)
 
     async def give_items(self, member, *items):
-        """Give a user items"""
-        ud = await self.db.get_user_data(member)
-        ud["items"] = Counter(ud["items"])
-        ud["items"].update(dict(items))
-        await self.db.update_user_data(member, ud)
-        return ud["items"]
+        """Give a user items, returns None if the write was deferred"""
+        items = await self.db.user_give_items(member, dict(items))
+        return Counter(items) if items is not None else None
 
     async def take_items(self, member, *items):
         """Take items from a user"""
-        ud = await self.db.get_user_data(member)
-        ud["items"] = Counter(ud["items"])
-        ud["items"].subtract(dict(items))
-
-        for item, value in list(ud["items"].items()):
-            if value < 0:
-                raise ValueError("Cannot take more items than the user has!")
-            if value == 0:
-                del ud["items"][item]
-
-        await self.db.update_user_data(member, ud)
-        return ud["items"]
+        items = await self.db.user_update_items(member, {x: -y for x, y in dict(items).items()}, strict=True)
+        if items is None:
+            raise ValueError("Cannot take more items than the user has!")
+        return Counter(items)
 
     async def take_items_override(self, member, *items):
         """Take items from a user (set to zero instead of error)"""
-        ud = await self.db.get_user_data(member)
-        ud["items"] = Counter(ud["items"])
-        ud["items"].subtract(dict(items))
-
-        for item, value in list(ud["items"].items()):
-            if value <= 0:
-                del ud["items"][item]
-
-        await self.db.update_user_data(member, ud)
-        return ud["items"]
+        return Counter(await self.db.user_update_items(member, {x: -y for x, y in dict(items).items()}))
 
     async def update_items(self, member, *items):
         """Take items from a user"""
-        ud = await self.db.get_user_data(member)
-        ud["items"] = Counter(ud["items"])
-        ud["items"].update(dict(items))
-
-        for item, value in list(ud["items"].items()):
-            if value <= 0:
-                del ud["items"][item]
-
-        await self.db.update_user_data(member, ud)
-        return ud["items"]
+        return Counter(await self.db.user_update_items(member, dict(items)))
 
     async def add_eco(self, member, amount):
-        """Give (or take) a user('s) money"""
-        ud = await self.db.get_user_data(member)
-        if ud["money"] + amount < 0 and (ud["money"] >= 0 or amount < 0):
+        """Give (or take) a user('s) money, returns None if the write was deferred"""
+        if amount >= 0:
+            balances = await self.db.balance_add(member, amount)
+            return balances[0] if balances is not None else None
+        balances = await self.db.balance_incr(member, amount, floor=0)
+        if balances is None:
             raise ValueError("Cannot take more than user has!")
-        ud["money"] += amount
-        await self.db.update_user_data(member, ud)
-        return ud["money"]
+        return balances[0]
+
+    async def transfer(self, guild, money=(), items=(), pets=(), listing=None, buyer=None):
+        """Move money, items and pets between users in one transaction, all or nothing.
+        `money` is (payer, payee, amount), `items` is (giver, receiver, item, count), `pets` is (giver, receiver, id),
+        parties being members (or None to create/destroy). `listing` is a market ID for `buyer` to buy.
+        Returns a TransferResult"""
+        def uid(x):
+            return None if x is None else x.id
+
+        result = await self.db.transfer(
+            guild,
+            money=[(uid(a), uid(b), abs(amount)) for a, b, amount in money],
+            items=[(uid(a), uid(b), item, abs(count)) for a, b, item, count in items],
+            pets=[(uid(a), uid(b), id) for a, b, id in pets],
+            listing=listing,
+            buyer=uid(buyer),
+        )
+        if result.pets:
+            result = result._replace(pets=[Pet(*x) for x in result.pets])
+        return result
 
     async def take_from_bank(self, member, amount):
         """Take a user('s) money, draining from the bank if necessary"""
-        ud = await self.db.get_user_data(member)
-        ud["money"] -= amount
-        if "bank" not in ud:
-            ud["bank"] = 0
-        if ud["money"] < 0:
-            ud["bank"] += ud["money"]
-            if ud["bank"] < 0:
-                raise ValueError("Cannot take more than user has!")
-        await self.db.update_user_data(member, ud)
-        return ud["money"], ud["bank"]
+        balances = await self.db.balance_take(member, amount)
+        if balances is None:
+            raise ValueError("Cannot take more than user has!")
+        return balances
 
     async def set_salary_ctime(self, member, ctimes):
         """Give a user items"""
-        ud = await self.db.get_user_data(member)
-        ud["ctimes"] = ctimes
-        await self.db.update_user_data(member, ud)
+        await self.db.user_set(member, ctimes=ctimes)
 
     async def update_salaries(self, guild, data):
-        gd = await self.db.get_guild_data(guild)
-        gd["salaries"] = data
-        await self.db.update_guild_data(guild, gd)
+        await self.db.set_section(guild, "salaries", data)
 
     async def set_delete_time(self, guild, time):
-        gd = await self.db.get_guild_data(guild)
-        gd["msgdel"] = time
-        await self.db.update_guild_data(guild, gd)
+        await self.db.set_section(guild, "msgdel", time)
 
     async def set_language(self, guild, language):
-        gd = await self.db.get_guild_data(guild)
-        gd["lang"] = language
-        await self.db.update_guild_data(guild, gd)
+        await self.db.set_section(guild, "lang", language)
 
     async def set_default_map(self, guild, value):
-        gd = await self.db.get_guild_data(guild)
-        gd["default_map"] = value
-        await self.db.update_guild_data(guild, gd)
+        await self.db.set_section(guild, "default_map", value)
 
     async def get_default_map(self, guild):
-        gd = await self.db.get_guild_data(guild)
-        return gd.get("default_map")
+        return await self.db.get_section(guild, "default_map")
 
     async def set_currency(self, guild, currency):
         if len(currency) > 30:
             raise ValueError("Currency prefix too long!")
-        gd = await self.db.get_guild_data(guild)
-        gd["currency"] = currency
-        await self.db.update_guild_data(guild, gd)
+        await self.db.set_section(guild, "currency", currency)
 
     async def set_eco(self, member, amount):
         """Set a user's balance"""
-        ud = await self.db.get_user_data(member)
-        ud["money"] = amount
-        ud["bank"] = 0
-        await self.db.update_user_data(member, ud)
-        return ud["money"]
+        await self.db.set_balances(member, amount, 0)
+        return amount
 
     async def set_balances(self, member, bal=None, bank=None):
         """Set a user's balance and bank balance"""
-        ud = await self.db.get_user_data(member)
-        if bal is not None:
-            ud["money"] = bal
-        if bank is not None:
-            ud["bank"] = bank
-        await self.db.update_user_data(member, ud)
+        await self.db.set_balances(member, bal, bank)
 
     async def set_start(self, guild, amount):
         """Set a server's user start balance"""
-        gd = await self.db.get_guild_data(guild)
-        gd["start"] = amount
-        await self.db.update_guild_data(guild, gd)
+        await self.db.set_section(guild, "start", amount)
 
     async def add_exp(self, member, exp):
-        ud = await self.bot.db.get_user_data(member)
-        if ud.get("level") is None:
-            ud["level"] = 0
-            ud["exp"] = 0
-        s = ud["level"]
-        ud["exp"] += exp
-        next = self.bot.get_exp(ud["level"])
-        while ud["exp"] > next:
-            ud["level"] += 1
-            ud["exp"] -= next
+        def add(ud):
+            if ud.get("level") is None:
+                ud["level"] = 0
+                ud["exp"] = 0
+            start.append(ud["level"])
+            ud["exp"] += exp
             next = self.bot.get_exp(ud["level"])
+            while ud["exp"] > next:
+                ud["level"] += 1
+                ud["exp"] -= next
+                next = self.bot.get_exp(ud["level"])
+            return ud
 
-        await self.db.update_user_data(member, ud)
-        return ud["level"] if ud["level"] > s else None
+        start = []
+        ud = await self.db.user_modify(member, ("level", "exp"), add)
+        return ud["level"] if ud["level"] > start[0] else None
 
     async def set_exp_enabled(self, guild, value):
-        gd = await self.db.get_guild_data(guild)
-        gd["exp"] = value
-        await self.db.update_guild_data(guild, gd)
+        await self.db.set_section(guild, "exp", value)
 
     async def add_recipe(self, guild, name: str, itemsin: dict, itemsout: dict):
-        gd = await self.db.get_guild_data(guild)
-        if "recipes" not in gd:
-            gd["recipes"] = {}
-        recipes = gd["recipes"]
-        recipes[name] = (itemsin, itemsout)
-        await self.db.update_guild_data(guild, gd)
+        await self.db.update_section(guild, "recipes", {name: (itemsin, itemsout)})
 
     async def remove_recipe(self, guild, name):
-        gd = await self.db.get_guild_data(guild)
-        del gd.get("recipes", {})[name]
-        await self.db.update_guild_data(guild, gd)
+        if name not in await self.db.get_section(guild, "recipes", {}):
+            raise KeyError(name)
+        await self.db.remove_section_entries(guild, "recipes", name)
 
     async def add_to_team(self, guild, character, id):
         """Add a pet to a character's team"""
-        gd = await self.db.get_guild_data(guild)
-        character = gd["characters"][character]
-        character[4].append(id)
-        if len(character[4]) > 6:
+        if not await self.db.character_team_add(guild, character, id):
             raise ValueError("Team is limited to 6!")
-        await self.db.update_guild_data(guild, gd)
 
     async def set_guild(self, member, name):
-        ud = await self.db.get_user_data(member)
-        ud["guild"] = name
-        await self.db.update_user_data(member, ud)
+        await self.db.user_set(member, guild=name)
 
     async def set_map(self, guild, name, map):
-        gd = await self.db.get_guild_data(guild)
-        if "maps" not in gd:
-            gd["maps"] = {}
-        gd["maps"][name] = map
-        return await self.db.update_guild_data(guild, gd)
+        await self.db.update_section(guild, "maps", {name: map})
 
     async def remove_map(self, guild, name):
-        gd = await self.db.get_guild_data(guild)
-        maps = gd.get("maps")
-        if maps and name in maps:
-            del gd["maps"][name]
-        return await self.db.update_guild_data(guild, gd)
+        await self.db.remove_section_entries(guild, "maps", name)
 
     async def set_pos(self, guild, map, character, pos):
-        char = await self.get_character(guild, character)
-        maps = char.meta.get("maps")
-        if maps is None:
-            char.meta["maps"] = {}
-        char.meta["maps"][map] = pos
-        await self.add_character(guild, character)
+        """Set a character's position on a map"""
+        if not await self.db.set_character_pos(guild, character, map, pos):
+            raise KeyError("Character doesn't exist!")
 
     async def set_level(self, member, level, exp):
-        ud = await self.db.get_user_data(member)
-        ud["level"] = level
-        ud["exp"] = exp
-        return await self.db.update_user_data(member, ud)
+        return await self.db.user_set(member, level=level, exp=exp)
 
     async def remove_from_team(self, guild, character, id):
         """Remove a pet from a character's team"""
-        gd = await self.db.get_guild_data(guild)
-        character = gd[4][character]
-        character[4].remove(id)
-        await self.db.update_guild_data(guild, gd)
+        await self.db.character_team_remove(guild, character, id)
+
+    async def create_listing(self, guild, item, user, cost, amount):
+        """List an item on a server's market, returning the listing's ID"""
+        while True:
+            id = self.bot.randsample()
+            if await self.db.add_listing(guild, id, item, user, cost, amount):
+                return id
 
-    async def update_guild_market(self, guild, data):
-        """Update a server's market"""
-        gd = await self.db.get_guild_data(guild)
-        gd["market_items"] = data
-        return await self.db.update_guild_data(guild, gd)
+    async def pop_listing(self, guild, id, user=None):
+        """Remove a listing from a server's market and return it, None if it doesn't exist or isn't `user`'s"""
+        return await self.db.pop_listing(guild, id, user)
 
     async def update_guild_lootboxes(self, guild, data):
         """Update a server's lootboxes"""
-        gd = await self.db.get_guild_data(guild)
-        gd["lootboxes"] = data
-        return await self.db.update_guild_data(guild, gd)
+        await self.db.set_section(guild, "lootboxes", data)
 
     async def update_guild_guilds(self, guild, data):
         """Update a server's guilds"""
-        gd = await self.db.get_guild_data(guild)
-        gd["guilds"] = data
-        return await self.db.update_guild_data(guild, gd)
+        await self.db.set_section(guild, "guilds", data)
 
     async def remove_guild(self, guild, name):
-        gd = await self.db.get_guild_data(guild)
-        for mid in gd["guilds"][name][3]:
+        members = await self.db.modify_guild_data(guild, lambda gd: gd['guilds'].pop(name)[3])
+        for mid in members:
             try:
                 await self.set_guild(Object(id=mid), None)
             except:
                 pass
-        del gd['guilds'][name]
-        return await self.db.update_guild_data(guild, gd)
 
     async def update_guild_shop(self, guild, data):
         """Update a server's shop"""
-        gd = await self.db.get_guild_data(guild)
-        gd["shop_items"] = data
-        return await self.db.update_guild_data(guild, gd)
+        await self.db.set_section(guild, "shop_items", data)
 
     async def add_shop_items(self, guild, data):
         """Update a server's shop"""
-        gd = await self.db.get_guild_data(guild)
-        gd["shop_items"].update(data)
-        return await self.db.update_guild_data(guild, gd)
+        await self.db.update_section(guild, "shop_items", data)
 
     async def remove_shop_items(self, guild, *items):
         """Remove a server item"""
-        gd = await self.db.get_guild_data(guild)
-        for item in items:
-            gd["shop_items"].pop(item, None)
-        await self.db.update_guild_data(guild, gd)
+        await self.db.remove_section_entries(guild, "shop_items", *items)
 
     async def set_prefix(self, guild, prefix):
-        gd = await self.db.get_guild_data(guild)
-        gd["prefix"] = prefix
-        return await self.db.update_guild_data(guild, gd)
+        await self.db.set_section(guild, "prefix", prefix)
 
     async def set_cmd_prefixes(self, guild, name, prefix):
-        gd = await self.db.get_guild_data(guild)
-        if "cmdprefixes" not in gd:
-            gd["cmdprefixes"] = {}
-        gd["cmdprefixes"][name] = prefix
-        return await self.db.update_guild_data(guild, gd)
+        await self.db.update_section(guild, "cmdprefixes", {name: prefix})
 
     async def get_cmd_prefixes(self, guild):
-        gd = await self.db.get_guild_data(guild)
-        return gd.get("cmdprefixes", {})
+        return await self.db.get_section(guild, "cmdprefixes", {})
 
     async def set_leave_setting(self, guild, prefix):
-        gd = await self.db.get_guild_data(guild)
-        gd["wipeonleave"] = prefix
-        return await self.db.update_guild_data(guild, gd)
+        await self.db.set_section(guild, "wipeonleave", prefix)
 
     async def get_leave_setting(self, guild):
-        gd = await self.db.get_guild_data(guild)
-        return gd.get("wipeonleave", False)
+        return await self.db.get_section(guild, "wipeonleave", False)
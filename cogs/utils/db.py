@@ -20,83 +20,1422 @@
 # DEALINGS IN THE SOFTWARE.
 
 import ujson as json
+import os
+import logging
+import asyncio
 import asyncpg
 import copy
+import time
+import random
+import zlib
+import hashlib
+import contextvars
+from typing import NamedTuple
+from itertools import chain
+from collections import OrderedDict, Counter, defaultdict
 
+from . import migrations
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+current_snapshot = contextvars.ContextVar("current_snapshot", default=None)
+
+
+def _default(obj):
+    """Encode the tuple and recordclass types stored in user and guild data as arrays"""
+    try:
+        return list(obj)
+    except TypeError:
+        raise TypeError(f"{type(obj).__name__} is not JSON serializable") from None
+
+
+if orjson is not None:
+    def dumps(obj):
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+    loads = orjson.loads
+else:
+    dumps = json.dumps
+    loads = json.loads
+
+
+def encode_jsonb(value):
+    """Encode a value in the jsonb binary format, str and bytes are taken to be already encoded JSON"""
+    if isinstance(value, str):
+        value = value.encode()
+    elif not isinstance(value, bytes):
+        value = dumps(value)
+        if isinstance(value, str):
+            value = value.encode()
+    return b"\x01" + value
+
+
+def decode_jsonb(data):
+    """Decode a value in the jsonb binary format, a version byte followed by the JSON text"""
+    return loads(data[1:])
+
+
+# Large, rarely changed guild sections are stored packed in their own rows rather than in the guild document
+COLD_SECTIONS = ("maps", "items", "recipes")
+
+
+def pack(value):
+    """Serialize and compress a section, msgpack and zstd if installed, else JSON and zlib.
+    The first two bytes name the codecs so either can be read back. Returned as a bytearray so
+    that drivers bind it as binary rather than text"""
+    if msgpack is not None:
+        body, serializer = msgpack.packb(value, default=_default), b"m"
+    else:
+        body = dumps(value)
+        body, serializer = body.encode() if isinstance(body, str) else body, b"j"
+    if zstandard is not None:
+        return bytearray(b"z" + serializer + zstandard.ZstdCompressor().compress(body))
+    return bytearray(b"d" + serializer + zlib.compress(body))
+
+
+def unpack(data):
+    """Decompress and deserialize a section written by pack"""
+    data = bytes(data)
+    compressor, serializer, body = data[:1], data[1:2], data[2:]
+    if compressor == b"z":
+        if zstandard is None:
+            raise RuntimeError("zstandard is needed to read this section")
+        body = zstandard.ZstdDecompressor().decompress(body)
+    else:
+        body = zlib.decompress(body)
+    if serializer == b"m":
+        if msgpack is None:
+            raise RuntimeError("msgpack is needed to read this section")
+        return msgpack.unpackb(body, raw=False, strict_map_key=False)
+    return loads(body)
+
+
+async def init_connection(connection):
+    await connection.set_type_codec("jsonb", encoder=encode_jsonb, decoder=decode_jsonb,
+                                    schema="pg_catalog", format="binary")
+
+
+class GuildCache:
+    """A bounded LRU cache of guild documents keyed by guild id.
+    Documents are kept in their encoded form so that every reader gets its own copy to mutate,
+    entries expire after `ttl` seconds and the least recently used are evicted past `max_bytes`"""
+
+    def __init__(self, max_bytes=128 * 2 ** 20, ttl=300, decode=loads):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.decode = decode
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        entry = self._entries.get(key)
+        return entry is not None and entry[1] > time.monotonic()
+
+    def get(self, key):
+        """Get a freshly decoded copy of a cached document, None if missing or expired"""
+        entry = self.get_versioned(key)
+        return entry[0] if entry is not None else None
+
+    def get_versioned(self, key):
+        """Get a freshly decoded copy of a cached document and the version it was stored at"""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        encoded, expires, version = entry
+        if expires <= time.monotonic():
+            self.invalidate(key)
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return self.decode(encoded), version
+
+    def put(self, key, encoded, version):
+        """Store an encoded document, evicting the least recently used entries if over the memory bound"""
+        self.invalidate(key)
+        if len(encoded) > self.max_bytes:
+            return
+
+        self._entries[key] = (encoded, time.monotonic() + self.ttl, version)
+        self.size += len(encoded)
+        while self.size > self.max_bytes:
+            _, (old, *_) = self._entries.popitem(last=False)
+            self.size -= len(old)
+            self.evictions += 1
+
+    def size_of(self, key):
+        """The encoded size of a cached document, None if it isn't cached"""
+        entry = self._entries.get(key)
+        return len(entry[0]) if entry is not None and entry[1] > time.monotonic() else None
+
+    def invalidate(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= len(entry[0])
+
+    def clear(self):
+        self._entries.clear()
+        self.size = 0
+
+    def stats(self):
+        total = self.hits + self.misses
+        return dict(entries=len(self), bytes=self.size, hits=self.hits, misses=self.misses,
+                    evictions=self.evictions, hit_rate=self.hits / total if total else 0.0)
+
+
+class GuildSnapshot:
+    """The guild document of a single command invocation, loaded once and shared by every read made during it.
+    A snapshot is dropped once it is older than `max_age` seconds or when the guild is written to"""
+
+    def __init__(self, guild, max_age=5):
+        self.guild = guild
+        self.max_age = max_age
+        self.data = None
+        self.generation = None
+        self.loaded = 0
+
+    def fresh(self, generation):
+        return self.data is not None and self.generation == generation and \
+               time.monotonic() - self.loaded < self.max_age
+
+    def set(self, data, generation):
+        self.data = data
+        self.generation = generation
+        self.loaded = time.monotonic()
+
+    def refresh(self):
+        self.data = None
+
+
+class Query:
+    """A named, parameterized statement.
+    asyncpg prepares each distinct statement text once per connection and reuses its plan,
+    so every statement is written once here and only ever given values as $n parameters.
+    Backends with another SQL dialect register their own form of a statement in `dialects`"""
+    registry = OrderedDict()
+
+    def __init__(self, name, sql):
+        self.name = name
+        self.sql = sql
+        self.dialects = {}
+        self.calls = 0
+        self.time = 0.0
+        Query.registry[name] = self
+
+    def __repr__(self):
+        return f"<Query {self.name} calls={self.calls} time={self.time:.3f}s>"
+
+    def text(self, connection):
+        """The form of the statement for the connection's dialect"""
+        dialect = getattr(connection, "dialect", "postgres")
+        if dialect == "postgres":
+            return self.sql
+        try:
+            return self.dialects[dialect]
+        except KeyError:
+            raise NotImplementedError(f"{self.name} has no {dialect} form") from None
+
+    async def _timed(self, connection, method, args):
+        start = time.perf_counter()
+        try:
+            return await method(self.text(connection), *args)
+        finally:
+            self.calls += 1
+            self.time += time.perf_counter() - start
+
+    async def execute(self, connection, *args):
+        return await self._timed(connection, connection.execute, args)
+
+    async def executemany(self, connection, args):
+        return await self._timed(connection, connection.executemany, (args,))
+
+    async def fetch(self, connection, *args):
+        return await self._timed(connection, connection.fetch, args)
+
+    async def fetchrow(self, connection, *args):
+        return await self._timed(connection, connection.fetchrow, args)
+
+    async def fetchval(self, connection, *args):
+        return await self._timed(connection, connection.fetchval, args)
+
+    @classmethod
+    def stats(cls):
+        return sorted(cls.registry.values(), key=lambda x: -x.time)
+
+
+# User statements
+########################################################################
+# Each user's data is stored as one memberdata row per server. The legacy userdata table,
+# which held every server's data for a user in one document keyed by server id,
+# is only read to adopt entries that haven't been moved over yet
+memberdata_create = Query("memberdata_create", """CREATE TABLE IF NOT EXISTS memberdata (
+    UUID bigint NOT NULL,
+    guild_id bigint NOT NULL,
+    info jsonb NOT NULL,
+    PRIMARY KEY (UUID, guild_id)
+);
+CREATE INDEX IF NOT EXISTS memberdata_guild_id ON memberdata (guild_id)""")
+user_insert = Query("user_insert", """INSERT INTO memberdata (UUID, guild_id, info) VALUES ($1, $2, $3::jsonb)
+ON CONFLICT (UUID, guild_id) DO NOTHING""")
+user_select = Query("user_select", """SELECT m.info || CASE WHEN b.UUID IS NULL THEN '{}'::jsonb
+    ELSE jsonb_build_object('money', b.money, 'bank', b.bank) END
+FROM memberdata AS m LEFT JOIN balances AS b ON b.guild_id = m.guild_id AND b.UUID = m.UUID
+WHERE m.UUID = $1 AND m.guild_id = $2""")
+user_full_select = Query("user_full_select", """SELECT
+    COALESCE((SELECT info FROM userdata WHERE UUID = $1), '{}'::jsonb) ||
+    COALESCE((
+        SELECT jsonb_object_agg(m.guild_id::text, m.info || CASE WHEN b.UUID IS NULL THEN '{}'::jsonb
+            ELSE jsonb_build_object('money', b.money, 'bank', b.bank) END)
+        FROM memberdata AS m LEFT JOIN balances AS b ON b.guild_id = m.guild_id AND b.UUID = m.UUID
+        WHERE m.UUID = $1
+    ), '{}'::jsonb)""")
+user_update = Query("user_update", """WITH member AS (
+    INSERT INTO memberdata (UUID, guild_id, info) VALUES ($1, $2, $3::jsonb)
+    ON CONFLICT (UUID, guild_id) DO UPDATE SET info = EXCLUDED.info
+), balance AS (
+    INSERT INTO balances (guild_id, UUID, money, bank)
+    SELECT $2, $1, COALESCE(($3::jsonb ->> 'money')::float8, 0), COALESCE(($3::jsonb ->> 'bank')::float8, 0)
+    WHERE $3::jsonb ?| ARRAY['money', 'bank']
+    ON CONFLICT (guild_id, UUID) DO UPDATE SET money = EXCLUDED.money, bank = EXCLUDED.bank
+)
+DELETE FROM balances WHERE UUID = $1 AND guild_id = $2 AND NOT $3::jsonb ?| ARRAY['money', 'bank']""")
+user_add = Query("user_add", """WITH legacy AS (
+    SELECT info -> ($2::bigint)::text AS info FROM userdata
+    WHERE UUID = $1 AND jsonb_typeof(info -> ($2::bigint)::text) = 'object'
+), member AS (
+    INSERT INTO memberdata (UUID, guild_id, info)
+    VALUES ($1, $2, COALESCE((SELECT info FROM legacy), $3::jsonb))
+    ON CONFLICT (UUID, guild_id) DO UPDATE SET info = EXCLUDED.info || memberdata.info
+    WHERE NOT memberdata.info ?& ARRAY(SELECT jsonb_object_keys(EXCLUDED.info))
+    RETURNING info, xmax = 0 AS inserted
+), balance AS (
+    INSERT INTO balances (guild_id, UUID, money, bank)
+    SELECT $2, $1, COALESCE((info ->> 'money')::float8, 0), COALESCE((info ->> 'bank')::float8, 0)
+    FROM member WHERE inserted
+    ON CONFLICT (guild_id, UUID) DO NOTHING
+)
+SELECT COALESCE((SELECT inserted FROM member), FALSE) AND NOT EXISTS(SELECT 1 FROM legacy)""")
+user_adopt = Query("user_adopt", """INSERT INTO memberdata (UUID, guild_id, info)
+SELECT UUID, $2::bigint, info -> ($2::bigint)::text FROM userdata
+WHERE UUID = $1 AND jsonb_typeof(info -> ($2::bigint)::text) = 'object'
+ON CONFLICT (UUID, guild_id) DO NOTHING
+RETURNING info""")
+user_backfill = Query("user_backfill", """WITH batch AS (
+    SELECT UUID, info FROM userdata WHERE UUID > $1 ORDER BY UUID LIMIT $2
+), moved AS (
+    INSERT INTO memberdata (UUID, guild_id, info)
+    SELECT batch.UUID, entry.key::bigint, entry.value FROM batch, jsonb_each(batch.info) AS entry
+    WHERE entry.key ~ '^[0-9]+$' AND jsonb_typeof(entry.value) = 'object'
+    ON CONFLICT (UUID, guild_id) DO NOTHING
+    RETURNING 1
+)
+SELECT (SELECT max(UUID) FROM batch) AS last, (SELECT count(*) FROM batch) AS users,
+       (SELECT count(*) FROM moved) AS moved""")
+user_item = Query("user_item", """SELECT info -> $3::text FROM memberdata WHERE UUID = $1 AND guild_id = $2""")
+user_entry_exists = Query("user_entry_exists", """SELECT TRUE FROM memberdata WHERE UUID = $1 AND guild_id = $2""")
+user_set = Query("user_set", """UPDATE memberdata
+SET info = info || $3::jsonb
+WHERE UUID = $1 AND guild_id = $2
+RETURNING TRUE""")
+user_incr = Query("user_incr", """UPDATE memberdata
+SET info = jsonb_set(info, ARRAY[$3::text], to_jsonb(COALESCE((info ->> $3::text)::float8, 0) + $4::float8))
+WHERE UUID = $1 AND guild_id = $2
+  AND ($5::float8 IS NULL OR COALESCE((info ->> $3::text)::float8, 0) + $4::float8 >= $5::float8)
+RETURNING (info ->> $3::text)::float8""")
+user_update_items = Query("user_update_items", """UPDATE memberdata
+SET info = jsonb_set(info, '{items}', (
+    SELECT COALESCE(jsonb_object_agg(key, value), '{}'::jsonb) FROM (
+        SELECT key, value FROM jsonb_each(COALESCE(info -> 'items', '{}'::jsonb))
+        WHERE NOT $3::jsonb ? key
+        UNION ALL
+        SELECT d.key, to_jsonb(COALESCE((info -> 'items' ->> d.key)::float8, 0) + d.value::float8)
+        FROM jsonb_each_text($3::jsonb) AS d
+    ) AS merged
+    WHERE (value #>> '{}')::float8 > 0
+))
+WHERE UUID = $1 AND guild_id = $2
+  AND (NOT $4::bool OR NOT EXISTS (
+      SELECT 1 FROM jsonb_each_text($3::jsonb) AS d
+      WHERE COALESCE((info -> 'items' ->> d.key)::float8, 0) + d.value::float8 < 0))
+RETURNING info -> 'items'""")
+user_modify_select = Query("user_modify_select", """SELECT (
+    SELECT COALESCE(jsonb_object_agg(k, info -> k), '{}'::jsonb)
+    FROM unnest($3::text[]) AS k WHERE info ? k
+)
+FROM memberdata WHERE UUID = $1 AND guild_id = $2
+FOR UPDATE""")
+user_modify_update = Query("user_modify_update", """UPDATE memberdata
+SET info = info || $3::jsonb
+WHERE UUID = $1 AND guild_id = $2""")
+
+# Balance statements
+########################################################################
+# Money and bank balances live in their own table, indexed for leaderboards. A user's row is
+# seeded from the money and bank in their memberdata the first time their balance is touched,
+# after which it overrides them
+balances_create = Query("balances_create", """CREATE TABLE IF NOT EXISTS balances (
+    guild_id bigint NOT NULL,
+    UUID bigint NOT NULL,
+    money float8 NOT NULL DEFAULT 0,
+    bank float8 NOT NULL DEFAULT 0,
+    PRIMARY KEY (guild_id, UUID)
+);
+CREATE INDEX IF NOT EXISTS balances_leaderboard ON balances (guild_id, money DESC)""")
+balance_seed = Query("balance_seed", """INSERT INTO balances (guild_id, UUID, money, bank)
+SELECT guild_id, UUID, COALESCE((info ->> 'money')::float8, 0), COALESCE((info ->> 'bank')::float8, 0)
+FROM memberdata WHERE UUID = $1 AND guild_id = $2
+ON CONFLICT (guild_id, UUID) DO NOTHING""")
+balance_backfill = Query("balance_backfill", """WITH batch AS (
+    SELECT UUID, guild_id, info FROM memberdata WHERE (UUID, guild_id) > ($1, $2)
+    ORDER BY UUID, guild_id LIMIT $3
+), moved AS (
+    INSERT INTO balances (guild_id, UUID, money, bank)
+    SELECT guild_id, UUID, COALESCE((info ->> 'money')::float8, 0), COALESCE((info ->> 'bank')::float8, 0)
+    FROM batch
+    ON CONFLICT (guild_id, UUID) DO NOTHING
+    RETURNING 1
+)
+SELECT last.UUID AS last_user, last.guild_id AS last_guild,
+       (SELECT count(*) FROM batch) AS users, (SELECT count(*) FROM moved) AS moved
+FROM (SELECT UUID, guild_id FROM batch ORDER BY UUID DESC, guild_id DESC LIMIT 1) AS last""")
+balance_select = Query("balance_select", """SELECT money, bank FROM balances WHERE UUID = $1 AND guild_id = $2""")
+balance_exists = Query("balance_exists", """SELECT TRUE FROM balances WHERE UUID = $1 AND guild_id = $2""")
+balance_incr = Query("balance_incr", """UPDATE balances SET money = money + $3, bank = bank + $4
+WHERE UUID = $1 AND guild_id = $2 AND ($5::float8 IS NULL OR money + $3 >= $5::float8)
+RETURNING money, bank""")
+balance_set = Query("balance_set", """UPDATE balances SET money = COALESCE($3, money), bank = COALESCE($4, bank)
+WHERE UUID = $1 AND guild_id = $2
+RETURNING money, bank""")
+balance_take = Query("balance_take", """UPDATE balances
+SET money = money - $3, bank = bank + LEAST(money - $3, 0)
+WHERE UUID = $1 AND guild_id = $2 AND bank + LEAST(money - $3, 0) >= 0
+RETURNING money, bank""")
+guild_balances = Query("guild_balances", """SELECT UUID, money FROM balances WHERE guild_id = $1
+ORDER BY money DESC LIMIT $2 OFFSET $3""")
+
+# Market statements
+########################################################################
+# Player market listings are stored one per row. A server's listings were moved out of the
+# market_items of its guild document by a migration
+market_create = Query("market_create", """CREATE TABLE IF NOT EXISTS market_listings (
+    guild_id bigint NOT NULL,
+    id text NOT NULL,
+    item text NOT NULL,
+    user_id bigint NOT NULL,
+    cost float8 NOT NULL,
+    amount integer NOT NULL,
+    created timestamptz NOT NULL DEFAULT now(),
+    PRIMARY KEY (guild_id, id)
+);
+CREATE INDEX IF NOT EXISTS market_listings_item ON market_listings (guild_id, item, cost);
+CREATE INDEX IF NOT EXISTS market_listings_user ON market_listings (guild_id, user_id)""")
+market_insert = Query("market_insert", """INSERT INTO market_listings (guild_id, id, item, user_id, cost, amount)
+VALUES ($1, $2, $3, $4, $5, $6)
+ON CONFLICT (guild_id, id) DO NOTHING
+RETURNING TRUE""")
+market_select = Query("market_select", """SELECT id, item, user_id AS "user", cost, amount FROM market_listings
+WHERE guild_id = $1 AND id = $2""")
+market_delete = Query("market_delete", """DELETE FROM market_listings
+WHERE guild_id = $1 AND id = $2 AND ($3::bigint IS NULL OR user_id = $3::bigint)
+RETURNING id, item, user_id AS "user", cost, amount""")
+market_all = Query("market_all", """SELECT id, item, user_id AS "user", cost, amount FROM market_listings
+WHERE guild_id = $1 ORDER BY created, id""")
+market_search = Query("market_search", """SELECT id, item, user_id AS "user", cost, amount FROM market_listings
+WHERE guild_id = $1 AND item = $2 ORDER BY cost, created""")
+market_by_user = Query("market_by_user", """SELECT id, item, user_id AS "user", cost, amount FROM market_listings
+WHERE guild_id = $1 AND user_id = $2 ORDER BY created, id""")
+
+# Character statements
+########################################################################
+# Characters are stored one per row as their Character tuple, and aliases one per row pointing
+# at a character's name. A server's characters and caliases were moved out of its guild document
+# by a migration
+characters_create = Query("characters_create", """CREATE TABLE IF NOT EXISTS characters (
+    guild_id bigint NOT NULL,
+    name text NOT NULL,
+    owner bigint NOT NULL,
+    info jsonb NOT NULL,
+    PRIMARY KEY (guild_id, name)
+);
+CREATE INDEX IF NOT EXISTS characters_owner ON characters (guild_id, owner);
+CREATE TABLE IF NOT EXISTS character_aliases (
+    guild_id bigint NOT NULL,
+    alias text NOT NULL,
+    name text NOT NULL,
+    PRIMARY KEY (guild_id, alias)
+)""")
+character_select = Query("character_select", """SELECT info FROM characters
+WHERE guild_id = $1 AND name = COALESCE(
+    (SELECT name FROM character_aliases WHERE guild_id = $1 AND alias = $2), $2
+)""")
+character_upsert = Query("character_upsert", """INSERT INTO characters (guild_id, name, owner, info)
+VALUES ($1, $2, $3, $4::jsonb)
+ON CONFLICT (guild_id, name) DO UPDATE SET owner = EXCLUDED.owner, info = EXCLUDED.info""")
+character_insert = Query("character_insert", """INSERT INTO characters (guild_id, name, owner, info)
+VALUES ($1, $2, $3, $4::jsonb)
+ON CONFLICT (guild_id, name) DO NOTHING""")
+character_delete = Query("character_delete", """DELETE FROM characters WHERE guild_id = $1 AND name = $2""")
+character_by_owner = Query("character_by_owner", """SELECT info FROM characters
+WHERE guild_id = $1 AND owner = $2 ORDER BY name""")
+character_all = Query("character_all", """SELECT info FROM characters WHERE guild_id = $1 ORDER BY name""")
+character_names = Query("character_names", """SELECT name FROM characters WHERE guild_id = $1
+ORDER BY name LIMIT $2 OFFSET $3""")
+character_count = Query("character_count", """SELECT count(*) FROM characters WHERE guild_id = $1""")
+character_name_taken = Query("character_name_taken", """SELECT
+    EXISTS(SELECT 1 FROM characters WHERE guild_id = $1 AND name = $2) OR
+    EXISTS(SELECT 1 FROM character_aliases WHERE guild_id = $1 AND alias = $2)""")
+character_set_pos = Query("character_set_pos", """UPDATE characters
+SET info = jsonb_set(info, '{5,maps}', COALESCE(info #> '{5,maps}', '{}'::jsonb) || jsonb_build_object($3::text, $4::jsonb))
+WHERE guild_id = $1 AND name = $2
+RETURNING TRUE""")
+character_team_add = Query("character_team_add", """UPDATE characters
+SET info = jsonb_set(info, '{4}', (info -> 4) || to_jsonb($3::bigint))
+WHERE guild_id = $1 AND name = $2 AND jsonb_array_length(info -> 4) < 6
+RETURNING TRUE""")
+character_team_remove = Query("character_team_remove", """UPDATE characters
+SET info = jsonb_set(info, '{4}', COALESCE(
+    (SELECT jsonb_agg(x) FROM jsonb_array_elements(info -> 4) AS x WHERE x <> to_jsonb($3::bigint)), '[]'::jsonb
+))
+WHERE guild_id = $1 AND name = $2
+RETURNING TRUE""")
+alias_select = Query("alias_select", """SELECT name FROM character_aliases WHERE guild_id = $1 AND alias = $2""")
+alias_insert = Query("alias_insert", """INSERT INTO character_aliases (guild_id, alias, name) VALUES ($1, $2, $3)
+ON CONFLICT (guild_id, alias) DO NOTHING
+RETURNING TRUE""")
+alias_delete = Query("alias_delete", """DELETE FROM character_aliases WHERE guild_id = $1 AND alias = $2""")
+
+# Server statements
+########################################################################
+# Every write to a guild's document bumps its version, so a writer can make its write conditional
+# on nobody else having written since it read
+guilddata_version = Query("guilddata_version", """ALTER TABLE guilddata
+ADD COLUMN IF NOT EXISTS version bigint NOT NULL DEFAULT 0""")
+guild_insert = Query("guild_insert", """INSERT INTO guilddata (UUID, info, schema_version) VALUES ($1, $2::jsonb, $3)
+RETURNING version""")
+guild_select = Query("guild_select", """SELECT info::text, version FROM guilddata WHERE UUID = $1""")
+guild_update = Query("guild_update", """UPDATE guilddata SET info = $2::jsonb, version = version + 1 WHERE UUID = $1
+RETURNING version""")
+guild_cas = Query("guild_cas", """UPDATE guilddata SET info = $2::jsonb, version = version + 1
+WHERE UUID = $1 AND version = $3
+RETURNING version""")
+guild_add = Query("guild_add", """INSERT INTO guilddata (UUID, info, schema_version) VALUES ($1, $2::jsonb, $3)
+ON CONFLICT (UUID) DO NOTHING""")
+guild_load = Query("guild_load", """WITH inserted AS (
+    INSERT INTO guilddata (UUID, info, schema_version) VALUES ($1, $2::jsonb, $3)
+    ON CONFLICT (UUID) DO NOTHING
+    RETURNING info::text, version
+)
+SELECT info::text, version FROM guilddata WHERE UUID = $1
+UNION ALL
+SELECT info, version FROM inserted
+LIMIT 1""")
+guild_upsert = Query("guild_upsert", """INSERT INTO guilddata (UUID, info, schema_version) VALUES ($1, $2::jsonb, $3)
+ON CONFLICT (UUID) DO UPDATE SET info = EXCLUDED.info, version = guilddata.version + 1
+RETURNING version""")
+# Section statements project or write only some top level keys of a guild's data,
+# so that reading the currency doesn't ship and decode the maps along with it
+guild_sections = Query("guild_sections", """SELECT (
+    SELECT COALESCE(jsonb_object_agg(key, info -> key), '{}'::jsonb) FROM unnest($2::text[]) AS key WHERE info ? key
+) FROM guilddata WHERE UUID = $1""")
+guild_set_sections = Query("guild_set_sections", """UPDATE guilddata SET info = info || $2::jsonb, version = version + 1
+WHERE UUID = $1
+RETURNING version""")
+guild_merge_section = Query("guild_merge_section", """UPDATE guilddata SET info = info || jsonb_build_object($2::text,
+    CASE WHEN jsonb_typeof(info -> $2::text) = 'object' THEN info -> $2::text ELSE '{}'::jsonb END || $3::jsonb
+), version = version + 1
+WHERE UUID = $1
+RETURNING version""")
+guild_remove_entries = Query("guild_remove_entries", """UPDATE guilddata
+SET info = jsonb_set(info, ARRAY[$2::text], (info -> $2::text) - $3::text[]), version = version + 1
+WHERE UUID = $1 AND jsonb_typeof(info -> $2::text) = 'object'
+RETURNING version""")
+# Schema statements, see migrations. Documents from before versioning are at 0
+guilddata_schema = Query("guilddata_schema", """ALTER TABLE guilddata
+ADD COLUMN IF NOT EXISTS schema_version integer NOT NULL DEFAULT 0""")
+guild_schema = Query("guild_schema", """SELECT schema_version FROM guilddata WHERE UUID = $1""")
+guild_migrate_select = Query("guild_migrate_select", """SELECT info::text, version, schema_version FROM guilddata
+WHERE UUID = $1""")
+guild_migrate = Query("guild_migrate", """UPDATE guilddata SET info = $2::jsonb, version = version + 1, schema_version = $4
+WHERE UUID = $1 AND version = $3
+RETURNING version""")
+guild_outdated = Query("guild_outdated", """SELECT UUID FROM guilddata WHERE schema_version < $1 AND UUID > $2
+ORDER BY UUID LIMIT $3""")
+guild_salaries = Query("guild_salaries", """SELECT UUID, info -> 'salaries' AS salaries FROM guilddata
+WHERE info -> 'salaries' <> '{}'::jsonb""")
+
+# Cold sections, see COLD_SECTIONS, each packed in a row of their own. They are moved out of a server's
+# guild document by a migration, and writes to the rest of the document never touch them.
+# The data is already compressed, so it is stored out of line without TOAST compressing it again
+blobs_create = Query("blobs_create", """CREATE TABLE IF NOT EXISTS guild_blobs (
+    guild_id bigint NOT NULL,
+    name text NOT NULL,
+    data bytea NOT NULL,
+    version bigint NOT NULL DEFAULT 0,
+    PRIMARY KEY (guild_id, name)
+);
+ALTER TABLE guild_blobs ALTER COLUMN data SET STORAGE EXTERNAL""")
+blob_select = Query("blob_select", """SELECT name, data FROM guild_blobs
+WHERE guild_id = $1 AND name = ANY($2::text[])""")
+blob_lock = Query("blob_lock", """SELECT data FROM guild_blobs WHERE guild_id = $1 AND name = $2 FOR UPDATE""")
+blob_upsert = Query("blob_upsert", """INSERT INTO guild_blobs (guild_id, name, data) VALUES ($1, $2, $3::bytea)
+ON CONFLICT (guild_id, name) DO UPDATE SET data = EXCLUDED.data, version = guild_blobs.version + 1
+RETURNING version""")
+blob_insert = Query("blob_insert", """INSERT INTO guild_blobs (guild_id, name, data) VALUES ($1, $2, $3::bytea)
+ON CONFLICT (guild_id, name) DO NOTHING""")
+
+
+# Archive statements
+########################################################################
+# Servers the bot has left, or that have had no activity for a while, have all of their rows
+# packed into one archive row and removed from the hot tables. They are put back the next time they are used
+archive_create = Query("archive_create", """CREATE TABLE IF NOT EXISTS guild_archive (
+    guild_id bigint PRIMARY KEY,
+    data bytea NOT NULL,
+    reason text NOT NULL,
+    size integer NOT NULL,
+    archived timestamptz NOT NULL DEFAULT now()
+);
+ALTER TABLE guild_archive ALTER COLUMN data SET STORAGE EXTERNAL;
+ALTER TABLE guilddata ADD COLUMN IF NOT EXISTS last_active timestamptz NOT NULL DEFAULT now()""")
+archive_insert = Query("archive_insert", """INSERT INTO guild_archive (guild_id, data, reason, size)
+VALUES ($1, $2::bytea, $3, $4)
+ON CONFLICT (guild_id) DO UPDATE SET data = EXCLUDED.data, reason = EXCLUDED.reason, size = EXCLUDED.size,
+    archived = now()""")
+archive_take = Query("archive_take", """DELETE FROM guild_archive WHERE guild_id = $1 RETURNING data""")
+archive_ids = Query("archive_ids", """SELECT guild_id FROM guild_archive""")
+archive_report = Query("archive_report", """SELECT guild_id, reason, size, archived FROM guild_archive
+ORDER BY archived DESC LIMIT $1""")
+archive_totals = Query("archive_totals", """SELECT count(*), COALESCE(sum(size), 0) FROM guild_archive""")
+archive_members = Query("archive_members", """SELECT UUID, info FROM memberdata WHERE guild_id = $1""")
+archive_balances = Query("archive_balances", """SELECT UUID, money, bank FROM balances WHERE guild_id = $1""")
+archive_listings = Query("archive_listings", """SELECT id, item, user_id, cost, amount, created::text
+FROM market_listings WHERE guild_id = $1""")
+archive_characters = Query("archive_characters", """SELECT name, owner, info FROM characters WHERE guild_id = $1""")
+archive_aliases = Query("archive_aliases", """SELECT alias, name FROM character_aliases WHERE guild_id = $1""")
+archive_blobs = Query("archive_blobs", """SELECT name, data FROM guild_blobs WHERE guild_id = $1""")
+archive_delete = Query("archive_delete", """WITH members AS (
+    DELETE FROM memberdata WHERE guild_id = $1
+), balances AS (
+    DELETE FROM balances WHERE guild_id = $1
+), listings AS (
+    DELETE FROM market_listings WHERE guild_id = $1
+), characters AS (
+    DELETE FROM characters WHERE guild_id = $1
+), aliases AS (
+    DELETE FROM character_aliases WHERE guild_id = $1
+), blobs AS (
+    DELETE FROM guild_blobs WHERE guild_id = $1
+)
+DELETE FROM guilddata WHERE UUID = $1""")
+restore_guild = Query("restore_guild", """INSERT INTO guilddata (UUID, info, version, schema_version)
+VALUES ($1, $2::jsonb, $3, 0)
+ON CONFLICT (UUID) DO UPDATE SET info = EXCLUDED.info, version = GREATEST(guilddata.version, EXCLUDED.version) + 1,
+    schema_version = 0""")
+restore_balance = Query("restore_balance", """INSERT INTO balances (guild_id, UUID, money, bank) VALUES ($1, $2, $3, $4)
+ON CONFLICT (guild_id, UUID) DO NOTHING""")
+restore_listing = Query("restore_listing", """INSERT INTO market_listings (guild_id, id, item, user_id, cost, amount, created)
+VALUES ($1, $2, $3, $4, $5, $6, $7::text::timestamptz)
+ON CONFLICT (guild_id, id) DO NOTHING""")
+guild_touch = Query("guild_touch", """UPDATE guilddata SET last_active = now() WHERE UUID = ANY($1::bigint[])""")
+guild_inactive = Query("guild_inactive", """SELECT UUID FROM guilddata
+WHERE last_active < now() - make_interval(days => $1)
+ORDER BY last_active LIMIT $2""")
+guild_ids = Query("guild_ids", """SELECT UUID FROM guilddata""")
+
+
+# Transfer statements
+########################################################################
+# Every party's rows are locked in user id order before anything is moved,
+# so transfers running at once, in this process or another, queue up instead of deadlocking
+transfer_lock_members = Query("transfer_lock_members", """SELECT UUID FROM memberdata
+WHERE guild_id = $1 AND UUID = ANY($2::bigint[])
+ORDER BY UUID
+FOR UPDATE""")
+transfer_lock_balances = Query("transfer_lock_balances", """SELECT UUID FROM balances
+WHERE guild_id = $1 AND UUID = ANY($2::bigint[])
+ORDER BY UUID
+FOR UPDATE""")
+
+
+class TransferResult(NamedTuple):
+    """The outcome of a transfer. If not `ok`, `reason` is which check failed
+    ("listing", "money", "items" or "pet") and `user` whose, and nothing was changed"""
+    ok: bool
+    reason: str = None
+    user: int = None
+    balances: dict = None
+    items: dict = None
+    pets: list = None
+    listing: dict = None
+
+
+class VersionConflict(Exception):
+    """A conditional write to a guild's data found it had been written to since it was read"""
+
+    def __init__(self, guild_id, version):
+        super().__init__(f"Guild {guild_id} is no longer at version {version}")
+        self.guild_id = guild_id
+        self.version = version
 
-class Database:
-    def __init__(self, bot):
-        self.bot = bot
+
+class _TransferAborted(Exception):
+    def __init__(self, reason, user=None):
+        super().__init__(reason, user)
+        self.reason = reason
+        self.user = user
+
+
+# Timer statements
+########################################################################
+# Long lived timers from the scheduler, due at a unix timestamp
+timers_create = Query("timers_create", """CREATE TABLE IF NOT EXISTS timers (
+    id bigserial PRIMARY KEY,
+    due float8 NOT NULL,
+    kind text NOT NULL,
+    payload jsonb NOT NULL
+)""")
+timer_insert = Query("timer_insert", """INSERT INTO timers (due, kind, payload) VALUES ($1, $2, $3) RETURNING id""")
+timer_delete = Query("timer_delete", """DELETE FROM timers WHERE id = $1""")
+timer_all = Query("timer_all", """SELECT id, due, kind, payload FROM timers ORDER BY due""")
+
+
+# Lock statements
+########################################################################
+advisory_try_lock = Query("advisory_try_lock", """SELECT pg_try_advisory_lock($1::bigint)""")
+advisory_unlock = Query("advisory_unlock", """SELECT pg_advisory_unlock($1::bigint)""")
+
+
+# Write-behind statements
+########################################################################
+# Increments waiting in the write-behind buffer are copied into a per-connection staging table
+# and applied to every user in it with one statement per table
+pending_create = Query("pending_create", """CREATE TEMP TABLE IF NOT EXISTS pending_user_writes (
+    UUID bigint NOT NULL,
+    guild_id bigint NOT NULL,
+    money float8 NOT NULL,
+    bank float8 NOT NULL,
+    items jsonb NOT NULL
+) ON COMMIT DELETE ROWS""")
+pending_adopt = Query("pending_adopt", """INSERT INTO memberdata (UUID, guild_id, info)
+SELECT p.UUID, p.guild_id, COALESCE(u.info -> p.guild_id::text, $1::jsonb)
+FROM pending_user_writes AS p
+LEFT JOIN userdata AS u ON u.UUID = p.UUID AND jsonb_typeof(u.info -> p.guild_id::text) = 'object'
+ON CONFLICT (UUID, guild_id) DO NOTHING""")
+pending_seed = Query("pending_seed", """INSERT INTO balances (guild_id, UUID, money, bank)
+SELECT m.guild_id, m.UUID, COALESCE((m.info ->> 'money')::float8, 0), COALESCE((m.info ->> 'bank')::float8, 0)
+FROM pending_user_writes AS p JOIN memberdata AS m ON m.UUID = p.UUID AND m.guild_id = p.guild_id
+WHERE p.money <> 0 OR p.bank <> 0
+ON CONFLICT (guild_id, UUID) DO NOTHING""")
+pending_balances = Query("pending_balances", """UPDATE balances AS b
+SET money = b.money + p.money, bank = b.bank + p.bank
+FROM pending_user_writes AS p
+WHERE b.UUID = p.UUID AND b.guild_id = p.guild_id AND (p.money <> 0 OR p.bank <> 0)""")
+pending_items = Query("pending_items", """UPDATE memberdata AS m
+SET info = jsonb_set(m.info, '{items}', (
+    SELECT COALESCE(jsonb_object_agg(key, value), '{}'::jsonb) FROM (
+        SELECT key, value FROM jsonb_each(COALESCE(m.info -> 'items', '{}'::jsonb))
+        WHERE NOT p.items ? key
+        UNION ALL
+        SELECT d.key, to_jsonb(COALESCE((m.info -> 'items' ->> d.key)::float8, 0) + d.value::float8)
+        FROM jsonb_each_text(p.items) AS d
+    ) AS merged
+    WHERE (value #>> '{}')::float8 > 0
+))
+FROM pending_user_writes AS p
+WHERE m.UUID = p.UUID AND m.guild_id = p.guild_id AND p.items <> '{}'::jsonb""")
+
+# Experience statements
+########################################################################
+# Accumulated experience is staged the same way. The gains are copied in, the current levels read
+# under a row lock, and the levels worked out from them replace the gains before one update applies them
+exp_create = Query("exp_create", """CREATE TEMP TABLE IF NOT EXISTS pending_exp (
+    UUID bigint NOT NULL,
+    guild_id bigint NOT NULL,
+    exp bigint NOT NULL,
+    level integer
+) ON COMMIT DELETE ROWS""")
+exp_adopt = Query("exp_adopt", """INSERT INTO memberdata (UUID, guild_id, info)
+SELECT p.UUID, p.guild_id, COALESCE(u.info -> p.guild_id::text, $1::jsonb)
+FROM pending_exp AS p
+LEFT JOIN userdata AS u ON u.UUID = p.UUID AND jsonb_typeof(u.info -> p.guild_id::text) = 'object'
+ON CONFLICT (UUID, guild_id) DO NOTHING""")
+exp_select = Query("exp_select", """SELECT p.UUID, p.guild_id, p.exp AS gain,
+    COALESCE((m.info ->> 'level')::float8, 0) AS level, COALESCE((m.info ->> 'exp')::float8, 0) AS exp
+FROM pending_exp AS p JOIN memberdata AS m ON m.UUID = p.UUID AND m.guild_id = p.guild_id
+FOR UPDATE OF m""")
+exp_clear = Query("exp_clear", """DELETE FROM pending_exp""")
+exp_apply = Query("exp_apply", """UPDATE memberdata AS m
+SET info = m.info || jsonb_build_object('level', p.level, 'exp', p.exp)
+FROM pending_exp AS p
+WHERE m.UUID = p.UUID AND m.guild_id = p.guild_id""")
+
+
+class WriteBehind:
+    """Coalesces unguarded balance and item increments per (user, server) and writes them out in batches.
+    Changes are written at most `max_delay` seconds after being queued, which bounds what a crash can lose,
+    or as soon as `max_pending` users have changes waiting"""
+
+    def __init__(self, db, max_delay=2.0, max_pending=500):
+        self.db = db
+        self.max_delay = max_delay
+        self.max_pending = max_pending
+        self.pending = {}
+        self.lock = asyncio.Lock()
+        self.flushes = 0
+        self.written = 0
+        self.time = 0.0
+        self._timer = None
+
+    def __len__(self):
+        return len(self.pending)
+
+    def add(self, member, money=0, bank=0, items=None):
+        """Queue increments to a user's balances and items"""
+        self._merge((member.id, member.guild.id), money, bank, items)
+        if len(self.pending) >= self.max_pending:
+            self._fire()
+        elif self._timer is None:
+            self._timer = asyncio.get_event_loop().call_later(self.max_delay, self._fire)
+
+    def _merge(self, key, money, bank, items):
+        entry = self.pending.get(key)
+        if entry is None:
+            entry = self.pending[key] = [0, 0, Counter()]
+        entry[0] += money
+        entry[1] += bank
+        if items:
+            entry[2].update(items)
+
+    def _fire(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        asyncio.ensure_future(self.flush())
+
+    async def settle(self, key=None):
+        """Wait until nothing queued for `key` (or anyone, if None) is left unwritten"""
+        if self.lock.locked() or (self.pending if key is None else key in self.pending):
+            await self.flush()
+
+    async def flush(self):
+        """Write every queued change in one transaction"""
+        async with self.lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if not self.pending:
+                return
+
+            pending, self.pending = self.pending, {}
+            records = [(uuid, guild_id, money, bank, dict(items))
+                       for (uuid, guild_id), (money, bank, items) in pending.items()]
+            start = time.perf_counter()
+            try:
+                async with self.db._conn.acquire() as connection:
+                    async with connection.transaction():
+                        await pending_create.execute(connection)
+                        await connection.copy_records_to_table("pending_user_writes", records=records)
+                        await pending_adopt.execute(connection, self.db.bot.default_udata)
+                        await pending_seed.execute(connection)
+                        await pending_balances.execute(connection)
+                        await pending_items.execute(connection)
+            except Exception:
+                for key, (money, bank, items) in pending.items():
+                    self._merge(key, money, bank, items)
+                if self._timer is None:
+                    self._timer = asyncio.get_event_loop().call_later(self.max_delay, self._fire)
+                raise
+            finally:
+                elapsed = time.perf_counter() - start
+                self.flushes += 1
+                self.time += elapsed
+                self.db.bot.stats.gauge("RPGBot.writebehind.pending", len(records), host="scw-8112e8")
+                self.db.bot.stats.histogram("RPGBot.writebehind.flush", elapsed, host="scw-8112e8")
+
+            self.written += len(records)
+
+    def stats(self):
+        return dict(pending=len(self), flushes=self.flushes, written=self.written, time=self.time)
+
+
+class ExpAccumulator:
+    """Adds up the experience users earn per (user, server) and writes it out every `interval` seconds,
+    or as soon as `max_pending` users have some waiting. Levels are worked out as it is written,
+    and a level_up event is dispatched with the last message that earned experience for each level gained"""
+
+    def __init__(self, db, interval=5.0, max_pending=1000):
+        self.db = db
+        self.interval = interval
+        self.max_pending = max_pending
+        self.pending = {}
+        self.lock = asyncio.Lock()
+        self.flushes = 0
+        self.written = 0
+        self.levels = 0
+        self._timer = None
+
+    def __len__(self):
+        return len(self.pending)
+
+    def add(self, member, exp, message=None):
+        """Queue experience for a user, and the message that earned it"""
+        key = member.id, member.guild.id
+        entry = self.pending.get(key)
+        if entry is None:
+            self.pending[key] = [exp, message]
+        else:
+            entry[0] += exp
+            entry[1] = message or entry[1]
+
+        if len(self.pending) >= self.max_pending:
+            self._fire()
+        elif self._timer is None:
+            self._timer = asyncio.get_event_loop().call_later(self.interval, self._fire)
+
+    def _fire(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        asyncio.ensure_future(self.flush())
+
+    def _level(self, level, exp):
+        next = self.db.bot.get_exp(level)
+        while exp > next:
+            level += 1
+            exp -= next
+            next = self.db.bot.get_exp(level)
+        return level, exp
+
+    async def flush(self):
+        """Write every user's queued experience in one transaction"""
+        async with self.lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if not self.pending:
+                return
+
+            pending, self.pending = self.pending, {}
+            leveled = []
+            try:
+                async with self.db._conn.acquire() as connection:
+                    async with connection.transaction():
+                        await exp_create.execute(connection)
+                        await connection.copy_records_to_table(
+                            "pending_exp", columns=("uuid", "guild_id", "exp"),
+                            records=[(uuid, guild_id, exp) for (uuid, guild_id), (exp, _) in pending.items()])
+                        await exp_adopt.execute(connection, self.db.bot.default_udata)
+                        records = []
+                        for row in await exp_select.fetch(connection):
+                            start = int(row["level"])
+                            level, exp = self._level(start, int(row["exp"]) + row["gain"])
+                            records.append((row["uuid"], row["guild_id"], exp, level))
+                            if level > start:
+                                leveled.append(((row["uuid"], row["guild_id"]), level))
+                        await exp_clear.execute(connection)
+                        await connection.copy_records_to_table("pending_exp", columns=("uuid", "guild_id", "exp", "level"),
+                                                               records=records)
+                        await exp_apply.execute(connection)
+            except Exception:
+                for (uuid, guild_id), (exp, message) in pending.items():
+                    entry = self.pending.setdefault((uuid, guild_id), [0, message])
+                    entry[0] += exp
+                if self._timer is None:
+                    self._timer = asyncio.get_event_loop().call_later(self.interval, self._fire)
+                raise
+
+            self.flushes += 1
+            self.written += len(pending)
+            self.levels += len(leveled)
+
+        for key, level in leveled:
+            message = pending[key][1]
+            if message is not None:
+                self.db.bot.dispatch("level_up", message, level)
+
+    def stats(self):
+        return dict(pending=len(self), flushes=self.flushes, written=self.written, levels=self.levels)
+
+
+class Archiver:
+    """Periodically archives the data of up to `batch` servers the bot has left, and as many that
+    have had no activity for `inactive_days`, every `interval` seconds"""
+
+    def __init__(self, db, inactive_days=180, interval=6 * 3600, batch=25):
+        self.db = db
+        self.inactive_days = inactive_days
+        self.interval = interval
+        self.batch = batch
+        self.archived = Counter()
+
+    async def run(self):
+        await self.db.bot.wait_until_ready()
+        while not self.db.bot.is_closed():
+            try:
+                await self.sweep()
+            except Exception:
+                logging.exception("Archiving failed")
+            await asyncio.sleep(self.interval)
+
+    async def sweep(self):
+        """Archive the servers that are due, returning how many were"""
+        await self.db.flush_activity()
+        present = {guild.id for guild in self.db.bot.guilds}
+        left = [x for x in await self.db.stored_guilds() if x not in present][:self.batch]
+        inactive = await self.db.inactive_guilds(self.inactive_days, self.batch)
+        for reason, ids in (("left", left), ("inactive", inactive)):
+            for guild_id in ids:
+                # Skip any used since the activity was written out
+                if guild_id not in self.db.active:
+                    await self.db.archive_guild(guild_id, reason)
+                    self.archived[reason] += 1
+        return len(left) + len(inactive)
+
+
+class GuildWriter:
+    """Applies a guild's queued mutations in batches from a single task, which exits once the queue is empty.
+    Every mutation queued within a `tick` is applied to one copy of the data and committed in one conditional write,
+    each caller getting back its own mutation's result or exception"""
+
+    def __init__(self, db, guild, tick=0.05, retries=8):
+        self.db = db
+        self.guild = guild
+        self.tick = tick
+        self.retries = retries
+        self.pending = []
+        self.task = None
+
+    def submit(self, func):
+        """Queue a mutation, returning a future for its result"""
+        future = asyncio.get_event_loop().create_future()
+        self.pending.append((func, future))
+        if self.task is None:
+            # Run in a fresh context so the writer doesn't update the first submitter's snapshot
+            self.task = contextvars.Context().run(asyncio.ensure_future, self.run())
+        return future
+
+    async def run(self):
+        try:
+            while self.pending:
+                await asyncio.sleep(self.tick)
+                batch, self.pending = [x for x in self.pending if not x[1].cancelled()], []
+                if not batch:
+                    continue
+                try:
+                    await self.commit(batch)
+                except Exception as e:
+                    for _, future in batch:
+                        if not future.done():
+                            future.set_exception(e)
+        finally:
+            self.task = None
+            if self.db.writers.get(self.guild.id) is self:
+                del self.db.writers[self.guild.id]
+
+    async def commit(self, batch):
+        for attempt in range(self.retries):
+            data, version = await self.db.load_guild_version(self.guild)
+            base = dumps(data)
+            applied = []
+            outcomes = []
+            for func, future in batch:
+                try:
+                    outcomes.append((future, func(data), None))
+                    applied.append(func)
+                except Exception as e:
+                    # Start over from the read, so a failed mutation leaves nothing half applied
+                    outcomes.append((future, None, e))
+                    data = loads(base)
+                    for done in applied:
+                        done(data)
+
+            try:
+                if applied:
+                    await self.db.update_guild_data(self.guild, data, expected_version=version)
+                    self.db.group_commits.update(writes=1, mutations=len(applied))
+            except VersionConflict:
+                await asyncio.sleep(random.uniform(0, min(0.01 * 2 ** attempt, 1)))
+                continue
+            except Exception as e:
+                outcomes = [(future, None, e) for future, _, _ in outcomes]
+
+            for future, result, error in outcomes:
+                if future.done():
+                    continue
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(result)
+            return
+
+        for func, future in batch:
+            if not future.done():
+                future.set_exception(VersionConflict(self.guild.id, version))
+
+
+class AdvisoryLocks:
+    """A ResourceManager backend that also takes its locks as Postgres session advisory locks,
+    so they're held against every process using the database.
+    The locks live on a connection of their own outside the pool, so holders don't take pooled connections away
+    from the work they do while holding them. Locks are only ever tried, backing off from `poll` up to
+    `max_poll` seconds between tries, so waiting on another process never ties up the connection"""
+
+    def __init__(self, db, poll=0.05, max_poll=1.0):
+        self.db = db
+        self.poll = poll
+        self.max_poll = max_poll
+        self.connection = None
+        self.lock = asyncio.Lock()
 
     @staticmethod
-    def dump(data):
-        return json.dumps(data).replace("'", "''")
+    def key(resource):
+        """The bigint key of a resource, ids are used as they are and anything else is hashed"""
+        if isinstance(resource, int) and -2 ** 63 <= resource < 2 ** 63:
+            return resource
+        return int.from_bytes(hashlib.blake2b(repr(resource).encode(), digest_size=8).digest(), "big", signed=True)
+
+    async def _run(self, query, key):
+        async with self.lock:
+            if self.connection is None or self.connection.is_closed():
+                # Session locks don't outlive their connection, so a lost connection has dropped them all
+                self.connection = await self.db.backend.connect_locks()
+            return await query.fetchval(self.connection, key)
+
+    async def acquire(self, resources):
+        # Ordered by key rather than by the caller's order, which other processes may not agree on
+        keys = sorted({self.key(x) for x in resources})
+        taken = []
+        try:
+            for key in keys:
+                delay = self.poll
+                while not await self._run(advisory_try_lock, key):
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, self.max_poll)
+                taken.append(key)
+        except BaseException:
+            await asyncio.shield(self.release(taken))
+            raise
+        return taken
+
+    async def release(self, keys):
+        for key in reversed(keys):
+            await self._run(advisory_unlock, key)
+
+
+class PostgresBackend:
+    """Runs the statements as written on an asyncpg pool"""
+    dialect = "postgres"
+
+    def __init__(self, user='root', password='root', database='pokerpg', host='127.0.0.1', port=5432,
+                 min_size=10, max_size=10, **options):
+        self.options = dict(user=user, password=password, database=database, host=host, port=port,
+                            min_size=min_size, max_size=max_size, **options)
+
+    async def connect(self):
+        """Create the pool, which hands out connections with `acquire()`"""
+        return await asyncpg.create_pool(**self.options, init=init_connection)
+
+    async def connect_locks(self):
+        """Open a connection outside the pool to hold advisory locks on"""
+        options = {k: v for k, v in self.options.items() if k not in ("min_size", "max_size")}
+        return await asyncpg.connect(**options)
+
+
+def load_config(path=os.path.join("resources", "database.json")):
+    """Read the database configuration, empty if there isn't any"""
+    try:
+        with open(path) as df:
+            return json.loads(df.read())
+    except FileNotFoundError:
+        return {}
+
+
+def load_backend(path=os.path.join("resources", "database.json")):
+    """Create the storage backend configured in `path`, the local Postgres server if it isn't there.
+    The file names a "backend" ("postgres" or "sqlite") and holds each one's connection and pool options"""
+    config = load_config(path)
+    backend = config.get("backend", "postgres")
+    if backend == "sqlite":
+        from .sqlite import SQLiteBackend
+        return SQLiteBackend(**config.get("sqlite", {}))
+    elif backend == "postgres":
+        return PostgresBackend(**config.get("postgres", {}))
+    raise ValueError(f"Unknown database backend {backend}")
+
+
+class Database:
+    # Cached guild documents up to this size are decoded to serve a section read rather than asking the database
+    section_decode_bytes = 64 * 2 ** 10
+
+    def __init__(self, bot, write_behind=False, group_commit=False, backend=None):
+        self.bot = bot
+        self.backend = backend
+        self.cache = GuildCache()
+        self.active = set()
+        self.archived = set()
+        self.archiver = None
+        self.migrator = None
+        self.connected = asyncio.Event()
+        self.blobs = GuildCache(max_bytes=32 * 2 ** 20, decode=unpack)
+        self.generations = Counter()
+        self.current = set()
+        self.migrating = defaultdict(asyncio.Lock)
+        self.writes = WriteBehind(self) if write_behind else None
+        self.exp = ExpAccumulator(self)
+        self.group_commit = group_commit
+        self.writers = {}
+        self.group_commits = Counter()
 
     async def connect(self):
-        self._conn = await asyncpg.create_pool(user='root', password='root',
-                                               database='pokerpg', host='127.0.0.1')
+        if self.backend is None:
+            self.backend = load_backend()
+        self._conn = await self.backend.connect()
+        await self.execute(memberdata_create)
+        await self.execute(balances_create)
+        await self.execute(market_create)
+        await self.execute(characters_create)
+        await self.execute(guilddata_version)
+        await self.execute(blobs_create)
+        await self.execute(archive_create)
+        await self.execute(guilddata_schema)
+        await self.execute(timers_create)
+        self.archived = {x[0] for x in await self.fetch(archive_ids)}
+        config = load_config()
+        self.archiver = Archiver(self, **config.get("archive", {}))
+        self.migrator = migrations.MigrationWorker(self, **config.get("migrations", {}))
+        self.connected.set()
+
+    async def run_workers(self):
+        """Run the archiver and the migration worker, once the database has connected"""
+        await self.connected.wait()
+        await asyncio.gather(self.archiver.run(), self.migrator.run())
+
+    async def execute(self, query, *args):
+        async with self._conn.acquire() as connection:
+            return await query.execute(connection, *args)
+
+    async def fetch(self, query, *args):
+        async with self._conn.acquire() as connection:
+            return await query.fetch(connection, *args)
+
+    async def fetchrow(self, query, *args):
+        async with self._conn.acquire() as connection:
+            return await query.fetchrow(connection, *args)
+
+    async def fetchval(self, query, *args):
+        async with self._conn.acquire() as connection:
+            return await query.fetchval(connection, *args)
+
+    async def flush(self):
+        """Write out everything waiting in the write-behind buffer and the experience accumulator"""
+        if self.writes is not None:
+            await self.writes.flush()
+        await self.exp.flush()
+
+    async def _settle(self, member=None):
+        """Write out a user's changes (or everyone's) still waiting in the write-behind buffer before reading"""
+        if self.writes is not None:
+            await self.writes.settle(None if member is None else (member.id, member.guild.id))
+
+    # Migration functions
+    ########################################################################
+    async def ensure_current(self, guild):
+        """Bring a server's guild document up to the latest schema version, if the migration worker hasn't yet.
+        Only asks the database once per server"""
+        if guild.id in self.current:
+            return
+        schema = await self.fetchval(guild_schema, guild.id)
+        if schema is not None and schema < migrations.LATEST:
+            await self.migrate_guild(guild)
+        self.current.add(guild.id)
+
+    async def migrate_guild(self, guild, retries=8):
+        """Run the migrations a server's guild document is missing and stamp it with the latest schema version,
+        starting over if it was written to in the meantime.
+        Migrations of a server are run one at a time, the second finding the document already current"""
+        async with self.migrating[guild.id]:
+            for attempt in range(retries):
+                response = await self.fetchrow(guild_migrate_select, guild.id)
+                if response is None or response[2] >= migrations.LATEST:
+                    break
+                data = loads(response[0])
+                for func in migrations.pending(response[2]):
+                    await func(self, guild, data)
+                if await self.fetchval(guild_migrate, guild.id, dumps(data), response[1], migrations.LATEST) is not None:
+                    break
+                await asyncio.sleep(random.uniform(0, min(0.01 * 2 ** attempt, 1)))
+            else:
+                raise VersionConflict(guild.id, response[1])
+
+        self.cache.invalidate(guild.id)
+        self.generations[guild.id] += 1
+        self.current.add(guild.id)
+
+    async def outdated_guilds(self, after, limit):
+        """Get the ids of up to `limit` servers after `after` whose documents are below the latest schema version"""
+        return [x[0] for x in await self.fetch(guild_outdated, migrations.LATEST, after, limit)]
+
+    # Archive functions
+    ########################################################################
+    async def touch(self, guild):
+        """Note that a server is in use, restoring it first if it was archived"""
+        self.active.add(guild.id)
+        if guild.id in self.archived:
+            await self.restore_guild(guild)
+
+    async def flush_activity(self):
+        """Write out which servers have been used since the last time"""
+        active, self.active = self.active, set()
+        if active:
+            await self.execute(guild_touch, list(active))
+
+    async def stored_guilds(self):
+        return [x[0] for x in await self.fetch(guild_ids)]
+
+    async def inactive_guilds(self, days, limit):
+        """Get the servers that haven't been used in `days`, longest unused first"""
+        return [x[0] for x in await self.fetch(guild_inactive, days, limit)]
+
+    async def archive_guild(self, guild_id, reason):
+        """Pack every row of a server into the archive and remove them from the other tables,
+        returning the archive's size"""
+        await self.flush()
+        async with self._conn.acquire() as connection:
+            async with connection.transaction():
+                guild = await guild_select.fetchrow(connection, guild_id)
+                data = dict(
+                    guild=(loads(guild[0]), guild[1]) if guild is not None else None,
+                    sections={name: unpack(x) for name, x in await archive_blobs.fetch(connection, guild_id)},
+                    members=[tuple(x) for x in await archive_members.fetch(connection, guild_id)],
+                    balances=[tuple(x) for x in await archive_balances.fetch(connection, guild_id)],
+                    listings=[tuple(x) for x in await archive_listings.fetch(connection, guild_id)],
+                    characters=[tuple(x) for x in await archive_characters.fetch(connection, guild_id)],
+                    aliases=[tuple(x) for x in await archive_aliases.fetch(connection, guild_id)],
+                )
+                packed = pack(data)
+                await archive_insert.execute(connection, guild_id, packed, reason, len(packed))
+                await archive_delete.execute(connection, guild_id)
+        self.archived.add(guild_id)
+        self._forget(guild_id)
+        return len(packed)
+
+    async def restore_guild(self, guild):
+        """Put an archived server's rows back, returns False if it wasn't archived"""
+        async with self._conn.acquire() as connection:
+            async with connection.transaction():
+                packed = await archive_take.fetchval(connection, guild.id)
+                if packed is not None:
+                    data = unpack(packed)
+                    if data["guild"] is not None:
+                        await restore_guild.execute(connection, guild.id, *data["guild"])
+                    await blob_upsert.executemany(connection, [(guild.id, name, pack(value))
+                                                               for name, value in data["sections"].items()])
+                    await user_insert.executemany(connection, [(uuid, guild.id, info)
+                                                               for uuid, info in data["members"]])
+                    await restore_balance.executemany(connection, [(guild.id, *x) for x in data["balances"]])
+                    await restore_listing.executemany(connection, [(guild.id, *x) for x in data["listings"]])
+                    await character_upsert.executemany(connection, [(guild.id, *x) for x in data["characters"]])
+                    await alias_insert.executemany(connection, [(guild.id, *x) for x in data["aliases"]])
+        self.archived.discard(guild.id)
+        self._forget(guild.id)
+        return packed is not None
+
+    def _forget(self, guild_id):
+        """Drop everything cached about a server"""
+        self.cache.invalidate(guild_id)
+        for name in COLD_SECTIONS:
+            self.blobs.invalidate((guild_id, name))
+        self.generations[guild_id] += 1
+        self.current.discard(guild_id)
+
+    async def get_archive_report(self, limit=10):
+        """Get the number and total size of archived servers, and the `limit` most recently archived"""
+        count, size = await self.fetchrow(archive_totals)
+        return count, size, [tuple(x) for x in await self.fetch(archive_report, limit)]
+
+    # Timer functions
+    ########################################################################
+    async def add_timer(self, due, kind, payload):
+        """Store a timer, returning its id"""
+        return await self.fetchval(timer_insert, due, kind, payload)
+
+    async def remove_timer(self, id):
+        await self.execute(timer_delete, id)
+
+    async def get_timers(self):
+        """Get every stored timer as (id, due, kind, payload), soonest first"""
+        return [tuple(x) for x in await self.fetch(timer_all)]
 
     # User functions
     ########################################################################
     async def user_insert(self, member, data):
-        """Create a new user entry with the given data"""
-        jd = self.dump({member.guild.id: data})
-        req = f"""INSERT INTO userdata (UUID, info) VALUES ({member.id}, '{jd}')"""
-        async with self._conn.acquire() as connection:
-            await connection.execute(req)
+        """Create a user's entry for a server with the given data, if they don't already have one"""
+        await self.execute(user_insert, member.id, member.guild.id, data)
 
     async def user_select(self, member):
         """Select a user's data for a specified server"""
-        req = f"""SELECT info -> '{member.guild.id}' FROM userdata WHERE UUID = {member.id}"""
+        await self._settle(member)
+        data = await self.fetchval(user_select, member.id, member.guild.id)
+        if data is None:
+            data = await self.user_adopt(member)
+        return data
+
+    async def user_adopt(self, member):
+        """Move a user's data for a server over from the legacy userdata table, if it is there"""
         async with self._conn.acquire() as connection:
-            response = await connection.fetchval(req)
-        return json.loads(response) if response else response
+            data = await user_adopt.fetchval(connection, member.id, member.guild.id)
+            if data is None:
+                data = await user_select.fetchval(connection, member.id, member.guild.id)
+        return data
 
     async def user_full_select(self, member):
-        """Select a user's data for a specified server"""
-        req = f"""SELECT info FROM userdata WHERE UUID = {member.id}"""
-        async with self._conn.acquire() as connection:
-            response = await connection.fetchval(req)
-        return json.loads(response) if response else response
+        """Select a user's data for every server, keyed by server id"""
+        await self._settle()
+        return await self.fetchval(user_full_select, member.id)
 
     async def user_update(self, member, data):
         """Update a user's data for a specific server"""
-        jd = self.dump(data)
-        req = f"""UPDATE userdata
-        SET info = '{jd}'
-        WHERE UUID = {member.id}"""
-        async with self._conn.acquire() as connection:
-            await connection.execute(req)
+        await self._settle(member)
+        await self.execute(user_update, member.id, member.guild.id, data)
 
     async def user_exists(self, member):
-        """Check if a user has an entry in the db"""
-        req = f"""SELECT info FROM userdata WHERE UUID = {member.id}"""
-        async with self._conn.acquire() as connection:
-            return bool(await connection.fetchval(req))
+        """Check if a user has an entry for the server in the db"""
+        return await self.user_select(member) is not None
 
     async def add_user(self, member, data=None):
-        """Add a server to the users json, if the user doesnt exist user_insert to make one"""
+        """Add a user's entry for a server in a single statement, adopting their legacy data if they have any
+        and filling in any keys of `data` an existing entry is missing.
+        Returns True if a new entry was created from `data`"""
         if not data:
-            data = {member.guild.id: self.bot.default_udata}
-
-        if not await self.user_exists(member):
-            await self.user_insert(member, data)
-            return
-
-        else:
-            values = await self.user_select(member)
+            data = self.bot.default_udata
 
-        if not values:
-            await self.update_user_data(member, data)
+        return await self.fetchval(user_add, member.id, member.guild.id, data)
 
     async def update_user_data(self, member, data):
         """Update a user's server data"""
-        fs = await self.user_full_select(member)
-        if fs:
-            fs.update({str(member.guild.id): data})
-            await self.user_update(member, fs)
-        else:
-            await self.user_insert(member, data)
+        await self.user_update(member, data)
 
     async def get_user_data(self, member):
         """Get a user's data for a server"""
@@ -105,94 +1444,635 @@ class Database:
 
     async def get_all_user_data(self, member):
         """Get a user's data for all servers"""
-        req = f"""SELECT info FROM userdata WHERE UUID = {member.id}"""
-        async with self._conn.acquire() as connection:
-            response = await connection.fetchval(req)
-        return json.loads(response) if response else response
+        return await self.user_full_select(member)
+
+    async def get_guild_balances(self, guild, limit=None, offset=0):
+        """Get the (user id, balance) of users on a server, highest balance first"""
+        await self._settle()
+        return [(x["uuid"], x["money"]) for x in await self.fetch(guild_balances, guild.id, limit, offset)]
+
+    async def backfill_memberdata(self, batch_size=1000):
+        """Move every user's legacy data over to memberdata, `batch_size` users at a time.
+        Yields the number of users read and entries moved for each batch"""
+        last = -1
+        while True:
+            response = await self.fetchrow(user_backfill, last, batch_size)
+            if not response["users"]:
+                return
+            last = response["last"]
+            yield response["users"], response["moved"]
+
+    async def backfill_balances(self, batch_size=1000):
+        """Seed the balances of every user in memberdata, `batch_size` entries at a time.
+        Yields the number of entries read and balances seeded for each batch"""
+        last = (-1, -1)
+        while True:
+            response = await self.fetchrow(balance_backfill, *last, batch_size)
+            if response is None:
+                return
+            last = response["last_user"], response["last_guild"]
+            yield response["users"], response["moved"]
+
+    # Balances
+    ########################################################################
+    async def _balance_partial(self, member, query, *args):
+        """Run a statement on a user's balance row, seeding it first if missing.
+        Returns the (money, bank) after the statement, or None if its guard rejected it"""
+        await self._settle(member)
+        for _ in range(2):
+            async with self._conn.acquire() as connection:
+                response = await query.fetchrow(connection, member.id, member.guild.id, *args)
+                if response is not None:
+                    return tuple(response)
+                exists = await balance_exists.fetchval(connection, member.id, member.guild.id)
+            if exists:
+                return None
+            await self.add_user(member)
+            await self.execute(balance_seed, member.id, member.guild.id)
+
+    async def get_balances(self, member):
+        """Get a user's (money, bank) on a server"""
+        await self._settle(member)
+        response = await self.fetchrow(balance_select, member.id, member.guild.id)
+        if response is None:
+            ud = await self.get_user_data(member)
+            return float(ud.get("money", 0)), float(ud.get("bank", 0))
+        return tuple(response)
+
+    async def balance_incr(self, member, money=0, bank=0, floor=None):
+        """Add to a user's money and bank balances.
+        Returns the new (money, bank), or None if money would have dropped below `floor`"""
+        return await self._balance_partial(member, balance_incr, money, bank, floor)
+
+    async def balance_add(self, member, money=0, bank=0):
+        """Add to a user's money and bank balances with no floor, through the write-behind buffer if enabled.
+        Returns the new (money, bank), or None if the change was queued"""
+        if self.writes is not None:
+            self.writes.add(member, money=money, bank=bank)
+            return None
+        return await self.balance_incr(member, money, bank)
+
+    async def set_balances(self, member, money=None, bank=None):
+        """Set a user's money and/or bank balance, returning the new (money, bank)"""
+        return await self._balance_partial(member, balance_set, money, bank)
+
+    async def balance_take(self, member, amount):
+        """Take from a user's money, drawing whatever it goes under zero from their bank.
+        Returns the new (money, bank), or None if they don't have enough between the two"""
+        return await self._balance_partial(member, balance_take, amount)
+
+    # Partial user updates
+    ########################################################################
+    async def _user_partial(self, member, query, *args):
+        """Run a partial update of a user's server data, creating their entry for the server if missing.
+        Returns the statement's RETURNING row, or None if its guard rejected the update"""
+        await self._settle(member)
+        for _ in range(2):
+            async with self._conn.acquire() as connection:
+                response = await query.fetchrow(connection, member.id, member.guild.id, *args)
+                if response is not None:
+                    return response
+                exists = await user_entry_exists.fetchval(connection, member.id, member.guild.id)
+            if exists:
+                return None
+            await self.add_user(member)
+
+    async def user_set(self, member, **values):
+        """Set top level keys of a user's server data in place"""
+        await self._user_partial(member, user_set, values)
+
+    async def user_incr(self, member, key, amount, floor=None):
+        """Add to a numeric key of a user's server data in a single statement.
+        Returns the new value, or None if it would have dropped below `floor`"""
+        response = await self._user_partial(member, user_incr, key, amount, floor)
+        return response[0] if response is not None else None
+
+    async def user_update_items(self, member, items, strict=False):
+        """Add the given counts (negative to take) to a user's items, dropping any that reach zero.
+        If `strict`, no update is made and None is returned if any count would go negative"""
+        response = await self._user_partial(member, user_update_items, items, strict)
+        return response[0] if response is not None else None
+
+    async def user_give_items(self, member, items):
+        """Add the given counts to a user's items, through the write-behind buffer if enabled.
+        Returns the user's new items, or None if the change was queued"""
+        if self.writes is not None and all(x > 0 for x in items.values()):
+            self.writes.add(member, items=items)
+            return None
+        return await self.user_update_items(member, items)
+
+    async def user_modify(self, member, keys, func):
+        """Read-modify-write only the given keys of a user's server data under a row lock.
+        `func` receives the current values and returns the ones to write, raising aborts the update"""
+        await self._settle(member)
+        for _ in range(2):
+            async with self._conn.acquire() as connection:
+                async with connection.transaction():
+                    current = await user_modify_select.fetchval(connection, member.id, member.guild.id, list(keys))
+                    if current is not None:
+                        values = func(current)
+                        await user_modify_update.execute(connection, member.id, member.guild.id, values)
+                        return values
+            await self.add_user(member)
+        raise RuntimeError("Failed to create user data!")
 
     # Server functions
     ########################################################################
     async def guild_insert(self, guild, data):
         """Add a new guild to the db"""
-        jd = self.dump(data)
-        req = f"""INSERT INTO guilddata (UUID, info) VALUES ({guild.id}, '{jd}')"""
-        async with self._conn.acquire() as connection:
-            await connection.execute(req)
+        encoded = dumps(data)
+        version = await self.fetchval(guild_insert, guild.id, encoded, migrations.LATEST)
+        self._written(guild, encoded, data, version)
 
     async def guild_select(self, guild):
         """Get a guild from the db"""
-        req = f"""SELECT info FROM guilddata WHERE UUID = $1"""
-        async with self._conn.acquire() as connection:
-            response = await connection.fetchval(req, guild.id)
-        return json.loads(response) if response else response
+        response = await self.fetchrow(guild_select, guild.id)
+        if response:
+            self.cache.put(guild.id, *response)
+            return loads(response[0])
+        return None
 
     async def guild_update(self, guild, data):
         """Update a guild"""
-        jd = self.dump(data)
-        req = f"""UPDATE guilddata
-        SET info = '{jd}'
-        WHERE UUID = {guild.id}"""
-        async with self._conn.acquire() as connection:
-            await connection.execute(req)
+        encoded = dumps(data)
+        version = await self.fetchval(guild_update, guild.id, encoded)
+        self._written(guild, encoded, data, version)
 
     async def add_guild(self, guild, data=None):
-        """Add a guild to the db"""
-        values = await self.guild_select(guild)
-        if values:
-            return
-
+        """Add a guild to the db, if it isn't already there"""
         if not data:
-            data = self.bot.default_servdata
-
-        await self.guild_insert(guild, data)
-
-    async def update_guild_data(self, guild, data):
-        # await self.guild_insert(guild, data)
-        # upsert
-        jd = self.dump(data)
-        req = f"""INSERT INTO guilddata (UUID, info)
-        VALUES (
-            {guild.id},
-            '{jd}'
-        )
-        ON CONFLICT (UUID) 
-        DO 
-            UPDATE
-            SET info = '{jd}';
-        """
-        async with self._conn.acquire() as connection:
-            await connection.execute(req)
+            data = self._default_document()
 
-        # if await self.guild_select(guild):
-        #    await self.guild_update(guild, data)
-        # else:
-        #    await self.guild_insert(guild, data)
+        await self.execute(guild_add, guild.id, dumps(data), migrations.LATEST)
 
-    async def get_guild_data(self, guild):
-        values = await self.guild_select(guild)
-        if values:
-            return values
+    async def update_guild_data(self, guild, data, expected_version=None):
+        """Write a guild's data, returning its new version.
+        If `expected_version` is given, only write if the guild is still at that version, raising VersionConflict if not.
+        Any cold sections in `data` are written packed, `data` itself is left as it is"""
+        data, cold = self.split_cold(data)
+        if cold:
+            await self.put_blobs(guild, cold)
+        encoded = dumps(data)
+        if expected_version is None:
+            version = await self.fetchval(guild_upsert, guild.id, encoded, migrations.LATEST)
         else:
-            req = f"""SELECT info FROM guilddata WHERE UUID = $1"""
-            async with self._conn.acquire() as connection:
-                response = await connection.fetchval(req, guild.id)
-            data = json.loads(response) if response else response
-            if data:
-                await self.update_guild_data(guild, data)
-                return data
+            version = await self.fetchval(guild_cas, guild.id, encoded, expected_version)
+            if version is None:
+                self.cache.invalidate(guild.id)
+                raise VersionConflict(guild.id, expected_version)
+        self._written(guild, encoded, data, version)
+        return version
+
+    async def modify_guild_data(self, guild, func, retries=8):
+        """Read-modify-write a guild's data without a lock. `func` mutates the data it's given in place,
+        and is re-applied to a fresh read, after a random backoff, if another write got in first.
+        With group commit on, it is queued to the guild's writer and committed along with any others.
+        Returns what `func` returned"""
+        if self.group_commit:
+            writer = self.writers.get(guild.id)
+            if writer is None:
+                writer = self.writers[guild.id] = GuildWriter(self, guild, retries=retries)
+            return await writer.submit(func)
+
+        for attempt in range(retries):
+            data, version = await self.load_guild_version(guild)
+            result = func(data)
+            try:
+                await self.update_guild_data(guild, data, expected_version=version)
+                return result
+            except VersionConflict:
+                await asyncio.sleep(random.uniform(0, min(0.01 * 2 ** attempt, 1)))
+        raise VersionConflict(guild.id, version)
+
+    def _written(self, guild, encoded, data, version):
+        """Record a write to a guild, refreshing the cache and the current invocation's snapshot"""
+        self.cache.put(guild.id, encoded, version)
+        self.generations[guild.id] += 1
+        snapshot = current_snapshot.get()
+        if snapshot is not None and snapshot.guild.id == guild.id:
+            snapshot.set(data, self.generations[guild.id])
+
+    async def get_guild_data(self, guild):
+        """Get a guild's data, reusing the current command invocation's snapshot if there is one"""
+        snapshot = current_snapshot.get()
+        if snapshot is None or snapshot.guild.id != guild.id:
+            return await self.load_guild_data(guild)
+
+        generation = self.generations[guild.id]
+        if not snapshot.fresh(generation):
+            snapshot.set(await self.load_guild_data(guild), generation)
+        return snapshot.data
+
+    async def load_guild_data(self, guild):
+        return (await self.load_guild_version(guild))[0]
+
+    async def load_guild_version(self, guild):
+        """Get a guild's data and the version it was read at"""
+        cached = self.cache.get_versioned(guild.id)
+        if cached is not None:
+            return cached
+
+        if guild.id in self.archived:
+            await self.restore_guild(guild)
+        await self.ensure_current(guild)
+        # Select the guild, inserting the default data if it doesn't exist yet, in one round trip
+        response = await self.fetchrow(guild_load, guild.id, dumps(self._default_document()), migrations.LATEST)
+        if response is None:
+            # Lost a race with another insert of the same guild
+            response = await self.fetchrow(guild_select, guild.id)
+            if response is None:
+                return self._default_document(), 0
+        self.cache.put(guild.id, *response)
+        return loads(response[0]), response[1]
+
+    async def get_full_guild_data(self, guild):
+        """Get a guild's whole document as it was before parts of it moved to their own tables,
+        with the cold sections, characters, aliases and market listings merged back in. None if it has no data"""
+        await self.ensure_current(guild)
+        data = await self.guild_select(guild)
+        if data is None:
+            return None
+        data.update(await self.get_sections(guild, COLD_SECTIONS))
+        data["characters"] = {x[0]: x for x in await self.get_characters(guild)}
+        data["caliases"] = dict(tuple(x) for x in await self.fetch(archive_aliases, guild.id))
+        data["market_items"] = {x["id"]: x for x in await self.get_listings(guild)}
+        return data
+
+    async def get_all_salaries(self):
+        """Get the (guild id, salaries) of every server with salaries set"""
+        return [(x["uuid"], x["salaries"]) for x in await self.fetch(guild_salaries)]
+
+    # Section functions
+    ########################################################################
+    def _section_source(self, guild):
+        """The guild's data if it is already at hand, decoded or small enough to decode, else None"""
+        snapshot = current_snapshot.get()
+        if snapshot is not None and snapshot.guild.id == guild.id and snapshot.fresh(self.generations[guild.id]):
+            return snapshot.data
+        size = self.cache.size_of(guild.id)
+        if size is not None and size <= self.section_decode_bytes:
+            return self.cache.get(guild.id)
+        return None
+
+    def _default_document(self):
+        """The default server data without its cold sections, which are kept apart"""
+        return {key: copy.deepcopy(value) for key, value in self.bot.default_servdata.items()
+                if key not in COLD_SECTIONS}
+
+    def _section_default(self, key, default=None):
+        return copy.deepcopy(self.bot.default_servdata.get(key, default))
+
+    async def get_sections(self, guild, keys, defaults=None):
+        """Get some top level keys of a guild's data, without loading the rest of it.
+        Missing keys are filled in from `defaults`, then the default server data"""
+        defaults = defaults or {}
+        if guild.id in self.archived:
+            await self.restore_guild(guild)
+        await self.ensure_current(guild)
+        hot = [key for key in keys if key not in COLD_SECTIONS]
+        data = await self.get_blobs(guild, [key for key in keys if key in COLD_SECTIONS])
+        if hot:
+            source = self._section_source(guild)
+            if source is None:
+                source = await self.fetchval(guild_sections, guild.id, hot) or {}
+            data.update((key, source[key]) for key in hot if key in source)
+        return {key: data[key] if key in data else self._section_default(key, defaults.get(key)) for key in keys}
+
+    async def get_section(self, guild, key, default=None):
+        """Get one top level key of a guild's data, or `default` if it isn't set"""
+        return (await self.get_sections(guild, (key,), {key: default}))[key]
+
+    async def _write_section(self, guild, query, *args):
+        """Run a section write, creating the guild first if it doesn't exist, returning the new version"""
+        version = await self.fetchval(query, guild.id, *args)
+        if version is None:
+            await self.add_guild(guild)
+            version = await self.fetchval(query, guild.id, *args)
+        # The cached document is now stale, and re-encoding the whole of it would undo the point
+        self.cache.invalidate(guild.id)
+        self.generations[guild.id] += 1
+        return version
+
+    async def set_sections(self, guild, values):
+        """Overwrite some top level keys of a guild's data, returning the new version of its document
+        (or of the last section written if they are all stored packed)"""
+        await self.ensure_current(guild)
+        hot = {key: value for key, value in values.items() if key not in COLD_SECTIONS}
+        cold = {key: value for key, value in values.items() if key in COLD_SECTIONS}
+        version = await self.put_blobs(guild, cold) if cold else None
+        if hot:
+            version = await self._write_section(guild, guild_set_sections, hot)
+        return version
+
+    async def set_section(self, guild, key, value):
+        """Overwrite one top level key of a guild's data, returning its new version"""
+        return await self.set_sections(guild, {key: value})
+
+    async def update_section(self, guild, key, entries):
+        """Add or overwrite entries of a dict valued key of a guild's data, returning its new version"""
+        if key in COLD_SECTIONS:
+            await self.ensure_current(guild)
+            return await self._modify_blob(guild, key, lambda section: section.update(entries))
+        return await self._write_section(guild, guild_merge_section, key, entries)
+
+    async def remove_section_entries(self, guild, key, *names):
+        """Remove entries from a dict valued key of a guild's data, returning its new version (None if not a dict)"""
+        if key in COLD_SECTIONS:
+            await self.ensure_current(guild)
+
+            def remove(section):
+                for name in names:
+                    section.pop(name, None)
+
+            return await self._modify_blob(guild, key, remove)
+        return await self._write_section(guild, guild_remove_entries, key, list(names))
+
+    # Cold section functions
+    ########################################################################
+    @staticmethod
+    def split_cold(data):
+        """Split a guild document into the rest of it and its cold sections, leaving it untouched"""
+        hot = {key: value for key, value in data.items() if key not in COLD_SECTIONS}
+        return hot, {key: data[key] for key in COLD_SECTIONS if key in data}
+
+    async def get_blobs(self, guild, names):
+        """Unpack the given cold sections of a guild, those that it has"""
+        if not names:
+            return {}
+        sections = {}
+        missing = []
+        for name in names:
+            section = self.blobs.get((guild.id, name))
+            if section is None:
+                missing.append(name)
             else:
-                await self.update_guild_data(guild, self.bot.default_servdata)
-            return copy.deepcopy(self.bot.default_servdata)
-            # return await self.get_guild_data(guild)
+                sections[name] = section
+        if missing:
+            for name, data in await self.fetch(blob_select, guild.id, missing):
+                self.blobs.put((guild.id, name), data, 0)
+                sections[name] = unpack(data)
+        return sections
 
-    async def guild_item(self, guild, name: str):
-        req = f"""SELECT info ->> '{name}' FROM guilddata WHERE UUID = {guild.id}"""
+    async def put_blobs(self, guild, sections):
+        """Pack and write cold sections of a guild, returning the last one's new version"""
+        packed = {name: pack(value) for name, value in sections.items()}
         async with self._conn.acquire() as connection:
-            response = await connection.fetchval(req)
-        return response if response else copy.deepcopy(self.bot.default_servdata[name])
+            async with connection.transaction():
+                for name, data in packed.items():
+                    version = await blob_upsert.fetchval(connection, guild.id, name, data)
+        for name, data in packed.items():
+            self.blobs.put((guild.id, name), data, 0)
+        return version
+
+    async def add_blobs(self, guild, sections):
+        """Pack and write cold sections of a guild that it doesn't have yet, leaving any it has as they are"""
+        async with self._conn.acquire() as connection:
+            async with connection.transaction():
+                for name, value in sections.items():
+                    await blob_insert.execute(connection, guild.id, name, pack(value))
+        for name in sections:
+            self.blobs.invalidate((guild.id, name))
+
+    async def replace_blob(self, guild, name, func):
+        """Replace a cold section of a guild with `func(section)` under a row lock, unless it returns None"""
+        async with self._conn.acquire() as connection:
+            async with connection.transaction():
+                data = await blob_lock.fetchval(connection, guild.id, name)
+                if data is None:
+                    return
+                section = func(unpack(data))
+                if section is None:
+                    return
+                data = pack(section)
+                await blob_upsert.fetchval(connection, guild.id, name, data)
+        self.blobs.put((guild.id, name), data, 0)
+
+    async def _modify_blob(self, guild, name, func):
+        """Read-modify-write a dict valued cold section of a guild under a row lock,
+        returning its new version, or None if it isn't a dict"""
+        async with self._conn.acquire() as connection:
+            async with connection.transaction():
+                data = await blob_lock.fetchval(connection, guild.id, name)
+                section = unpack(data) if data is not None else self._section_default(name, {})
+                if not isinstance(section, dict):
+                    return None
+                func(section)
+                data = pack(section)
+                version = await blob_upsert.fetchval(connection, guild.id, name, data)
+        self.blobs.put((guild.id, name), data, 0)
+        return version
 
     async def user_item(self, member, name: str):
-        req = f"""SELECT info -> '{member.guild.id}' ->> '{name}' FROM userdata WHERE UUID = {member.id}"""
+        if name in ("money", "bank"):
+            return (await self.get_balances(member))[name == "bank"]
+        await self._settle(member)
+        response = await self.fetchrow(user_item, member.id, member.guild.id, name)
+        if response is None:
+            data = await self.user_adopt(member)
+            response = (data.get(name),) if data else (None,)
+        return response[0] if response[0] is not None else copy.copy(self.bot.default_udata[name])
+
+    # Market functions
+    ########################################################################
+    @staticmethod
+    def _listing(record):
+        listing = dict(record)
+        if listing["cost"].is_integer():
+            listing["cost"] = int(listing["cost"])
+        return listing
+
+    async def add_listings(self, guild, listings):
+        """Add many (id, item, user, cost, amount) listings, skipping any whose ID is taken"""
+        async with self._conn.acquire() as connection:
+            await market_insert.executemany(connection, [(guild.id, *x) for x in listings])
+
+    async def add_listing(self, guild, id, item, user, cost, amount):
+        """Add a listing, returns False if the ID is already taken"""
+        await self.ensure_current(guild)
+        return bool(await self.fetchval(market_insert, guild.id, id, item, user, cost, amount))
+
+    async def get_listing(self, guild, id):
+        await self.ensure_current(guild)
+        response = await self.fetchrow(market_select, guild.id, id)
+        return self._listing(response) if response else None
+
+    async def pop_listing(self, guild, id, user=None):
+        """Remove and return a listing, None if it doesn't exist or isn't `user`'s"""
+        await self.ensure_current(guild)
+        response = await self.fetchrow(market_delete, guild.id, id, user)
+        return self._listing(response) if response else None
+
+    async def get_listings(self, guild, item=None, user=None):
+        """Get a server's listings, only those of an item (cheapest first) or a seller if given"""
+        await self.ensure_current(guild)
+        if item is not None:
+            response = await self.fetch(market_search, guild.id, item)
+        elif user is not None:
+            response = await self.fetch(market_by_user, guild.id, user)
+        else:
+            response = await self.fetch(market_all, guild.id)
+        return [self._listing(x) for x in response]
+
+    # Character functions
+    ########################################################################
+    async def add_characters(self, guild, characters, aliases):
+        """Add many characters, from a name to Character dict, and many aliases, skipping any names taken"""
+        async with self._conn.acquire() as connection:
+            async with connection.transaction():
+                await character_insert.executemany(
+                    connection, [(guild.id, name, x[1], list(x)) for name, x in characters.items()]
+                )
+                await alias_insert.executemany(connection, [(guild.id, alias, name) for alias, name in aliases.items()])
+
+    async def get_character(self, guild, name):
+        """Get a character's data by its name or an alias, None if it doesn't exist"""
+        await self.ensure_current(guild)
+        return await self.fetchval(character_select, guild.id, name)
+
+    async def get_characters(self, guild, owner=None):
+        """Get the data of every character on a server, or only those of `owner`"""
+        await self.ensure_current(guild)
+        if owner is not None:
+            response = await self.fetch(character_by_owner, guild.id, owner)
+        else:
+            response = await self.fetch(character_all, guild.id)
+        return [x["info"] for x in response]
+
+    async def get_character_names(self, guild, limit=None, offset=0):
+        await self.ensure_current(guild)
+        return [x["name"] for x in await self.fetch(character_names, guild.id, limit, offset)]
+
+    async def count_characters(self, guild):
+        await self.ensure_current(guild)
+        return await self.fetchval(character_count, guild.id)
+
+    async def character_name_taken(self, guild, name):
+        """Check if a name is used by a character or an alias"""
+        await self.ensure_current(guild)
+        return await self.fetchval(character_name_taken, guild.id, name)
+
+    async def put_character(self, guild, character):
+        """Create or replace a character"""
+        await self.ensure_current(guild)
+        await self.execute(character_upsert, guild.id, character[0], character[1], list(character))
+
+    async def delete_character(self, guild, name):
+        await self.ensure_current(guild)
+        await self.execute(character_delete, guild.id, name)
+
+    async def set_character_pos(self, guild, name, map, pos):
+        """Set a character's position on a map, returns False if it doesn't exist"""
+        await self.ensure_current(guild)
+        return bool(await self.fetchval(character_set_pos, guild.id, name, map, pos))
+
+    async def character_team_add(self, guild, name, id):
+        """Add a pet to a character's team, returns False if the team is full"""
+        await self.ensure_current(guild)
+        return bool(await self.fetchval(character_team_add, guild.id, name, id))
+
+    async def character_team_remove(self, guild, name, id):
+        await self.ensure_current(guild)
+        return bool(await self.fetchval(character_team_remove, guild.id, name, id))
+
+    async def get_alias(self, guild, alias):
+        """Get the name of the character an alias points to, None if there is no such alias"""
+        await self.ensure_current(guild)
+        return await self.fetchval(alias_select, guild.id, alias)
+
+    async def add_alias(self, guild, alias, name):
+        """Add an alias, returns False if it already exists"""
+        await self.ensure_current(guild)
+        return bool(await self.fetchval(alias_insert, guild.id, alias, name))
+
+    async def remove_alias(self, guild, alias):
+        await self.ensure_current(guild)
+        await self.execute(alias_delete, guild.id, alias)
+
+    # Transfers
+    ########################################################################
+    async def transfer(self, guild, money=(), items=(), pets=(), listing=None, buyer=None):
+        """Move money, items and pets between users of a server in a single transaction, all or nothing.
+        `money` is (payer, payee, amount), `items` is (giver, receiver, item, count) and `pets` is (giver, receiver, id),
+        all by user id. A payer, giver or receiver of None creates or destroys, except a pet's giver.
+        If `listing` is given it is taken off the market, `buyer` paying its cost to the seller for its items.
+        Returns a TransferResult"""
+        money, items, pets = list(money), list(items), list(pets)
+        if listing is not None:
+            await self.ensure_current(guild)
+        await self._settle()
+
         async with self._conn.acquire() as connection:
-            response = await connection.fetchval(req)
-        return response if response else copy.copy(self.bot.default_udata[name])
+            try:
+                async with connection.transaction():
+                    sold = None
+                    if listing is not None:
+                        response = await market_delete.fetchrow(connection, guild.id, listing, None)
+                        if response is None:
+                            raise _TransferAborted("listing")
+                        sold = self._listing(response)
+                        money.append((buyer, sold["user"], sold["cost"]))
+                        items.append((None, buyer, sold["item"], sold["amount"]))
+
+                    users = sorted({x for leg in chain(money, items, pets) for x in leg[:2] if x is not None})
+                    await user_add.executemany(connection, [(x, guild.id, self.bot.default_udata) for x in users])
+                    await balance_seed.executemany(connection, [(x, guild.id) for x in users])
+                    await transfer_lock_members.execute(connection, guild.id, users)
+                    await transfer_lock_balances.execute(connection, guild.id, users)
+
+                    deltas = Counter()
+                    for payer, payee, amount in money:
+                        if payer is not None:
+                            deltas[payer] -= amount
+                        if payee is not None:
+                            deltas[payee] += amount
+
+                    balances = {}
+                    for user in sorted(deltas):
+                        delta = deltas[user]
+                        response = await balance_incr.fetchrow(connection, user, guild.id, delta, 0,
+                                                               0 if delta < 0 else None)
+                        if response is None:
+                            raise _TransferAborted("money", user)
+                        balances[user] = tuple(response)
+
+                    counts = {}
+                    for giver, receiver, item, count in items:
+                        if giver is not None:
+                            counts.setdefault(giver, Counter())[item] -= count
+                        if receiver is not None:
+                            counts.setdefault(receiver, Counter())[item] += count
+
+                    inventories = {}
+                    for user in sorted(counts):
+                        response = await user_update_items.fetchrow(connection, user, guild.id,
+                                                                    dict(counts[user]), True)
+                        if response is None:
+                            raise _TransferAborted("items", user)
+                        inventories[user] = Counter(response[0])
+
+                    moved = []
+                    if pets:
+                        boxes = {}
+                        for user in sorted({x for leg in pets for x in leg[:2] if x is not None}):
+                            current = await user_modify_select.fetchval(connection, user, guild.id, ["box"])
+                            boxes[user] = current.get("box", [])
+
+                        for giver, receiver, id in pets:
+                            for pet in boxes[giver]:
+                                if pet[0] == id:
+                                    break
+                            else:
+                                raise _TransferAborted("pet", giver)
+                            boxes[giver].remove(pet)
+                            if receiver is not None:
+                                box = boxes[receiver]
+                                pet = [max((x[0] for x in box), default=-1) + 1, *pet[1:]]
+                                box.append(pet)
+                            moved.append(pet)
+
+                        for user, box in boxes.items():
+                            await user_modify_update.execute(connection, user, guild.id, dict(box=box))
+            except _TransferAborted as e:
+                return TransferResult(False, e.reason, e.user)
+
+        return TransferResult(True, balances=balances, items=inventories, pets=moved, listing=sold)
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# Copyright (c) 2016-2017, henry232323
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.  IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+"""Guild document migrations.
+Every guild document is stamped with the schema version it is at. Each migration upgrades a document
+from the version before it, mutating it in place and moving anything that now lives elsewhere,
+and must be safe to run again on a document it has already been applied to.
+Writes outside the document only add what isn't there yet, so a repeated run can't undo later changes"""
+
+import asyncio
+import hashlib
+import logging
+
+from discord import Object
+
+MIGRATIONS = {}
+
+
+def migration(version):
+    """Register a migration to `version`"""
+    def decorator(func):
+        if version in MIGRATIONS:
+            raise ValueError(f"Migration {version} is already registered")
+        MIGRATIONS[version] = func
+        return func
+
+    return decorator
+
+
+def pending(version):
+    """The migrations a document at `version` still needs, in order"""
+    return [MIGRATIONS[x] for x in sorted(MIGRATIONS) if x > version]
+
+
+def _offer_id(item, index):
+    """A listing id for the `index`th offer of `item` in a very old market"""
+    return hashlib.sha1(f"{item}/{index}".encode()).hexdigest()[:6].upper()
+
+
+@migration(1)
+async def market_table(db, guild, data):
+    """Move the market listings into market_listings"""
+    market = data.pop("market_items", None)
+    if not market:
+        return
+
+    listings = []
+    for id, listing in market.items():
+        if isinstance(listing, dict) and "item" in listing:
+            listings.append((listing.get("id", id), listing["item"], listing["user"],
+                             listing["cost"], listing["amount"]))
+        else:
+            # Very old markets were keyed by item with a list of offers, and no seller or id.
+            # The ids are derived from the offer so a repeated run adds nothing new
+            for index, offer in enumerate(listing):
+                listings.append((_offer_id(id, index), id, getattr(guild, "owner_id", 0),
+                                 offer["cost"], offer["amount"]))
+    await db.add_listings(guild, listings)
+
+
+@migration(2)
+async def character_tables(db, guild, data):
+    """Move the characters and their aliases into characters and character_aliases"""
+    characters = data.pop("characters", None)
+    aliases = data.pop("caliases", None)
+    if characters or aliases:
+        await db.add_characters(guild, characters or {}, aliases or {})
+
+
+@migration(3)
+async def named_maps(db, guild, data):
+    """Servers from before multiple maps had a single map in place of the name to map dict"""
+    if "maps" in data:
+        if isinstance(data["maps"], list):
+            data["maps"] = {"Default": data["maps"]}
+        return
+
+    await db.replace_blob(guild, "maps", lambda maps: {"Default": maps} if isinstance(maps, list) else None)
+
+
+@migration(4)
+async def cold_sections(db, guild, data):
+    """Pack the cold sections into guild_blobs"""
+    _, cold = db.split_cold(data)
+    if cold:
+        await db.add_blobs(guild, cold)
+    for key in cold:
+        del data[key]
+
+
+LATEST = max(MIGRATIONS)
+
+
+class MigrationWorker:
+    """Upgrades every guild document below the latest schema version in the background,
+    `batch` at a time in server id order with `delay` seconds between batches"""
+
+    def __init__(self, db, batch=50, delay=1.0):
+        self.db = db
+        self.batch = batch
+        self.delay = delay
+        self.migrated = 0
+        self.failed = 0
+        self.done = False
+
+    async def run(self):
+        await self.db.bot.wait_until_ready()
+        after = 0
+        while not self.db.bot.is_closed():
+            ids = await self.db.outdated_guilds(after, self.batch)
+            if not ids:
+                break
+            for guild_id in ids:
+                try:
+                    await self.db.migrate_guild(self.db.bot.get_guild(guild_id) or Object(id=guild_id))
+                    self.migrated += 1
+                except Exception:
+                    # Left behind for the next start, or to be upgraded when the server is next used
+                    logging.exception(f"Migrating guild {guild_id} failed")
+                    self.failed += 1
+            after = ids[-1]
+            await asyncio.sleep(self.delay)
+        self.done = True
+
+    def stats(self):
+        return dict(migrated=self.migrated, failed=self.failed, done=self.done, latest=LATEST)
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+# Copyright (c) 2016-2017, henry232323
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.  IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+
+"""Delayed actions, run from a single task instead of a sleeping coroutine each.
+Timers are kept in a heap ordered by when they are due. Long lived ones are also stored in the database
+under a kind with a JSON payload, and are put back in the heap when the bot starts"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import defaultdict
+
+import discord
+
+
+class Timer:
+    """A handle to a scheduled action, which can be cancelled until it has run"""
+
+    __slots__ = ("when", "kind", "payload", "callback", "id", "cancelled")
+
+    def __init__(self, when, kind=None, payload=None, callback=None):
+        self.when = when
+        self.kind = kind
+        self.payload = payload
+        self.callback = callback
+        self.id = None
+        self.cancelled = False
+
+
+class Scheduler:
+    """Runs timers as they come due. Message deletions that come due together are grouped per channel
+    and made with bulk deletes"""
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.handlers = {}
+        self.restorers = {}
+        self.heap = []
+        self.deletions = defaultdict(list)
+        self.counter = itertools.count()
+        self.fired = 0
+        self.deleted = 0
+        self.loaded = None
+        self._wake = asyncio.Event()
+
+    def register(self, kind, handler, restore=None):
+        """Run `handler(payload)` for stored timers of `kind`. `restore(timer)` is called for each one
+        put back at startup, to rebuild any state that goes with it"""
+        self.handlers[kind] = handler
+        if restore is not None:
+            self.restorers[kind] = restore
+
+    def _push(self, timer):
+        heapq.heappush(self.heap, (timer.when, next(self.counter), timer))
+        if self.heap[0][2] is timer:
+            self._wake.set()
+        return timer
+
+    def call_later(self, delay, callback, *args):
+        """Run `callback(*args)` (a coroutine function) in `delay` seconds. Not kept over a restart"""
+        return self._push(Timer(time.time() + delay, callback=(callback, args)))
+
+    def delete_later(self, message, delay):
+        """Delete `message` in `delay` seconds"""
+        return self._push(Timer(time.time() + delay, kind="delete", payload=message))
+
+    async def schedule(self, delay, kind, payload):
+        """Run the handler registered for `kind` with `payload` in `delay` seconds, even across a restart"""
+        timer = Timer(time.time() + delay, kind, payload)
+        timer.id = await self.bot.db.add_timer(timer.when, kind, payload)
+        return self._push(timer)
+
+    async def cancel(self, timer):
+        """Stop a timer from running, if it hasn't already"""
+        if timer is None or timer.cancelled:
+            return
+        timer.cancelled = True
+        if timer.id is not None:
+            await self.bot.db.remove_timer(timer.id)
+
+    async def _load(self, retry=30):
+        # Timers scheduled meanwhile still run, the heap loop doesn't wait on this
+        await self.bot.db.connected.wait()
+        while not self.bot.is_closed():
+            try:
+                return await self.load()
+            except Exception:
+                logging.exception(f"Loading stored timers failed, retrying in {retry}s")
+                await asyncio.sleep(retry)
+
+    async def load(self):
+        """Put the stored timers back in the heap"""
+        known = {x[2].id for x in self.heap}
+        for id, when, kind, payload in await self.bot.db.get_timers():
+            if id in known:
+                continue
+            timer = Timer(when, kind, payload)
+            timer.id = id
+            self._push(timer)
+            if kind in self.restorers:
+                try:
+                    self.restorers[kind](timer)
+                except Exception:
+                    logging.exception(f"Restoring {kind} timer {id} failed")
+
+    async def run(self):
+        await self.bot.wait_until_ready()
+        self.loaded = asyncio.ensure_future(self._load())
+        while not self.bot.is_closed():
+            now = time.time()
+            while self.heap and self.heap[0][0] <= now:
+                timer = heapq.heappop(self.heap)[2]
+                if not timer.cancelled:
+                    self._fire(timer)
+            if self.deletions:
+                deletions, self.deletions = self.deletions, defaultdict(list)
+                for channel, messages in deletions.items():
+                    asyncio.ensure_future(self._delete(channel, messages))
+
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.heap[0][0] - now if self.heap else None)
+            except asyncio.TimeoutError:
+                pass
+
+    def _fire(self, timer):
+        timer.cancelled = True
+        self.fired += 1
+        if timer.kind == "delete":
+            self.deletions[timer.payload.channel].append(timer.payload)
+        elif timer.callback is not None:
+            callback, args = timer.callback
+            asyncio.ensure_future(self._guard(timer, callback(*args)))
+        else:
+            handler = self.handlers.get(timer.kind)
+            if handler is None:
+                logging.error(f"No handler for {timer.kind} timer {timer.id}")
+                return
+            asyncio.ensure_future(self._guard(timer, handler(timer.payload)))
+
+    async def _guard(self, timer, coro):
+        try:
+            await coro
+        except Exception:
+            logging.exception(f"Timer {timer.kind or timer.callback[0].__qualname__} failed")
+        finally:
+            if timer.id is not None:
+                await self.bot.db.remove_timer(timer.id)
+
+    async def _delete(self, channel, messages):
+        # Bulk deletes take at most 100 messages
+        for i in range(0, len(messages), 100):
+            batch = messages[i:i + 100]
+            try:
+                await channel.delete_messages(batch)
+                self.deleted += len(batch)
+            except discord.HTTPException:
+                # A bulk delete fails whole if any message is gone or over two weeks old
+                for message in batch:
+                    try:
+                        await message.delete()
+                        self.deleted += 1
+                    except discord.NotFound:
+                        pass
+                    except discord.HTTPException:
+                        logging.exception(f"Deleting message {message.id} in {channel.id} failed")
+
+    def stats(self):
+        return dict(scheduled=sum(not x[2].cancelled for x in self.heap), fired=self.fired, deleted=self.deleted)
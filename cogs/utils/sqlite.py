@@ -0,0 +1,634 @@
+#!/usr/bin/env python3
+# Copyright (c) 2016-2017, henry232323
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.  IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+"""An embedded SQLite backend for running the bot, or benchmarking DataInteraction, without a Postgres server.
+Needs SQLite 3.38 or newer for its JSON operators. Each statement has an SQLite form here,
+a list where Postgres does it in one statement with data-modifying CTEs, and the result is that of the
+first statement in the list that returns rows"""
+
+import re
+import asyncio
+import sqlite3
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+
+from .db import Query, dumps, loads
+
+# A JSON value out of json_each, rebuilt so it's aggregated as JSON rather than as text
+_VALUE = """CASE WHEN type IN ('object', 'array') THEN json(value)
+    WHEN type = 'true' THEN json('true') WHEN type = 'false' THEN json('false') ELSE value END"""
+
+
+def _merge(a, b):
+    """SQL for the top level keys of JSON object `a` overwritten with those of `b`, like Postgres' jsonb ||"""
+    return f"""(SELECT json_group_object(key, {_VALUE}) FROM (
+        SELECT key, value, type FROM json_each({a}) WHERE key NOT IN (SELECT key FROM json_each({b}))
+        UNION ALL
+        SELECT key, value, type FROM json_each({b})
+    ))"""
+
+
+def _merge_items(info, deltas):
+    """SQL for the items of `info` with the counts in `deltas` added, dropping any that reach zero"""
+    return f"""json((SELECT json_group_object(key, value) FROM (
+        SELECT key, value FROM json_each(COALESCE({info} -> 'items', '{{}}'))
+        WHERE key NOT IN (SELECT key FROM json_each({deltas}))
+        UNION ALL
+        SELECT d.key, COALESCE({info} -> 'items' ->> d.key, 0) + d.value FROM json_each({deltas}) AS d
+    ) WHERE value > 0))"""
+
+
+_LEGACY = "(SELECT info -> CAST(?2 AS text) FROM userdata " \
+          "WHERE UUID = ?1 AND json_type(info -> CAST(?2 AS text)) = 'object')"
+_WITH_BALANCES = "CASE WHEN b.UUID IS NULL THEN m.info ELSE json_set(m.info, '$.money', b.money, '$.bank', b.bank) END"
+_LISTING = 'id, item, user_id AS "user", cost, amount'
+
+STATEMENTS = {
+    # User statements
+    "memberdata_create": [
+        "CREATE TABLE IF NOT EXISTS userdata (UUID integer PRIMARY KEY, info text NOT NULL)",
+        """CREATE TABLE IF NOT EXISTS memberdata (
+            UUID integer NOT NULL,
+            guild_id integer NOT NULL,
+            info text NOT NULL,
+            PRIMARY KEY (UUID, guild_id)
+        )""",
+        "CREATE INDEX IF NOT EXISTS memberdata_guild_id ON memberdata (guild_id)",
+    ],
+    "user_insert": """INSERT INTO memberdata (UUID, guild_id, info) VALUES (?1, ?2, json(?3))
+        ON CONFLICT (UUID, guild_id) DO NOTHING""",
+    "user_select": f"""SELECT {_WITH_BALANCES} AS "info [json]"
+        FROM memberdata AS m LEFT JOIN balances AS b ON b.guild_id = m.guild_id AND b.UUID = m.UUID
+        WHERE m.UUID = ?1 AND m.guild_id = ?2""",
+    "user_full_select": f"""SELECT json_group_object(key, json(value)) AS "info [json]" FROM (
+            SELECT e.key, e.value FROM userdata AS u, json_each(u.info) AS e
+            WHERE u.UUID = ?1 AND e.type = 'object'
+              AND e.key NOT IN (SELECT CAST(guild_id AS text) FROM memberdata WHERE UUID = ?1)
+            UNION ALL
+            SELECT CAST(m.guild_id AS text), {_WITH_BALANCES}
+            FROM memberdata AS m LEFT JOIN balances AS b ON b.guild_id = m.guild_id AND b.UUID = m.UUID
+            WHERE m.UUID = ?1
+        )""",
+    "user_update": [
+        """INSERT INTO memberdata (UUID, guild_id, info) VALUES (?1, ?2, json(?3))
+        ON CONFLICT (UUID, guild_id) DO UPDATE SET info = excluded.info""",
+        """INSERT INTO balances (guild_id, UUID, money, bank)
+        SELECT ?2, ?1, COALESCE(json_extract(?3, '$.money'), 0), COALESCE(json_extract(?3, '$.bank'), 0)
+        WHERE json_type(?3, '$.money') IS NOT NULL OR json_type(?3, '$.bank') IS NOT NULL
+        ON CONFLICT (guild_id, UUID) DO UPDATE SET money = excluded.money, bank = excluded.bank""",
+        """DELETE FROM balances WHERE UUID = ?1 AND guild_id = ?2
+        AND json_type(?3, '$.money') IS NULL AND json_type(?3, '$.bank') IS NULL""",
+    ],
+    "user_add": [
+        f"""SELECT NOT EXISTS (SELECT 1 FROM memberdata WHERE UUID = ?1 AND guild_id = ?2)
+        AND {_LEGACY} IS NULL""",
+        f"""INSERT INTO balances (guild_id, UUID, money, bank)
+        SELECT ?2, ?1, COALESCE(info ->> 'money', 0), COALESCE(info ->> 'bank', 0)
+        FROM (SELECT COALESCE({_LEGACY}, json(?3)) AS info)
+        WHERE NOT EXISTS (SELECT 1 FROM memberdata WHERE UUID = ?1 AND guild_id = ?2)
+        ON CONFLICT (guild_id, UUID) DO NOTHING""",
+        f"""INSERT INTO memberdata (UUID, guild_id, info) VALUES (?1, ?2, COALESCE({_LEGACY}, json(?3)))
+        ON CONFLICT (UUID, guild_id) DO UPDATE SET info = {_merge("excluded.info", "memberdata.info")}
+        WHERE EXISTS (SELECT 1 FROM json_each(excluded.info)
+                      WHERE key NOT IN (SELECT key FROM json_each(memberdata.info)))""",
+    ],
+    "user_adopt": """INSERT INTO memberdata (UUID, guild_id, info)
+        SELECT UUID, ?2, info -> CAST(?2 AS text) FROM userdata
+        WHERE UUID = ?1 AND json_type(info -> CAST(?2 AS text)) = 'object'
+        ON CONFLICT (UUID, guild_id) DO NOTHING
+        RETURNING info AS "info [json]\"""",
+    "user_item": """SELECT info -> ?3 AS "value [json]" FROM memberdata WHERE UUID = ?1 AND guild_id = ?2""",
+    "user_entry_exists": "SELECT 1 FROM memberdata WHERE UUID = ?1 AND guild_id = ?2",
+    "user_set": f"""UPDATE memberdata SET info = {_merge("info", "json(?3)")}
+        WHERE UUID = ?1 AND guild_id = ?2
+        RETURNING 1""",
+    "user_incr": """UPDATE memberdata
+        SET info = json_set(info, '$."' || ?3 || '"', COALESCE(info ->> ?3, 0) + ?4)
+        WHERE UUID = ?1 AND guild_id = ?2 AND (?5 IS NULL OR COALESCE(info ->> ?3, 0) + ?4 >= ?5)
+        RETURNING info ->> ?3""",
+    "user_update_items": f"""UPDATE memberdata SET info = json_set(info, '$.items', {_merge_items("info", "?3")})
+        WHERE UUID = ?1 AND guild_id = ?2
+          AND (NOT ?4 OR NOT EXISTS (
+              SELECT 1 FROM json_each(?3) AS d WHERE COALESCE(info -> 'items' ->> d.key, 0) + d.value < 0))
+        RETURNING info -> 'items' AS "items [json]\"""",
+    "user_modify_select": """SELECT (
+            SELECT json_group_object(k.value, json(info -> k.value)) FROM json_each(?3) AS k
+            WHERE info -> k.value IS NOT NULL
+        ) AS "info [json]"
+        FROM memberdata WHERE UUID = ?1 AND guild_id = ?2""",
+    "user_modify_update": f"""UPDATE memberdata SET info = {_merge("info", "json(?3)")}
+        WHERE UUID = ?1 AND guild_id = ?2""",
+
+    # Balance statements
+    "balances_create": [
+        """CREATE TABLE IF NOT EXISTS balances (
+            guild_id integer NOT NULL,
+            UUID integer NOT NULL,
+            money real NOT NULL DEFAULT 0,
+            bank real NOT NULL DEFAULT 0,
+            PRIMARY KEY (guild_id, UUID)
+        )""",
+        "CREATE INDEX IF NOT EXISTS balances_leaderboard ON balances (guild_id, money DESC)",
+    ],
+    "balance_seed": """INSERT INTO balances (guild_id, UUID, money, bank)
+        SELECT guild_id, UUID, COALESCE(info ->> 'money', 0), COALESCE(info ->> 'bank', 0)
+        FROM memberdata WHERE UUID = ?1 AND guild_id = ?2
+        ON CONFLICT (guild_id, UUID) DO NOTHING""",
+    "balance_select": "SELECT money, bank FROM balances WHERE UUID = ?1 AND guild_id = ?2",
+    "balance_exists": "SELECT 1 FROM balances WHERE UUID = ?1 AND guild_id = ?2",
+    "balance_incr": """UPDATE balances SET money = money + ?3, bank = bank + ?4
+        WHERE UUID = ?1 AND guild_id = ?2 AND (?5 IS NULL OR money + ?3 >= ?5)
+        RETURNING money, bank""",
+    "balance_set": """UPDATE balances SET money = COALESCE(?3, money), bank = COALESCE(?4, bank)
+        WHERE UUID = ?1 AND guild_id = ?2
+        RETURNING money, bank""",
+    "balance_take": """UPDATE balances SET money = money - ?3, bank = bank + MIN(money - ?3, 0)
+        WHERE UUID = ?1 AND guild_id = ?2 AND bank + MIN(money - ?3, 0) >= 0
+        RETURNING money, bank""",
+    "guild_balances": """SELECT UUID, money FROM balances WHERE guild_id = ?1
+        ORDER BY money DESC LIMIT COALESCE(?2, -1) OFFSET ?3""",
+
+    # Market statements
+    "market_create": [
+        """CREATE TABLE IF NOT EXISTS market_listings (
+            guild_id integer NOT NULL,
+            id text NOT NULL,
+            item text NOT NULL,
+            user_id integer NOT NULL,
+            cost real NOT NULL,
+            amount integer NOT NULL,
+            created text NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now')),
+            PRIMARY KEY (guild_id, id)
+        )""",
+        "CREATE INDEX IF NOT EXISTS market_listings_item ON market_listings (guild_id, item, cost)",
+        "CREATE INDEX IF NOT EXISTS market_listings_user ON market_listings (guild_id, user_id)",
+    ],
+    "market_insert": """INSERT INTO market_listings (guild_id, id, item, user_id, cost, amount)
+        VALUES (?1, ?2, ?3, ?4, ?5, ?6)
+        ON CONFLICT (guild_id, id) DO NOTHING
+        RETURNING 1""",
+    "market_select": f"SELECT {_LISTING} FROM market_listings WHERE guild_id = ?1 AND id = ?2",
+    "market_delete": f"""DELETE FROM market_listings
+        WHERE guild_id = ?1 AND id = ?2 AND (?3 IS NULL OR user_id = ?3)
+        RETURNING {_LISTING}""",
+    "market_all": f"SELECT {_LISTING} FROM market_listings WHERE guild_id = ?1 ORDER BY created, id",
+    "market_search": f"""SELECT {_LISTING} FROM market_listings
+        WHERE guild_id = ?1 AND item = ?2 ORDER BY cost, created""",
+    "market_by_user": f"""SELECT {_LISTING} FROM market_listings
+        WHERE guild_id = ?1 AND user_id = ?2 ORDER BY created, id""",
+
+    # Character statements
+    "characters_create": [
+        """CREATE TABLE IF NOT EXISTS characters (
+            guild_id integer NOT NULL,
+            name text NOT NULL,
+            owner integer NOT NULL,
+            info text NOT NULL,
+            PRIMARY KEY (guild_id, name)
+        )""",
+        "CREATE INDEX IF NOT EXISTS characters_owner ON characters (guild_id, owner)",
+        """CREATE TABLE IF NOT EXISTS character_aliases (
+            guild_id integer NOT NULL,
+            alias text NOT NULL,
+            name text NOT NULL,
+            PRIMARY KEY (guild_id, alias)
+        )""",
+    ],
+    "character_select": """SELECT info AS "info [json]" FROM characters
+        WHERE guild_id = ?1 AND name = COALESCE(
+            (SELECT name FROM character_aliases WHERE guild_id = ?1 AND alias = ?2), ?2
+        )""",
+    "character_upsert": """INSERT INTO characters (guild_id, name, owner, info) VALUES (?1, ?2, ?3, json(?4))
+        ON CONFLICT (guild_id, name) DO UPDATE SET owner = excluded.owner, info = excluded.info""",
+    "character_insert": """INSERT INTO characters (guild_id, name, owner, info) VALUES (?1, ?2, ?3, json(?4))
+        ON CONFLICT (guild_id, name) DO NOTHING""",
+    "character_delete": "DELETE FROM characters WHERE guild_id = ?1 AND name = ?2",
+    "character_by_owner": """SELECT info AS "info [json]" FROM characters
+        WHERE guild_id = ?1 AND owner = ?2 ORDER BY name""",
+    "character_all": """SELECT info AS "info [json]" FROM characters WHERE guild_id = ?1 ORDER BY name""",
+    "character_names": """SELECT name FROM characters WHERE guild_id = ?1
+        ORDER BY name LIMIT COALESCE(?2, -1) OFFSET ?3""",
+    "character_count": "SELECT count(*) FROM characters WHERE guild_id = ?1",
+    "character_name_taken": """SELECT
+        EXISTS(SELECT 1 FROM characters WHERE guild_id = ?1 AND name = ?2) OR
+        EXISTS(SELECT 1 FROM character_aliases WHERE guild_id = ?1 AND alias = ?2)""",
+    "character_set_pos": """UPDATE characters
+        SET info = json_set(json_set(info, '$[5].maps', json(COALESCE(info -> '$[5].maps', '{}'))),
+                            '$[5].maps."' || ?3 || '"', json(?4))
+        WHERE guild_id = ?1 AND name = ?2
+        RETURNING 1""",
+    "character_team_add": """UPDATE characters SET info = json_insert(info, '$[4][#]', ?3)
+        WHERE guild_id = ?1 AND name = ?2 AND json_array_length(info, '$[4]') < 6
+        RETURNING 1""",
+    "character_team_remove": """UPDATE characters
+        SET info = json_set(info, '$[4]', json((SELECT json_group_array(value) FROM json_each(info, '$[4]')
+                                                WHERE value <> ?3)))
+        WHERE guild_id = ?1 AND name = ?2
+        RETURNING 1""",
+    "alias_select": "SELECT name FROM character_aliases WHERE guild_id = ?1 AND alias = ?2",
+    "alias_insert": """INSERT INTO character_aliases (guild_id, alias, name) VALUES (?1, ?2, ?3)
+        ON CONFLICT (guild_id, alias) DO NOTHING
+        RETURNING 1""",
+    "alias_delete": "DELETE FROM character_aliases WHERE guild_id = ?1 AND alias = ?2",
+
+    # Server statements
+    "guilddata_version": """CREATE TABLE IF NOT EXISTS guilddata (
+        UUID integer PRIMARY KEY,
+        info text NOT NULL,
+        version integer NOT NULL DEFAULT 0,
+        last_active text NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now')),
+        schema_version integer NOT NULL DEFAULT 0
+    )""",
+    "guild_insert": """INSERT INTO guilddata (UUID, info, schema_version) VALUES (?1, json(?2), ?3)
+        RETURNING version""",
+    "guild_select": "SELECT info, version FROM guilddata WHERE UUID = ?1",
+    "guild_update": """UPDATE guilddata SET info = json(?2), version = version + 1 WHERE UUID = ?1
+        RETURNING version""",
+    "guild_cas": """UPDATE guilddata SET info = json(?2), version = version + 1
+        WHERE UUID = ?1 AND version = ?3
+        RETURNING version""",
+    "guild_add": """INSERT INTO guilddata (UUID, info, schema_version) VALUES (?1, json(?2), ?3)
+        ON CONFLICT (UUID) DO NOTHING""",
+    "guild_load": [
+        """INSERT INTO guilddata (UUID, info, schema_version) VALUES (?1, json(?2), ?3)
+            ON CONFLICT (UUID) DO NOTHING""",
+        "SELECT info, version FROM guilddata WHERE UUID = ?1",
+    ],
+    "guild_upsert": """INSERT INTO guilddata (UUID, info, schema_version) VALUES (?1, json(?2), ?3)
+        ON CONFLICT (UUID) DO UPDATE SET info = excluded.info, version = guilddata.version + 1
+        RETURNING version""",
+    "guild_sections": """SELECT (
+            SELECT json_group_object(k.value, json(info -> k.value)) FROM json_each(?2) AS k
+            WHERE info -> k.value IS NOT NULL
+        ) AS "info [json]" FROM guilddata WHERE UUID = ?1""",
+    "guild_set_sections": f"""UPDATE guilddata SET info = {_merge('info', 'json(?2)')}, version = version + 1
+        WHERE UUID = ?1
+        RETURNING version""",
+    "guild_merge_section": f"""UPDATE guilddata SET info = json_set(info, '$."' || ?2 || '"', json({_merge(
+        "CASE WHEN json_type(info -> ?2) = 'object' THEN info -> ?2 ELSE '{}' END", 'json(?3)'
+    )})), version = version + 1
+        WHERE UUID = ?1
+        RETURNING version""",
+    "guild_remove_entries": f"""UPDATE guilddata SET info = json_set(info, '$."' || ?2 || '"', json(COALESCE((
+            SELECT json_group_object(key, {_VALUE}) FROM json_each(info -> ?2)
+            WHERE key NOT IN (SELECT value FROM json_each(?3))
+        ), '{{}}'))), version = version + 1
+        WHERE UUID = ?1 AND json_type(info -> ?2) = 'object'
+        RETURNING version""",
+    "guild_salaries": """SELECT UUID, info -> 'salaries' AS "salaries [json]" FROM guilddata
+        WHERE info -> 'salaries' <> '{}'""",
+    "blobs_create": """CREATE TABLE IF NOT EXISTS guild_blobs (
+        guild_id integer NOT NULL,
+        name text NOT NULL,
+        data blob NOT NULL,
+        version integer NOT NULL DEFAULT 0,
+        PRIMARY KEY (guild_id, name)
+    )""",
+    "blob_select": """SELECT name, data FROM guild_blobs
+        WHERE guild_id = ?1 AND name IN (SELECT value FROM json_each(?2))""",
+    "blob_lock": "SELECT data FROM guild_blobs WHERE guild_id = ?1 AND name = ?2",
+    "blob_upsert": """INSERT INTO guild_blobs (guild_id, name, data) VALUES (?1, ?2, ?3)
+        ON CONFLICT (guild_id, name) DO UPDATE SET data = excluded.data, version = guild_blobs.version + 1
+        RETURNING version""",
+    "blob_insert": """INSERT INTO guild_blobs (guild_id, name, data) VALUES (?1, ?2, ?3)
+        ON CONFLICT (guild_id, name) DO NOTHING""",
+
+    # Schema statements, schema_version is part of guilddata from the start
+    "guilddata_schema": "SELECT 1",
+    "guild_schema": "SELECT schema_version FROM guilddata WHERE UUID = ?1",
+    "guild_migrate_select": "SELECT info, version, schema_version FROM guilddata WHERE UUID = ?1",
+    "guild_migrate": """UPDATE guilddata SET info = json(?2), version = version + 1, schema_version = ?4
+        WHERE UUID = ?1 AND version = ?3
+        RETURNING version""",
+    "guild_outdated": """SELECT UUID FROM guilddata WHERE schema_version < ?1 AND UUID > ?2
+        ORDER BY UUID LIMIT ?3""",
+
+    # Archive statements
+    "archive_create": """CREATE TABLE IF NOT EXISTS guild_archive (
+        guild_id integer PRIMARY KEY,
+        data blob NOT NULL,
+        reason text NOT NULL,
+        size integer NOT NULL,
+        archived text NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now'))
+    )""",
+    "archive_insert": """INSERT INTO guild_archive (guild_id, data, reason, size) VALUES (?1, ?2, ?3, ?4)
+        ON CONFLICT (guild_id) DO UPDATE SET data = excluded.data, reason = excluded.reason, size = excluded.size,
+            archived = strftime('%Y-%m-%d %H:%M:%f', 'now')""",
+    "archive_take": "DELETE FROM guild_archive WHERE guild_id = ?1 RETURNING data",
+    "archive_ids": "SELECT guild_id FROM guild_archive",
+    "archive_report": """SELECT guild_id, reason, size, archived FROM guild_archive
+        ORDER BY archived DESC LIMIT ?1""",
+    "archive_totals": "SELECT count(*), COALESCE(sum(size), 0) FROM guild_archive",
+    "archive_members": """SELECT UUID, info AS "info [json]" FROM memberdata WHERE guild_id = ?1""",
+    "archive_balances": "SELECT UUID, money, bank FROM balances WHERE guild_id = ?1",
+    "archive_listings": """SELECT id, item, user_id, cost, amount, created
+        FROM market_listings WHERE guild_id = ?1""",
+    "archive_characters": """SELECT name, owner, info AS "info [json]" FROM characters WHERE guild_id = ?1""",
+    "archive_aliases": "SELECT alias, name FROM character_aliases WHERE guild_id = ?1",
+    "archive_blobs": "SELECT name, data FROM guild_blobs WHERE guild_id = ?1",
+    "archive_delete": [
+        "DELETE FROM memberdata WHERE guild_id = ?1",
+        "DELETE FROM balances WHERE guild_id = ?1",
+        "DELETE FROM market_listings WHERE guild_id = ?1",
+        "DELETE FROM characters WHERE guild_id = ?1",
+        "DELETE FROM character_aliases WHERE guild_id = ?1",
+        "DELETE FROM guild_blobs WHERE guild_id = ?1",
+        "DELETE FROM guilddata WHERE UUID = ?1",
+    ],
+    "restore_guild": """INSERT INTO guilddata (UUID, info, version, schema_version) VALUES (?1, json(?2), ?3, 0)
+        ON CONFLICT (UUID) DO UPDATE SET info = excluded.info, version = max(guilddata.version, excluded.version) + 1,
+            schema_version = 0""",
+    "restore_balance": """INSERT INTO balances (guild_id, UUID, money, bank) VALUES (?1, ?2, ?3, ?4)
+        ON CONFLICT (guild_id, UUID) DO NOTHING""",
+    "restore_listing": """INSERT INTO market_listings (guild_id, id, item, user_id, cost, amount, created)
+        VALUES (?1, ?2, ?3, ?4, ?5, ?6, ?7)
+        ON CONFLICT (guild_id, id) DO NOTHING""",
+    "guild_touch": """UPDATE guilddata SET last_active = strftime('%Y-%m-%d %H:%M:%f', 'now')
+        WHERE UUID IN (SELECT value FROM json_each(?1))""",
+    "guild_inactive": """SELECT UUID FROM guilddata
+        WHERE last_active < strftime('%Y-%m-%d %H:%M:%f', 'now', '-' || ?1 || ' days')
+        ORDER BY last_active LIMIT ?2""",
+    "guild_ids": "SELECT UUID FROM guilddata",
+
+    # Transfer statements, a write transaction already holds the whole database
+    "transfer_lock_members": """SELECT UUID FROM memberdata
+        WHERE guild_id = ?1 AND UUID IN (SELECT value FROM json_each(?2))""",
+    "transfer_lock_balances": """SELECT UUID FROM balances
+        WHERE guild_id = ?1 AND UUID IN (SELECT value FROM json_each(?2))""",
+
+    # Write-behind statements
+    "pending_create": [
+        """CREATE TEMP TABLE IF NOT EXISTS pending_user_writes (
+            UUID integer NOT NULL,
+            guild_id integer NOT NULL,
+            money real NOT NULL,
+            bank real NOT NULL,
+            items text NOT NULL
+        )""",
+        "DELETE FROM pending_user_writes",
+    ],
+    "pending_adopt": """INSERT INTO memberdata (UUID, guild_id, info)
+        SELECT p.UUID, p.guild_id, COALESCE(u.info -> CAST(p.guild_id AS text), json(?1))
+        FROM pending_user_writes AS p
+        LEFT JOIN userdata AS u ON u.UUID = p.UUID AND json_type(u.info -> CAST(p.guild_id AS text)) = 'object'
+        WHERE TRUE
+        ON CONFLICT (UUID, guild_id) DO NOTHING""",
+    "pending_seed": """INSERT INTO balances (guild_id, UUID, money, bank)
+        SELECT m.guild_id, m.UUID, COALESCE(m.info ->> 'money', 0), COALESCE(m.info ->> 'bank', 0)
+        FROM pending_user_writes AS p JOIN memberdata AS m ON m.UUID = p.UUID AND m.guild_id = p.guild_id
+        WHERE p.money <> 0 OR p.bank <> 0
+        ON CONFLICT (guild_id, UUID) DO NOTHING""",
+    "pending_balances": """UPDATE balances SET money = balances.money + p.money, bank = balances.bank + p.bank
+        FROM pending_user_writes AS p
+        WHERE balances.UUID = p.UUID AND balances.guild_id = p.guild_id AND (p.money <> 0 OR p.bank <> 0)""",
+    "pending_items": f"""UPDATE memberdata
+        SET info = json_set(memberdata.info, '$.items', {_merge_items("memberdata.info", "p.items")})
+        FROM pending_user_writes AS p
+        WHERE memberdata.UUID = p.UUID AND memberdata.guild_id = p.guild_id AND p.items <> '{{}}'""",
+
+    # Timer statements
+    "timers_create": """CREATE TABLE IF NOT EXISTS timers (
+        id integer PRIMARY KEY AUTOINCREMENT,
+        due real NOT NULL,
+        kind text NOT NULL,
+        payload text NOT NULL
+    )""",
+    "timer_insert": "INSERT INTO timers (due, kind, payload) VALUES (?1, ?2, ?3) RETURNING id",
+    "timer_delete": "DELETE FROM timers WHERE id = ?1",
+    "timer_all": """SELECT id, due, kind, payload AS "payload [json]" FROM timers ORDER BY due""",
+
+    # Experience statements
+    "exp_create": [
+        """CREATE TEMP TABLE IF NOT EXISTS pending_exp (
+            UUID integer NOT NULL,
+            guild_id integer NOT NULL,
+            exp integer NOT NULL,
+            level integer
+        )""",
+        "DELETE FROM pending_exp",
+    ],
+    "exp_adopt": """INSERT INTO memberdata (UUID, guild_id, info)
+        SELECT p.UUID, p.guild_id, COALESCE(u.info -> CAST(p.guild_id AS text), json(?1))
+        FROM pending_exp AS p
+        LEFT JOIN userdata AS u ON u.UUID = p.UUID AND json_type(u.info -> CAST(p.guild_id AS text)) = 'object'
+        WHERE TRUE
+        ON CONFLICT (UUID, guild_id) DO NOTHING""",
+    "exp_select": """SELECT p.UUID AS uuid, p.guild_id, p.exp AS gain,
+            COALESCE(m.info ->> 'level', 0) AS level, COALESCE(m.info ->> 'exp', 0) AS exp
+        FROM pending_exp AS p JOIN memberdata AS m ON m.UUID = p.UUID AND m.guild_id = p.guild_id""",
+    "exp_clear": "DELETE FROM pending_exp",
+    "exp_apply": """UPDATE memberdata SET info = json_set(memberdata.info, '$.level', p.level, '$.exp', p.exp)
+        FROM pending_exp AS p
+        WHERE memberdata.UUID = p.UUID AND memberdata.guild_id = p.guild_id""",
+}
+
+for name, sql in STATEMENTS.items():
+    Query.registry[name].dialects["sqlite"] = sql
+
+sqlite3.register_converter("json", loads)
+
+
+def _param(value):
+    """Bind dicts, lists and tuples as JSON, and pre-encoded JSON as text.
+    Packed sections are bytearrays, and are bound as blobs"""
+    if isinstance(value, (dict, list, tuple)):
+        value = dumps(value)
+    if isinstance(value, bytes):
+        value = value.decode()
+    return value
+
+
+@lru_cache(maxsize=None)
+def _count(sql):
+    """The number of parameters a statement takes, the highest ?n it uses"""
+    return max(map(int, re.findall(r"\?(\d+)", sql)), default=0)
+
+
+class SQLiteTransaction:
+    def __init__(self, connection):
+        self.connection = connection
+        self.savepoint = None
+
+    async def start(self):
+        connection = self.connection
+        if connection.depth:
+            self.savepoint = f"transaction_{connection.depth}"
+            await connection.run(connection.raw.execute, f"SAVEPOINT {self.savepoint}")
+        else:
+            await connection.run(connection.raw.execute, "BEGIN IMMEDIATE")
+        connection.depth += 1
+
+    async def commit(self):
+        self.connection.depth -= 1
+        await self.connection.run(self.connection.raw.execute,
+                                  f"RELEASE {self.savepoint}" if self.savepoint else "COMMIT")
+
+    async def rollback(self):
+        self.connection.depth -= 1
+        if self.savepoint:
+            await self.connection.run(self.connection.raw.executescript,
+                                      f"ROLLBACK TO {self.savepoint}; RELEASE {self.savepoint}")
+        else:
+            await self.connection.run(self.connection.raw.execute, "ROLLBACK")
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            await self.commit()
+        else:
+            await self.rollback()
+
+
+class SQLiteConnection:
+    """A connection with the parts of asyncpg's interface the bot uses, its statements run on a thread pool"""
+    dialect = "sqlite"
+
+    def __init__(self, path, executor):
+        self.raw = sqlite3.connect(path, isolation_level=None, check_same_thread=False,
+                                   detect_types=sqlite3.PARSE_COLNAMES)
+        self.raw.row_factory = sqlite3.Row
+        self.raw.execute("PRAGMA busy_timeout = 10000")
+        if path != ":memory:":
+            self.raw.execute("PRAGMA journal_mode = WAL")
+        self.executor = executor
+        self.depth = 0
+
+    async def run(self, func, *args):
+        return await asyncio.get_event_loop().run_in_executor(self.executor, func, *args)
+
+    def _query(self, sql, argsets):
+        """Run a statement, or list of statements as one, for each set of arguments"""
+        statements = [sql] if isinstance(sql, str) else sql
+        grouped = len(statements) > 1 or len(argsets) > 1
+        if grouped:
+            self.raw.execute("SAVEPOINT statement")
+        try:
+            result = None
+            for args in argsets:
+                args = [_param(x) for x in args]
+                for statement in statements:
+                    cursor = self.raw.execute(statement, args[:_count(statement)])
+                    rows = cursor.fetchall()
+                    if result is None and cursor.description is not None:
+                        result = rows
+        except BaseException:
+            if grouped:
+                self.raw.executescript("ROLLBACK TO statement; RELEASE statement")
+            raise
+        if grouped:
+            self.raw.execute("RELEASE statement")
+        return result or []
+
+    async def execute(self, sql, *args):
+        await self.run(self._query, sql, [args])
+
+    async def executemany(self, sql, args):
+        args = list(args)
+        if args:
+            await self.run(self._query, sql, args)
+
+    async def fetch(self, sql, *args):
+        return await self.run(self._query, sql, [args])
+
+    async def fetchrow(self, sql, *args):
+        rows = await self.fetch(sql, *args)
+        return rows[0] if rows else None
+
+    async def fetchval(self, sql, *args):
+        row = await self.fetchrow(sql, *args)
+        return row[0] if row else None
+
+    async def copy_records_to_table(self, table, records, columns=None):
+        records = list(records)
+        if not records:
+            return
+        width = len(records[0])
+        names = f" ({', '.join(columns)})" if columns else ""
+        sql = f"INSERT INTO {table}{names} VALUES ({', '.join(f'?{i + 1}' for i in range(width))})"
+        await self.run(self._query, sql, records)
+
+    def transaction(self):
+        return SQLiteTransaction(self)
+
+    def close(self):
+        self.raw.close()
+
+
+class _Acquire:
+    def __init__(self, pool):
+        self.pool = pool
+        self.connection = None
+
+    def __await__(self):
+        return self.pool._get().__await__()
+
+    async def __aenter__(self):
+        self.connection = await self.pool._get()
+        return self.connection
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.pool.release(self.connection)
+
+
+class SQLitePool:
+    """A fixed set of SQLite connections handed out like an asyncpg pool"""
+
+    def __init__(self, path, size):
+        self.executor = ThreadPoolExecutor(max_workers=size)
+        self.connections = [SQLiteConnection(path, self.executor) for _ in range(size)]
+        self.idle = asyncio.Queue()
+        for connection in self.connections:
+            self.idle.put_nowait(connection)
+
+    async def _get(self):
+        return await self.idle.get()
+
+    def acquire(self):
+        return _Acquire(self)
+
+    async def release(self, connection):
+        if connection.depth:
+            # Left in a transaction by a cancelled holder
+            await connection.run(connection.raw.execute, "ROLLBACK")
+            connection.depth = 0
+        self.idle.put_nowait(connection)
+
+    async def close(self):
+        for connection in self.connections:
+            connection.close()
+        self.executor.shutdown()
+
+
+class SQLiteBackend:
+    """Runs the SQLite form of each statement on a database file.
+    An in-memory database is private to one connection, so it is always given a pool of one"""
+    dialect = "sqlite"
+
+    def __init__(self, path="savedata/pokerpg.sqlite3", max_size=4):
+        self.path = path
+        self.max_size = 1 if path == ":memory:" else max_size
+
+    async def connect(self):
+        """Create the pool, which hands out connections with `acquire()`"""
+        return SQLitePool(self.path, self.max_size)
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+# Copyright (c) 2016-2017, henry232323
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.  IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+
+import asyncio
+import tempfile
+from collections import defaultdict
+from io import BytesIO
+
+import discord
+
+
+class WebhookPool:
+    """One bot owned webhook per channel, shared by every character proxied there.
+    The name and icon are sent as overrides with each message"""
+
+    name = "RPGBot"
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.hooks = {}
+        self.locks = defaultdict(asyncio.Lock)
+
+    def invalidate(self, channel_id):
+        self.hooks.pop(channel_id, None)
+
+    async def get(self, channel):
+        """The pooled webhook for `channel`, creating it if there isn't one yet"""
+        hook = self.hooks.get(channel.id)
+        if hook is not None:
+            return hook
+
+        async with self.locks[channel.id]:
+            hook = self.hooks.get(channel.id)
+            if hook is None:
+                hook = await self._fetch(channel)
+                self.hooks[channel.id] = hook
+        return hook
+
+    async def _fetch(self, channel):
+        hook = None
+        for existing in await channel.webhooks():
+            if existing.user is None or existing.user.id != self.bot.user.id:
+                continue
+            if existing.name == self.name and hook is None:
+                hook = existing
+            else:
+                # Characters used to get a webhook each, free up the slots they take
+                try:
+                    await existing.delete()
+                except discord.HTTPException:
+                    pass
+
+        if hook is None:
+            hook = await channel.create_webhook(name=self.name)
+        return hook
+
+    async def send(self, channel, content=None, *, username, avatar_url=None, files=None, embeds=None):
+        """Send as `username` through the channel's pooled webhook"""
+        hook = await self.get(channel)
+        try:
+            return await hook.send(content, username=username, avatar_url=avatar_url, files=files, embeds=embeds)
+        except discord.NotFound:
+            # Deleted since it was cached and the update hasn't reached us yet
+            self.invalidate(channel.id)
+            hook = await self.get(channel)
+            for file in files or ():
+                file.reset()
+            return await hook.send(content, username=username, avatar_url=avatar_url, files=files, embeds=embeds)
+
+
+class AttachmentRelay:
+    """Downloads a message's attachments concurrently for re-upload. Small ones are kept in memory,
+    anything over `spool_size` bytes is streamed to a temporary file"""
+
+    chunk_size = 64 * 1024
+
+    def __init__(self, session, spool_size=1024 * 1024, max_total=8 * 1024 * 1024):
+        self.session = session
+        self.spool_size = spool_size
+        self.max_total = max_total
+
+    async def fetch(self, attachments, limit=None):
+        """discord.Files for `attachments`, or None if together they are over the byte limit"""
+        limit = min(self.max_total, limit or self.max_total)
+        if sum(attachment.size for attachment in attachments) > limit:
+            return None
+
+        results = await asyncio.gather(*map(self._download, attachments), return_exceptions=True)
+        errors = [result for result in results if isinstance(result, BaseException)]
+        if errors:
+            for result in results:
+                if not isinstance(result, BaseException):
+                    result.close()
+            raise errors[0]
+
+        return [discord.File(fp, attachment.filename, spoiler=attachment.is_spoiler())
+                for fp, attachment in zip(results, attachments)]
+
+    @staticmethod
+    def close(files):
+        """Close the files fetch returned, whether or not they were sent"""
+        for file in files:
+            # discord.File stubs out its file's close until its own close is called
+            file.close()
+            file.fp.close()
+
+    async def _download(self, attachment):
+        fp = BytesIO() if attachment.size <= self.spool_size else tempfile.TemporaryFile()
+        try:
+            async with self.session.get(attachment.url) as resp:
+                resp.raise_for_status()
+                async for chunk in resp.content.iter_chunked(self.chunk_size):
+                    fp.write(chunk)
+        except BaseException:
+            fp.close()
+            raise
+        fp.seek(0)
+        return fp
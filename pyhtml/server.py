@@ -19,6 +19,15 @@ try:
 except ImportError:
     import json
 
+from cogs.utils.db import Query
+
+bot_select = Query("api_bot_select", """SELECT * FROM botdata WHERE UUID = $1""")
+bot_name = Query("api_bot_name", """SELECT name FROM botdata WHERE id = $1""")
+bot_url = Query("api_bot_url", """SELECT url FROM botdata WHERE name = $1""")
+token_user_select = Query("api_user_by_id", """SELECT * FROM userdata WHERE user_id = $1""")
+token_user_insert = Query("api_user_insert", """INSERT INTO userdata VALUES ($1, ARRAY[]::bigint[], $2, 0)""")
+token_select = Query("api_user_by_token", """SELECT * FROM userdata WHERE token = $1""")
+
 example_post = {
     "bot_id": 305177429612298242,
     "to_bot": "Tatsumaki",
@@ -110,27 +119,15 @@ class API(web.Application):
 
     async def get_botdata(self, snowflake: int):
         async with self.pool.acquire() as connection:
-            response = await connection.fetch(
-                f"""SELECT * FROM botdata WHERE UUID = $1""", snowflake
-            )
+            response = await bot_select.fetch(connection, snowflake)
 
         return response
 
     async def get_userdata(self, snowflake: int):
-        async with self.pool.acquire() as connection:
-            response = await connection.fetchval(
-                f"""SELECT info FROM userdata WHERE UUID= $1""", snowflake
-            )
-
-        return json.loads(response)
+        return await self.bot.db.get_all_user_data(discord.Object(int(snowflake)))
 
     async def get_serverdata(self, snowflake: int):
-        async with self.pool.acquire() as connection:
-            response = await connection.fetchval(
-                f"""SELECT info FROM guilddata WHERE UUID = $1""", snowflake
-            )
-
-        return json.loads(response)
+        return await self.bot.db.get_full_guild_data(discord.Object(int(snowflake)))
 
     async def code(self, request: web.Request):
         if 'code' not in request.query:
@@ -232,19 +229,13 @@ class API(web.Application):
         fmap = map(lambda x: f"<li>{x[0]} x{x[1]}</li>", sorted(user_data["items"].items()))
         inventory = "\n".join(fmap)
 
-        req = f"""SELECT (UUID, info->'{guild_id}'->>'money') FROM userdata;"""
-        async with self.pool.acquire() as connection:
-            resp = await connection.fetch(req)
-
-        users = [(discord.utils.get(await guild.fetch_members(None).flatten(), id=int(x["row"][0])), x["row"][1]) for x in resp if
-                 (len(x["row"]) == 2) and (x["row"][1] is not None)]
-        users = [x for x in users if x[0]]
-        users.sort(key=lambda x: -float(x[1]))
+        members = {x.id: x for x in await guild.fetch_members(None).flatten()}
+        users = await self.bot.di.get_baltop(guild, 11, members.get)
 
         currency = await self.bot.di.get_currency(guild)
         baltop = "\n".join(f"<li> {y[0]} {y[1]} {currency}</li>" for y in users[:11])
         characters = "\n".join(
-            f"<li>{name}</li>" for name, obj in guild_data["characters"].items() if obj[2] == str(medata["id"]))
+            f"<li>{name}</li>" for name in await self.bot.di.get_guild_characters(guild, owner=int(medata["id"])))
 
         hubbutton = """
                 <button>
@@ -291,9 +282,7 @@ class API(web.Application):
             return web.StreamResponse(reason=js["message"], status=js["code"])
 
         async with self.pool.acquire() as connection:
-            exists = await connection.fetch(
-                f"""SELECT * FROM userdata WHERE user_id = {js['id']};"""
-            )
+            exists = await token_user_select.fetch(connection, int(js['id']))
 
             if exists:
                 logging.info(f"Received request to view user info for {js['id']}")
@@ -305,14 +294,7 @@ class API(web.Application):
                 logging.info(f"Creating new database entry for user {js['id']}")
                 token = secrets.token_urlsafe(48)
 
-                await connection.fetch(
-                    f"""INSERT INTO userdata VALUES (
-                        {js["id"]},
-                        ARRAY[]::bigint[],
-                        '{token}',
-                        0
-                    );"""
-                )
+                await token_user_insert.execute(connection, int(js["id"]), token)
 
                 js = {
                     "user_id": js["id"],
@@ -327,11 +309,9 @@ class API(web.Application):
         guild = int(request.match_info['guild'])
         user = int(request.match_info['user'])
 
-        req = f"""SELECT info FROM userdata WHERE UUID = {user}"""
-        async with self.bot.db._conn.acquire() as connection:
-            response = await connection.fetchval(req)
+        response = await self.bot.db.get_all_user_data(discord.Object(user))
         if response:
-            data = json.loads(response)[str(int(guild))]
+            data = response[str(int(guild))]
 
             fdata = data
             for item in request.match_info['tail'].split("/"):
@@ -352,11 +332,9 @@ class API(web.Application):
     # @server.route("/guild/<int:guild>/", methods=["GET"])
     async def getguild(self, request: web.Request):
         guild = int(request.match_info['guild'])
-        req = f"""SELECT info FROM guilddata WHERE UUID = $1"""
-        async with self.bot.db._conn.acquire() as connection:
-            response = await connection.fetchval(req, guild)
+        response = await self.bot.db.get_full_guild_data(discord.Object(guild))
         if response:
-            data = json.loads(response)
+            data = response
 
             fdata = data
             if request.match_info['tail']:
@@ -414,9 +392,8 @@ class API(web.Application):
 
                 token = request.headers["Authorization"]  # The user token
                 snowflake = int(snowflake)  # The bot snowflake
-                req = f"""SELECT * FROM userdata WHERE token = '{token.replace("'", "''")}';"""
                 async with self.pool.acquire() as connection:
-                    response = await connection.fetch(req)  # Get bots and webhook / gather type
+                    response = await token_select.fetch(connection, token)  # Get bots and webhook / gather type
                 if response:
                     bots, type = response[0]["bots"], response[0]["type"]
                     if snowflake not in bots:  # That bot is not associated with that token
@@ -425,12 +402,8 @@ class API(web.Application):
                     formdata = await request.post()
 
                     async with self.pool.acquire() as connection:
-                        name = await connection.fetchval(
-                            f"""SELECT name FROM botdata WHERE id = {snowflake};"""
-                        )  # Get the bot's name
-                        url = await connection.fetchval(
-                            f"""SELECT url FROM botdata WHERE name = '{formdata["to_bot"].replace("'", "''")}';"""
-                        )  # Get the URL of the bot we're sending to
+                        name = await bot_name.fetchval(connection, snowflake)  # Get the bot's name
+                        url = await bot_url.fetchval(connection, formdata["to_bot"])  # Get the URL of the bot we're sending to
                     if url is None:  # That bot is not in our database!
                         raise web.HTTPBadRequest(reason="That is an invalid bot!")
 
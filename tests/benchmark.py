@@ -0,0 +1,71 @@
+# Copyright (c) 2016-2017, henry232323
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.  IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+
+"""Time DataInteraction's common operations against an embedded SQLite database, or Postgres if
+$RPGBOT_TEST_POSTGRES is set and it is named, whose database is emptied first.
+Usage: python3 -m tests.benchmark [members] [rounds] [sqlite|postgres] [sqlite path]"""
+
+import sys
+import time
+import random
+import asyncio
+
+from cogs.utils.data import DataInteraction
+
+from .support import Guild, Member, connect
+
+
+async def bench(name, rounds, func):
+    start = time.perf_counter()
+    for i in range(rounds):
+        await func(i)
+    elapsed = time.perf_counter() - start
+    print(f"{name:<14}{rounds / elapsed:>10.0f} ops/s {elapsed / rounds * 1000:>8.3f} ms/op")
+
+
+async def main(members, rounds, backend, path):
+    db = await connect(backend, path)
+    db.bot.db = db
+    di = DataInteraction(db.bot)
+    guild = Guild(1)
+    people = [Member(i, guild) for i in range(1, members + 1)]
+    for member in people:
+        await db.add_user(member, dict(db.bot.default_udata, money=10 ** 6))
+    pick = random.Random(0).choice
+
+    await bench("add_eco", rounds, lambda i: di.add_eco(pick(people), 1))
+    await bench("give_items", rounds, lambda i: di.give_items(pick(people), ("apple", 1)))
+    await bench("take_items", rounds, lambda i: di.take_items_override(pick(people), ("apple", 1)))
+    await bench("get_balance", rounds, lambda i: di.get_balance(pick(people)))
+    await bench("get_inventory", rounds, lambda i: di.get_inventory(pick(people)))
+    await bench("transfer", rounds, lambda i: di.transfer(guild, money=[(pick(people), pick(people), 1)]))
+    await bench("get_baltop", rounds, lambda i: di.get_baltop(guild))
+    await bench("get_currency", rounds, lambda i: di.get_currency(guild))
+    await db.flush()
+    await db._conn.close()
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    asyncio.get_event_loop().run_until_complete(main(int(args[0]) if len(args) > 0 else 100,
+                                                     int(args[1]) if len(args) > 1 else 1000,
+                                                     args[2] if len(args) > 2 else "sqlite",
+                                                     args[3] if len(args) > 3 else ":memory:"))
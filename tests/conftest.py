@@ -0,0 +1,57 @@
+# Copyright (c) 2016-2017, henry232323
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.  IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+
+"""Every test taking `db` runs once per storage backend, against a fresh, empty database.
+SQLite always runs, in memory. Postgres runs when $RPGBOT_TEST_POSTGRES holds the options
+to reach a scratch database, such as {"database": "pokerpg_test"}.
+Coroutine tests are run on the same event loop as the database they're given"""
+
+import asyncio
+
+import pytest
+
+from .support import connect, postgres_options
+
+
+@pytest.fixture
+def loop():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    yield loop
+    loop.close()
+    asyncio.set_event_loop(None)
+
+
+@pytest.fixture(params=["sqlite", "postgres"])
+def db(request, loop):
+    if request.param == "postgres" and postgres_options() is None:
+        pytest.skip("RPGBOT_TEST_POSTGRES is not set")
+    db = loop.run_until_complete(connect(request.param))
+    yield db
+    loop.run_until_complete(db.flush())
+    loop.run_until_complete(db._conn.close())
+
+
+def pytest_pyfunc_call(pyfuncitem):
+    if asyncio.iscoroutinefunction(pyfuncitem.obj):
+        args = {name: pyfuncitem.funcargs[name] for name in pyfuncitem._fixtureinfo.argnames}
+        pyfuncitem.funcargs["loop"].run_until_complete(pyfuncitem.obj(**args))
+        return True
@@ -0,0 +1,110 @@
+# Copyright (c) 2016-2017, henry232323
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.  IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+
+"""Stand-ins for the parts of the bot and discord the database uses, for the tests and the benchmark"""
+
+import os
+import random
+
+import ujson as json
+
+from cogs.utils.db import Database, PostgresBackend
+from cogs.utils.sqlite import SQLiteBackend
+from cogs.utils.data import default_user, default_server
+
+# Every table the bot keeps, emptied between tests on a shared Postgres database
+TABLES = ("userdata", "memberdata", "balances", "market_listings", "characters", "character_aliases",
+          "guilddata", "guild_blobs", "guild_archive", "timers")
+
+
+class Stats:
+    def gauge(self, *args, **kwargs):
+        pass
+
+    def histogram(self, *args, **kwargs):
+        pass
+
+
+class Bot:
+    """Just enough of RPGBot for the database layer"""
+    default_udata = default_user
+    default_servdata = default_server
+
+    def __init__(self):
+        self.stats = Stats()
+        self.guilds = []
+        self.events = []
+
+    def get_guild(self, id):
+        return None
+
+    def dispatch(self, event, *args):
+        self.events.append((event, *args))
+
+    @staticmethod
+    def get_exp(level):
+        return int(0.1 * level ** 2 + 5 * level + 4)
+
+    def randsample(self):
+        return "".join(random.sample("1234567890ABCDEFGHIJKLMNOPQRSTUVWXYZ", 6))
+
+
+class Guild:
+    def __init__(self, id):
+        self.id = id
+        self.members = []
+
+    def get_member(self, id):
+        return next((x for x in self.members if x.id == id), None)
+
+
+class Member:
+    def __init__(self, id, guild):
+        self.id = id
+        self.guild = guild
+        guild.members.append(self)
+
+
+def postgres_options():
+    """The PostgresBackend options in $RPGBOT_TEST_POSTGRES (a JSON object), None if it isn't set.
+    Its database is emptied, so never point it at the bot's own"""
+    options = os.environ.get("RPGBOT_TEST_POSTGRES")
+    return json.loads(options) if options else None
+
+
+def make_backend(name, path=":memory:"):
+    if name == "sqlite":
+        return SQLiteBackend(path)
+    return PostgresBackend(**postgres_options())
+
+
+async def connect(name, path=":memory:", **options):
+    """A connected Database on an empty `name` backend"""
+    db = Database(Bot(), backend=make_backend(name, path), **options)
+    if name == "postgres":
+        # Tables from before the bot kept its own, which it expects to find
+        async with (await db.backend.connect()) as pool:
+            await pool.execute("CREATE TABLE IF NOT EXISTS userdata (UUID bigint PRIMARY KEY, info jsonb NOT NULL)")
+            await pool.execute("CREATE TABLE IF NOT EXISTS guilddata (UUID bigint PRIMARY KEY, info jsonb NOT NULL)")
+    await db.connect()
+    if name == "postgres":
+        await db._conn.execute(f"TRUNCATE {', '.join(TABLES)}")
+    return db
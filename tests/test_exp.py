@@ -0,0 +1,41 @@
+# Copyright (c) 2016-2017, henry232323
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.  IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+
+from .support import Guild, Member
+
+
+async def test_exp_flush(db):
+    guild = Guild(1)
+    member, newcomer = Member(10, guild), Member(11, guild)
+    await db.add_user(member)
+    await db.user_set(member, level=1, exp=8)
+    for i in range(3):
+        db.exp.add(member, 1, f"msg{i}")
+    db.exp.add(newcomer, 2)
+    assert len(db.exp) == 2
+
+    await db.flush()
+    assert len(db.exp) == 0
+    data = await db.get_user_data(member)
+    assert (data["level"], data["exp"]) == (2, 2)
+    assert (await db.get_user_data(newcomer))["exp"] == 2
+    # Levelling up is announced under the last message that counted
+    assert db.bot.events == [("level_up", "msg2", 2)]
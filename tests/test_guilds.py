@@ -0,0 +1,102 @@
+# Copyright (c) 2016-2017, henry232323
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.  IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+
+from .support import Guild, Member
+
+
+async def test_sections(db):
+    guild = Guild(1)
+    assert await db.get_section(guild, "currency", "dollars") == "dollars"
+    await db.set_section(guild, "currency", "E")
+    await db.update_section(guild, "items", {"a": [1], "b\"q": [2]})
+    await db.update_section(guild, "items", {"c": 3})
+    await db.remove_section_entries(guild, "items", "a", "zz")
+    db.cache.invalidate(guild.id)
+    assert await db.get_sections(guild, ["items", "currency", "start", "nope"]) == {
+        "items": {"b\"q": [2], "c": 3}, "currency": "E", "start": 0, "nope": None,
+    }
+
+
+async def test_cold_sections(db):
+    guild = Guild(1)
+    await db.set_section(guild, "start", 5)
+    await db.set_section(guild, "maps", {"m": [1]})
+    assert await db.get_section(guild, "maps") == {"m": [1]}
+    assert "maps" not in await db.get_guild_data(guild)
+    full = await db.get_full_guild_data(guild)
+    assert (full["start"], full["maps"]) == (5, {"m": [1]})
+
+
+async def test_modify_guild_data(db):
+    guild = Guild(1)
+    assert await db.modify_guild_data(guild, lambda data: data.update(start=5) or "ok") == "ok"
+    data, version = await db.load_guild_version(guild)
+    assert data["start"] == 5
+    await db.modify_guild_data(guild, lambda data: data.update(salaries={"1": 5}))
+    assert (await db.load_guild_version(guild))[1] > version
+    assert await db.get_all_salaries() == [(1, {"1": 5})]
+
+
+async def test_characters(db):
+    guild = Guild(1)
+    await db.put_character(guild, ["Ash", 10, "desc", 1, [], {}])
+    assert await db.character_team_add(guild, "Ash", 3)
+    assert await db.character_team_add(guild, "Ash", 4)
+    assert await db.character_team_remove(guild, "Ash", 3)
+    assert await db.set_character_pos(guild, "Ash", "map1", [1, 2])
+    assert not await db.set_character_pos(guild, "Misty", "map1", [1, 2])
+    await db.add_alias(guild, "A", "Ash")
+    ash = ["Ash", 10, "desc", 1, [4], {"maps": {"map1": [1, 2]}}]
+    assert await db.get_character(guild, "A") == ash
+    assert await db.get_characters(guild, owner=10) == [ash]
+    assert await db.get_character_names(guild) == ["Ash"]
+    assert await db.count_characters(guild) == 1
+    assert await db.character_name_taken(guild, "A")
+
+    await db.remove_alias(guild, "A")
+    assert await db.get_character(guild, "A") is None
+    await db.delete_character(guild, "Ash")
+    assert await db.count_characters(guild) == 0
+
+
+async def test_archive_and_restore(db):
+    guild = Guild(5)
+    member = Member(10, guild)
+    await db.set_section(guild, "currency", "E")
+    await db.set_section(guild, "maps", {"m": [1]})
+    await db.balance_add(member, 50)
+    await db.user_give_items(member, {"x": 2})
+    await db.add_listing(guild, "L1", "x", 10, 3, 1)
+    await db.put_character(guild, ["Ash", 10, "d", 1, [], {}])
+    await db.add_alias(guild, "A", "Ash")
+    user = await db.get_user_data(member)
+
+    assert await db.archive_guild(guild.id, "left") > 0
+    assert guild.id in db.archived
+    assert await db.stored_guilds() == []
+    assert await db.get_archive_report()
+
+    await db.touch(guild)
+    assert guild.id not in db.archived
+    assert await db.get_sections(guild, ["currency", "maps"]) == {"currency": "E", "maps": {"m": [1]}}
+    assert await db.get_user_data(member) == user
+    assert [x["id"] for x in await db.get_listings(guild)] == ["L1"]
+    assert await db.get_character(guild, "A") == ["Ash", 10, "d", 1, [], {}]
@@ -0,0 +1,48 @@
+# Copyright (c) 2016-2017, henry232323
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.  IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+
+import pytest
+
+from cogs.utils.data import ResourceManager
+
+from .support import Bot
+
+
+class FailingLocks:
+    """A lock backend whose connection breaks on release"""
+
+    async def acquire(self, resources):
+        return list(resources)
+
+    async def release(self, keys):
+        raise ConnectionError("lost the lock connection")
+
+
+async def test_release_frees_local_locks_when_backend_fails(loop):
+    rm = ResourceManager(Bot(), timeout=1, backend=FailingLocks())
+    with pytest.raises(ConnectionError):
+        async with rm.lock(("guild", 1), ("user", 10)):
+            pass
+    assert rm.locks == {}
+
+    rm.backend = None
+    async with rm.lock(("guild", 1), ("user", 10)):
+        assert len(rm.locks) == 2
@@ -0,0 +1,84 @@
+# Copyright (c) 2016-2017, henry232323
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.  IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+
+from .support import Guild, Member
+
+
+async def test_listings(db):
+    guild = Guild(1)
+    assert await db.add_listing(guild, "A1", "apple", 10, 2, 3)
+    assert not await db.add_listing(guild, "A1", "pear", 11, 1, 1)
+    await db.add_listing(guild, "A2", "apple", 11, 1, 1)
+    listing = {"id": "A1", "item": "apple", "user": 10, "cost": 2, "amount": 3}
+    assert await db.get_listing(guild, "A1") == listing
+    assert [x["id"] for x in await db.get_listings(guild, item="apple")] == ["A2", "A1"]
+    assert await db.get_listings(guild, user=10) == [listing]
+    assert await db.pop_listing(guild, "A1", 11) is None
+    assert await db.pop_listing(guild, "A1", 10) == listing
+    assert await db.get_listing(guild, "A1") is None
+
+
+async def test_transfer(db):
+    guild = Guild(1)
+    payer, payee = Member(10, guild), Member(11, guild)
+    await db.balance_add(payer, 20)
+    await db.user_give_items(payee, {"apple": 2})
+    await db.user_modify(payee, ("box",), lambda current: dict(box=[[0, "pika", "rat", {}, {}]]))
+
+    result = await db.transfer(guild, money=[(10, 11, 5)], items=[(11, 10, "apple", 1)], pets=[(11, 10, 0)])
+    assert result.ok
+    assert result.balances == {10: (15, 0), 11: (5, 0)}
+    assert result.items == {10: {"apple": 1}, 11: {"apple": 1}}
+    assert [x[0] for x in (await db.get_user_data(payer))["box"]] == [0]
+    assert (await db.get_user_data(payee))["box"] == []
+
+
+async def test_failed_transfer_changes_nothing(db):
+    guild = Guild(1)
+    payer, payee = Member(10, guild), Member(11, guild)
+    await db.balance_add(payer, 20)
+    await db.user_give_items(payee, {"apple": 2})
+
+    result = await db.transfer(guild, money=[(10, 11, 5)], items=[(11, 10, "apple", 3)])
+    assert (result.ok, result.reason, result.user) == (False, "items", 11)
+    result = await db.transfer(guild, money=[(10, 11, 500)])
+    assert (result.ok, result.reason, result.user) == (False, "money", 10)
+    assert await db.get_balances(payer) == (20, 0)
+    assert await db.get_balances(payee) == (0, 0)
+    assert await db.user_item(payee, "items") == {"apple": 2}
+
+
+async def test_buy_listing(db):
+    guild = Guild(1)
+    seller, buyer = Member(10, guild), Member(11, guild)
+    await db.balance_add(buyer, 10)
+    await db.add_listing(guild, "A1", "apple", 10, 2, 3)
+
+    result = await db.transfer(guild, listing="A1", buyer=11)
+    assert result.ok
+    assert result.listing["id"] == "A1"
+    assert await db.get_balances(seller) == (2, 0)
+    assert await db.get_balances(buyer) == (8, 0)
+    assert await db.user_item(buyer, "items") == {"apple": 3}
+    assert await db.get_listing(guild, "A1") is None
+
+    result = await db.transfer(guild, listing="A1", buyer=11)
+    assert (result.ok, result.reason) == (False, "listing")
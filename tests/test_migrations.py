@@ -0,0 +1,48 @@
+# Copyright (c) 2016-2017, henry232323
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.  IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+
+from cogs.utils import migrations
+from cogs.utils.db import dumps, guild_insert, guild_update
+
+from .support import Guild
+
+LEGACY = {"start": 0, "market_items": {"apple": [{"cost": 2, "amount": 3}, {"cost": 5, "amount": 1}]}}
+
+
+async def test_market_migration_runs_again_without_duplicates(db, monkeypatch):
+    guild = Guild(1)
+    await db.execute(guild_insert, guild.id, dumps(LEGACY), 0)
+    market_table = migrations.MIGRATIONS[1]
+    runs = []
+
+    async def racing(db, guild, data):
+        await market_table(db, guild, data)
+        runs.append(1)
+        if len(runs) == 1:
+            # Written to in the meantime, so the migrations start over
+            await db.fetchval(guild_update, guild.id, dumps(LEGACY))
+
+    monkeypatch.setitem(migrations.MIGRATIONS, 1, racing)
+    await db.migrate_guild(guild)
+    await db.migrate_guild(guild)
+    assert len(runs) == 2
+    listings = await db.get_listings(guild, item="apple")
+    assert [(x["cost"], x["amount"]) for x in listings] == [(2, 3), (5, 1)]
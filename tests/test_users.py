@@ -0,0 +1,104 @@
+# Copyright (c) 2016-2017, henry232323
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.  IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+
+from .support import Guild, Member
+
+
+async def test_add_user(db):
+    member = Member(10, Guild(1))
+    assert await db.add_user(member)
+    assert not await db.add_user(member)
+    assert await db.get_user_data(member) == dict(db.bot.default_udata, bank=0)
+
+
+async def test_users_are_kept_per_server(db):
+    first, second = Member(10, Guild(1)), Member(10, Guild(2))
+    await db.add_user(first)
+    await db.add_user(second)
+    await db.balance_incr(first, 25)
+    assert await db.get_balances(first) == (25, 0)
+    assert await db.get_balances(second) == (0, 0)
+
+
+async def test_balance_incr_floor(db):
+    member = Member(10, Guild(1))
+    await db.add_user(member)
+    assert await db.balance_incr(member, 100) == (100, 0)
+    assert await db.balance_incr(member, -500, floor=0) is None
+    assert await db.balance_incr(member, -40, floor=0) == (60, 0)
+    assert await db.get_balances(member) == (60, 0)
+
+
+async def test_balance_add_creates_user(db):
+    member = Member(10, Guild(1))
+    assert await db.balance_add(member, 5) == (5, 0)
+    assert (await db.get_user_data(member))["money"] == 5
+
+
+async def test_balance_take_draws_on_bank(db):
+    member = Member(10, Guild(1))
+    await db.add_user(member)
+    assert await db.set_balances(member, 20, 30) == (20, 30)
+    assert await db.balance_take(member, 100) is None
+    # As it always has, the money goes negative by what the bank covered
+    assert await db.balance_take(member, 40) == (-20, 10)
+
+
+async def test_guild_balances(db):
+    guild = Guild(1)
+    rich, poor = Member(10, guild), Member(11, guild)
+    await db.balance_add(rich, 20)
+    await db.balance_add(poor, 5)
+    assert await db.get_guild_balances(guild, 10) == [(10, 20), (11, 5)]
+    assert await db.get_guild_balances(guild, 1, 1) == [(11, 5)]
+
+
+async def test_items(db):
+    member = Member(10, Guild(1))
+    assert await db.user_give_items(member, {"apple": 3}) == {"apple": 3}
+    assert await db.user_update_items(member, {"apple": -1}, strict=True) == {"apple": 2}
+    assert await db.user_update_items(member, {"apple": -5}, strict=True) is None
+    assert await db.user_item(member, "items") == {"apple": 2}
+    assert await db.user_update_items(member, {"apple": -5, "pear": 1}) == {"pear": 1}
+
+
+async def test_partial_updates(db):
+    member = Member(10, Guild(1))
+    await db.add_user(member)
+    await db.user_set(member, guild="g1", level=2)
+    assert await db.user_incr(member, "exp", 7) == 7
+    assert await db.user_item(member, "guild") == "g1"
+
+    def catch(current):
+        return dict(box=current["box"] + [[0, "pika", "rat", {}, {}]], level=current["level"] + 1)
+
+    assert await db.user_modify(member, ("box", "level"), catch) == {"box": [[0, "pika", "rat", {}, {}]], "level": 3}
+    data = await db.get_user_data(member)
+    assert (data["level"], data["exp"], len(data["box"])) == (3, 7, 1)
+
+
+async def test_update_user_data(db):
+    member = Member(10, Guild(1))
+    await db.add_user(member)
+    await db.update_user_data(member, dict(db.bot.default_udata, items={"x": 1}, money=7))
+    assert await db.get_balances(member) == (7, 0)
+    assert (await db.get_user_data(member))["items"] == {"x": 1}
+    assert await db.get_all_user_data(member) == {"1": await db.get_user_data(member)}